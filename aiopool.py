@@ -0,0 +1,430 @@
+from __future__ import annotations
+from typing import Optional, Collection, Callable, AsyncIterator, Union
+import asyncio
+import random
+import socket
+import ssl
+from time import monotonic, perf_counter
+from pool import ProxyPool, Proxy, PROXY_PROTOCOLS, empty_callback, hostport, auth
+from netutils import generate_headers
+from probe import PROXY_TLS_CONTEXT, PROBE_ORDER
+from measure import Timings
+from handshake import (
+    HandshakeError, is_ipv4, url_endpoint,
+    socks4_request, parse_socks4_reply, SOCKS4_REPLY_SIZE,
+    socks5_greeting, parse_socks5_method, socks5_auth_request, parse_socks5_auth_reply,
+    socks5_connect_request, parse_socks5_reply, socks5_reply_address_size, SOCKS5_REPLY_HEADER_SIZE,
+    SOCKS5_NO_AUTH, SOCKS5_USER_PASS,
+    http_connect_request, http_get_request, parse_http_status,
+)
+
+
+TLS_CONTEXT = ssl.create_default_context()
+
+
+async def _resolve(host: str) -> str:
+    # socks4 and socks5 (unlike socks4a and socks5h) expect the client to resolve the destination host
+    if is_ipv4(host):
+        return host
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+    return infos[0][4][0]
+
+
+async def _socks4_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                            proxy: Proxy, host: str, port: int, remote_dns: bool) -> bool:
+    if not remote_dns:
+        host = await _resolve(host)
+    username = proxy.auth[0] if proxy.auth else None
+    writer.write(socks4_request(host, port, username, remote_dns))
+    await writer.drain()
+    return parse_socks4_reply(await reader.readexactly(SOCKS4_REPLY_SIZE))
+
+
+async def _socks5_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                            proxy: Proxy, host: str, port: int, remote_dns: bool) -> bool:
+    writer.write(socks5_greeting(proxy.auth))
+    await writer.drain()
+    method = parse_socks5_method(await reader.readexactly(2))
+    if method == SOCKS5_USER_PASS and proxy.auth:
+        writer.write(socks5_auth_request(proxy.auth))
+        await writer.drain()
+        if not parse_socks5_auth_reply(await reader.readexactly(2)):
+            return False  # bad credentials
+    elif method != SOCKS5_NO_AUTH:
+        return False  # no acceptable methods
+    if not remote_dns:
+        host = await _resolve(host)
+    writer.write(socks5_connect_request(host, port, remote_dns))
+    await writer.drain()
+    header = await reader.readexactly(SOCKS5_REPLY_HEADER_SIZE)
+    if not parse_socks5_reply(header):
+        return False
+    first = await reader.readexactly(1)
+    await reader.readexactly(socks5_reply_address_size(header, first[0]) - 1)  # bound address, not needed
+    return True
+
+
+async def _http_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        proxy: Proxy, host: str, port: int) -> int:
+    writer.write(http_connect_request(host, port, proxy.auth))
+    await writer.drain()
+    status = parse_http_status(await reader.readline())
+    while True:  # skip the headers
+        line = await reader.readline()
+        if not line or line in (b"\r\n", b"\n"):
+            break
+    return status
+
+
+async def fetch(proxy: Proxy, protocol: str, url: str, timeout: float,
+                connect_timeout: Optional[float] = None,
+                max_bytes: Optional[int] = None, max_time: Optional[float] = None) -> Timings:
+    """
+    GETs the url through the proxy, speaking the protocol, timing every phase of it (see measure.fetch).
+    :param timeout: timeout of every step after the connection
+    :param connect_timeout: timeout of the connection to the proxy (defaults to timeout)
+    :param max_bytes: the body is read up to this many bytes, the whole of it by default
+    :param max_time: the body is read for this many seconds after the first byte at most
+    :return: the timings, status 0 if the proxy refused to connect to the server
+    """
+    scheme, host, port = url_endpoint(url)
+    start = perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(proxy.host, proxy.port),
+                                            timeout if connect_timeout is None else connect_timeout)
+    try:
+        connected = perf_counter()
+        if protocol == "https":
+            await asyncio.wait_for(writer.start_tls(PROXY_TLS_CONTEXT), timeout)
+        absolute = False
+        if protocol in ("http", "https"):
+            if scheme == "https":
+                status = await asyncio.wait_for(_http_connect(reader, writer, proxy, host, port), timeout)
+                if status != 200:
+                    return Timings(status, 0, connected - start, perf_counter() - connected, 0.0, 0.0)
+            else:
+                absolute = True  # plain http requests are just forwarded by the proxy
+        elif protocol in ("socks4", "socks4a"):
+            if not await asyncio.wait_for(
+                    _socks4_handshake(reader, writer, proxy, host, port, protocol == "socks4a"), timeout):
+                return Timings(0, 0, connected - start, perf_counter() - connected, 0.0, 0.0)
+        else:
+            if not await asyncio.wait_for(
+                    _socks5_handshake(reader, writer, proxy, host, port, protocol == "socks5h"), timeout):
+                return Timings(0, 0, connected - start, perf_counter() - connected, 0.0, 0.0)
+        if scheme == "https":
+            await asyncio.wait_for(writer.start_tls(TLS_CONTEXT, server_hostname=host), timeout)
+        handshaken = perf_counter()
+        writer.write(http_get_request(url, generate_headers(), absolute, proxy.auth))
+        await writer.drain()
+        status = parse_http_status(await asyncio.wait_for(reader.readline(), timeout))
+        first_byte = perf_counter()
+        size = 0
+        if status == 200:
+            while await asyncio.wait_for(reader.readline(), timeout) not in (b"\r\n", b"\n", b""):
+                pass  # the headers aren't counted
+            deadline = None if max_time is None else first_byte + max_time
+            while max_bytes is None or size < max_bytes:
+                chunk = await asyncio.wait_for(
+                    reader.read(65536 if max_bytes is None else min(65536, max_bytes - size)), timeout)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if deadline is not None and perf_counter() >= deadline:
+                    break
+        return Timings(status, size, connected - start, handshaken - connected, first_byte - handshaken,
+                       perf_counter() - first_byte)
+    finally:
+        writer.close()
+
+
+async def _probe_reply(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request: bytes,
+                       n: int, timeout: float) -> bytes:
+    # the reply fits into the first segment, no need to read any further
+    writer.write(request)
+    await writer.drain()
+    return await asyncio.wait_for(reader.read(n), timeout)
+
+
+async def probe(host: str, port: int, url: str, timeout: float,
+                protocols: Collection[str] = PROBE_ORDER,
+                a: Optional[tuple[str, Optional[str]]] = None) -> list[str]:
+    """
+    Async counterpart of probe.probe: the same handshakes (see handshake.py), in the same order.
+    :param host: host of the proxy server
+    :param port: port of the proxy server
+    :param url: the test url, which the proxy is asked to connect to
+    :param timeout: timeout of every connection and exchange
+    :param protocols: protocols to look for
+    :param a: proxy server authentication credentials
+    :return: detected protocols, in PROBE_ORDER
+    """
+    scheme, target_host, target_port = url_endpoint(url)
+    errors = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HandshakeError)
+
+    async def exchange(request: bytes, n: int, tls: bool = False) -> bytes:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=PROXY_TLS_CONTEXT if tls else None), timeout)
+        try:
+            return await _probe_reply(reader, writer, request, n, timeout)
+        finally:
+            writer.close()
+
+    async def http(tls: bool = False) -> bool:
+        if scheme == "https":
+            request = http_connect_request(target_host, target_port, a)
+        else:
+            request = http_get_request(url, {}, absolute=True, a=a)
+        return parse_http_status((await exchange(request, 256, tls)).split(b"\r\n", 1)[0]) == 200
+
+    async def socks4(remote_dns: bool) -> bool:
+        request = socks4_request(target_host if remote_dns else await _resolve(target_host), target_port,
+                                 a[0] if a else None, remote_dns)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        try:
+            writer.write(request)
+            await writer.drain()
+            return parse_socks4_reply(await asyncio.wait_for(reader.readexactly(SOCKS4_REPLY_SIZE), timeout))
+        finally:
+            writer.close()
+
+    detected = set()
+    speaks_socks5 = None
+    if {"socks5", "socks5h", "http"}.intersection(protocols):
+        try:
+            reply = await exchange(socks5_greeting(a), 16)
+            if reply.startswith(b"HTTP/"):
+                speaks_socks5 = False  # an HTTP server answering (most probably with 400) to garbage
+            else:
+                parse_socks5_method(reply)
+                speaks_socks5 = True  # even 0xFF (no acceptable methods) means that the server speaks SOCKS5
+                detected.update({"socks5", "socks5h"}.intersection(protocols))
+        except errors:
+            pass  # HTTP servers, which read the request line by line, never answer the greeting
+    answered_http = speaks_socks5 is False
+    if speaks_socks5 is not True and "http" in protocols:
+        try:
+            if await http():
+                detected.add("http")
+        except errors:
+            pass
+    if not detected and not answered_http and {"socks4", "socks4a"}.intersection(protocols):
+        try:
+            # socks4a servers speak socks4, the opposite isn't always true
+            if await socks4("socks4a" in protocols):
+                detected.update({"socks4", "socks4a"}.intersection(protocols))
+            elif "socks4a" in protocols and "socks4" in protocols and await socks4(False):
+                detected.add("socks4")
+        except errors:
+            pass
+    if not detected and "https" in protocols:
+        try:
+            if await http(tls=True):
+                detected.add("https")
+        except errors:
+            pass
+    return [protocol for protocol in PROBE_ORDER if protocol in detected]
+
+
+class AsyncProxyPool(ProxyPool):
+    """
+    Proxy Pool, which checks proxies on a single asyncio event loop instead of the nested thread pools.
+    Connections, protocol handshakes and test url fetches of all the submitted proxies run concurrently,
+    the total number of simultaneously open connections is limited by max_concurrency.
+    Best used with Python's "async with" clause.
+    >>> async with AsyncProxyPool(urls, max_concurrency=2000).limit_capacity(10) as pool:
+    >>>     pool.add_many(random_proxies)
+    >>> # this will exit when all the proxies are checked
+    """
+    max_concurrency: int
+
+    def __init__(self,
+                 urls: list[str], timeout: float = 2.0,
+                 protocols: Optional[Collection[str]] = None,
+                 max_concurrency: int = 1000,
+                 callback: Callable[[Proxy, ], None] = empty_callback,
+                 **kwargs):
+        """
+        :param urls: urls to test the proxies against
+        :param timeout: timeout of every network operation (the initial one, if adaptive_timeouts is on)
+        :param protocols: set of protocols to check proxies for
+        :param max_concurrency: max number of connections open at the same time (min 1)
+        :param callback: callback triggered, when a new alive proxy was found
+        :param kwargs: the rest of the ProxyPool arguments, but concurrency: the checks are limited
+                       by max_concurrency, the AIMD controller blocks threads
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency={max_concurrency}: must be a positive number.")
+        if kwargs.get("concurrency") is not None:
+            raise ValueError("concurrency: AsyncProxyPool is limited by max_concurrency, "
+                             "the AIMD controller isn't supported.")
+        super().__init__(urls, timeout, protocols,
+                         max_protocol_workers=len(PROXY_PROTOCOLS), max_proxy_workers=1, callback=callback,
+                         **kwargs)
+        self.max_concurrency = max_concurrency
+
+    async def _connect(self, proxy: Proxy) -> bool:
+        async with self._semaphore:
+            try:
+                start = monotonic()
+                _, writer = await asyncio.wait_for(asyncio.open_connection(proxy.host, proxy.port),
+                                                   self.timeouts.connect(proxy))
+                self.timeouts.observe_connect(monotonic() - start, proxy)
+                writer.close()
+                self.metrics.connects.inc("ok")
+                return True
+            except (OSError, asyncio.TimeoutError):
+                self.metrics.connects.inc("failed")
+                return False
+
+    async def check_protocol(self, proxy: Proxy, protocol: str) -> bool:
+        """
+        Async counterpart of Proxy.check_protocol.
+        """
+        urls = self.urls.copy()
+        random.shuffle(urls)
+        for url in urls:
+            async with self._semaphore:
+                try:
+                    connect_timeout, timeout = self.timeouts.request(proxy)
+                    timings = await fetch(proxy, protocol, url, timeout, connect_timeout,
+                                          self.throughput_bytes, self.throughput_window)
+                    if timings.status == 200:
+                        proxy._observe(timings)
+                        return True
+                    elif timings.status == 407:
+                        return False  # bad authentication
+                    elif timings.status in (429, 503):
+                        proxy._inconclusive = True  # the test url is throttled
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HandshakeError, ValueError) as ex:
+                    if isinstance(ex, OSError) and self._local_error(ex):
+                        proxy._inconclusive = True
+        return False
+
+    async def check(self, proxy: Proxy, connect: bool = True) -> None:
+        """
+        Async counterpart of Proxy.check.
+        The check is aborted with asyncio.CancelledError, when the pool is cancelled.
+        """
+        proxy._inconclusive = False
+        if connect and not await self._connect(proxy):
+            proxy.add_online(False)
+        elif self.probe:
+            # find out the protocols with handshakes, then only the first of them gets the real request
+            async with self._semaphore:
+                protocols = await probe(proxy.host, proxy.port, random.choice(self.urls),
+                                        self.timeouts.read(proxy), self.protocols, proxy.auth)
+            online = bool(protocols) and await self.check_protocol(proxy, protocols[0])
+            if protocols:
+                self.metrics.protocol_checks.inc(protocols[0], "ok" if online else "failed")
+            proxy.protocols = protocols if online else []
+            proxy.add_online(online)
+        else:
+            results = await asyncio.gather(*(self.check_protocol(proxy, p) for p in self.protocols))
+            self._count_protocols(self.protocols, results)
+            proxy.protocols = [protocol for protocol, result in zip(self.protocols, results) if result]
+            proxy.add_online(bool(proxy.protocols))
+        proxy._cache_health()
+        self._on_check(proxy)
+
+    async def _add(self, proxy: Proxy, connect: bool = True) -> None:
+        self.metrics.checks_started.inc()
+        start = perf_counter()
+        checked = None  # stays None, if the check raises
+        try:
+            try:
+                await self.check(proxy, connect)
+                checked = True
+            except asyncio.CancelledError:
+                checked = False
+                raise
+            finally:
+                self._count_check(proxy, checked, perf_counter() - start)
+            streams = self._checked(proxy)
+            if streams is not None:
+                for stream in streams:
+                    # the consumer throttles the validation
+                    while stream in self._streams:
+                        try:
+                            await asyncio.wait_for(stream.put(proxy), 0.1)
+                            break
+                        except asyncio.TimeoutError:
+                            pass
+        finally:
+            self._done(proxy)
+
+    async def results(self, maxsize: int = 64, stop_when_idle: bool = True) -> AsyncIterator[Proxy]:
+        """
+        Async counterpart of ProxyPool.results.
+        >>> async with proxy_pool:
+        >>>     proxy_pool.add_many(random_proxies)
+        >>>     async for proxy in proxy_pool.results():
+        >>>         ...
+        """
+        stream = asyncio.Queue(maxsize)
+        self._streams.append(stream)
+        proxies = list(self.proxies)
+        try:
+            for proxy in proxies:
+                yield proxy
+            while True:
+                try:
+                    yield await asyncio.wait_for(stream.get(), 0.1)
+                except asyncio.TimeoutError:
+                    if (stop_when_idle and self._idle()) or self._closed.is_set():
+                        if stream.empty():
+                            return
+        finally:
+            self._streams.remove(stream)
+
+    def _cancel(self) -> None:
+        self._cancelled.set()
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()  # raised at the next await
+
+    def add_many(self, proxies: Union[Collection[hostport], Collection[tuple[hostport, auth]]], flag=None,
+                 sweep: bool = False) -> None:
+        """
+        Async counterpart of ProxyPool.add_many, which never blocks the event loop.
+        :param proxies: proxies to add
+        :param flag: "noauth" if the proxies are passed without authentication data
+        :param sweep: accepted for compatibility: every check already starts with a non-blocking connection test
+                      on the event loop (at most max_concurrency at once), which is what the sweep of ProxyPool does,
+                      so the candidates are submitted the same way either way
+        """
+        if flag == "noauth":
+            proxies = ((p, None) for p in proxies)
+        for p, a in proxies:
+            self.add(p, a)
+
+    def _submit(self, proxy: Proxy, connect: bool = True) -> None:
+        task = asyncio.get_running_loop().create_task(self._add(proxy, connect))
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._task_done(t, proxy))
+
+    def _task_done(self, task: asyncio.Task, proxy: Proxy) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            if proxy in self:
+                self._done(proxy)  # cancelled while being published
+            else:
+                self._uncheck(proxy)
+
+    def __enter__(self):
+        raise TypeError("AsyncProxyPool must be used with 'async with'.")
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._tasks = set()
+        self._closed.clear()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._initialize_state_variables()
+        self._cancelled.clear()
+        self._closed.set()
+        return False
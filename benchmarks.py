@@ -0,0 +1,268 @@
+"""
+Micro-benchmarks of the proxy pool internals.
+Run as a script: python benchmarks.py [name ...]
+"""
+from __future__ import annotations
+from time import perf_counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import http.client
+import random
+import statistics
+import sys
+import threading
+import requests
+from pool import ProxyPool, Proxy
+from measure import fetch
+from metrics import Metrics
+from payload_server import PayloadServer
+from netutils import (
+    generate_headers, find_host_port_pairs, valid_host_port_pair, extract_host_port_records, numpy
+)
+import bs4
+import scrape
+
+
+def random_candidates(n: int, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    return [f"{rnd.randrange(1, 224)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}:"
+            f"{rnd.randrange(1, 65536)}" for _ in range(n)]
+
+
+class NullPool(ProxyPool):
+    """
+    Proxy pool, which never checks anything: measures the bookkeeping only.
+    """
+    def _submit(self, proxy: Proxy, connect: bool = True) -> None:
+        pass
+
+
+def bench_add_many() -> None:
+    """
+    add_many must scale linearly with the number of candidates,
+    no matter how many proxies there are in the pool already.
+    """
+    print("add_many (every candidate submitted twice, half of the pool is already filled):")
+    for n in (12_500, 25_000, 50_000, 100_000):
+        pool = NullPool(["http://example.com"])
+        candidates = random_candidates(n)
+        for c in candidates[:n // 2]:
+            host, port = c.rsplit(":", 1)
+            proxy = Proxy(pool, host, int(port))
+            pool.proxies.add(proxy)
+            pool.index[(proxy.host, proxy.port)] = proxy
+        start = perf_counter()
+        pool.add_many(candidates + candidates, "noauth")
+        dt = perf_counter() - start
+        print(f"  {n:>7} candidates: {dt * 1000:8.1f} ms, {dt / (2 * n) * 1e6:.2f} us per candidate")
+
+
+class ForwardProxyHandler(BaseHTTPRequestHandler):
+    """
+    HTTP proxy, which only forwards absolute-URI GET requests, keeping both sides alive.
+    The bodies are streamed, a client, which hangs up early, drops the upstream connection.
+    """
+    protocol_version = "HTTP/1.1"
+    wbufsize = 65536
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+        self.upstream = dict()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        upstream = self.upstream.get(parts.netloc)
+        if upstream is None:
+            upstream = self.upstream[parts.netloc] = http.client.HTTPConnection(parts.netloc)
+        upstream.request("GET", (parts.path or "/") + (f"?{parts.query}" if parts.query else ""))
+        response = upstream.getresponse()
+        self.send_response(response.status)
+        self.send_header("Content-Length", response.getheader("Content-Length", "0"))
+        self.end_headers()
+        try:
+            while chunk := response.read(65536):
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            del self.upstream[parts.netloc]
+            upstream.close()
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):  # the checks with a byte budget hang up early
+            super().handle_error(request, client_address)
+
+
+def local_server(handler) -> tuple[ThreadingHTTPServer, int]:
+    server = LocalServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+def bench_sessions(checks: int = 300) -> None:
+    """
+    Per-check overhead of a fresh requests.get against the checks of the pool, which reuse the connections
+    of its sessions, but for the first one and a sample of the rest, checking a local proxy against a local test server.
+    """
+    origin = PayloadServer().start()
+    proxy_server, proxy_port = local_server(ForwardProxyHandler)
+    url = origin.url(16384)
+    print(f"{checks} checks through a local proxy:")
+
+    proxies = Proxy(ProxyPool([url]), "127.0.0.1", proxy_port).dict("http")
+    ForwardProxyHandler.connections = 0
+    start = perf_counter()
+    for _ in range(checks):
+        response = requests.get(url, headers=generate_headers(), proxies=proxies, timeout=2, stream=True)
+        len(response.raw.data)
+    dt = perf_counter() - start
+    print(f"  requests.get:       {dt / checks * 1000:6.2f} ms per check, "
+          f"{ForwardProxyHandler.connections} connections to the proxy")
+
+    for label, rate in (("fresh connections", 1.0), ("pooled sessions", 0.1)):
+        proxy = Proxy(ProxyPool([url], fresh_connection_rate=rate), "127.0.0.1", proxy_port)
+        ForwardProxyHandler.connections = 0
+        start = perf_counter()
+        for _ in range(checks):
+            proxy.check_protocol("http")
+        dt = perf_counter() - start
+        print(f"  {label + ':':<19} {dt / checks * 1000:6.2f} ms per check, "
+              f"{ForwardProxyHandler.connections} connections to the proxy")
+    origin.close()
+    proxy_server.shutdown()
+
+
+def bench_probe(checks: int = 20, size: int = 8 << 20, rate: float = 64 << 20) -> None:
+    """
+    Cost of a throughput measurement through a local proxy: the whole test page against a byte budget
+    and a time window. The payload is served at a known rate, which the measurements should come close to.
+    """
+    proxy_server, proxy_port = local_server(ForwardProxyHandler)
+    with PayloadServer() as origin:
+        url = origin.url(size, rate)
+        print(f"{checks} checks of a {size >> 20} MB page served at {rate / (1 << 20):g} MB/s through a local proxy:")
+        for label, max_bytes, max_time in (("whole page", None, None), ("256 KB budget", 256 << 10, None),
+                                           ("50 ms window", None, 0.05)):
+            start = perf_counter()
+            speeds = [fetch("127.0.0.1", proxy_port, "http", url, 10, max_bytes=max_bytes, max_time=max_time)
+                      .throughput() for _ in range(checks)]
+            dt = perf_counter() - start
+            print(f"  {label:<14} {dt / checks * 1000:7.1f} ms per check, "
+                  f"{statistics.median(speeds) / (1 << 20):6.1f} MB/s median")
+    proxy_server.shutdown()
+
+
+def bench_metrics(n: int = 1_000_000, proxies: int = 10_000) -> None:
+    """
+    Cost of the counters on the hot path, from many threads at once, and of a scrape of a big pool.
+    """
+    metrics = Metrics()
+    threads = 8
+
+    def count() -> None:
+        for _ in range(n // threads):
+            metrics.candidates.inc("submitted")
+
+    workers = [threading.Thread(target=count) for _ in range(threads)]
+    start = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    dt = perf_counter() - start
+    print(f"counter: {dt / n * 1e9:.0f} ns per increment from {threads} threads, "
+          f"{int(metrics.candidates.value('submitted'))} of {n // threads * threads} counted")
+
+    pool = NullPool(["http://example.com"], metrics=metrics)
+    for c in random_candidates(proxies):
+        host, port = c.rsplit(":", 1)
+        proxy = Proxy(pool, host, int(port))
+        proxy.protocols = ["http", "socks5"]
+        pool.proxies.add(proxy)
+        pool.index[(proxy.host, proxy.port)] = proxy
+    start = perf_counter()
+    text = pool.prometheus()
+    dt = perf_counter() - start
+    print(f"scrape of {proxies} proxies: {dt * 1000:.1f} ms, {len(text)} bytes")
+
+
+def proxy_table_page(rows: int = 500, seed: int = 0) -> str:
+    """
+    Page shaped like the big proxy lists: some navigation and scripts around a table of proxies.
+    """
+    rnd = random.Random(seed)
+    head = "<html><head>" + "<script>var x = 1;</script>" * 10 + "</head><body>"
+    nav = "<ul>" + "".join(f"<li><a href='/page/{i}'>{i}</a></li>" for i in range(50)) + "</ul>"
+    table = "<table id='proxy_list'><tbody>" + "".join(
+        f"<tr class='spy1x'><td><font class='spy14'>{c.split(':')[0]}</font></td><td>{c.split(':')[1]}</td>"
+        f"<td><a href='/anon'>HIA</a></td><td>{rnd.randrange(100)}%</td></tr>"
+        for c in random_candidates(rows, seed)
+    ) + "</tbody></table>"
+    return head + nav + table + nav + "</body></html>"
+
+
+def bench_parsers(pages: int = 20) -> None:
+    """
+    Pages parsed per second by every available backend, building the whole tree and only the proxy table.
+    """
+    page = proxy_table_page()
+    print(f"parsing a {len(page) // 1024} KB page with 500 proxies:")
+    for backend in scrape.available_parsers():
+        scrape.set_parser(backend)
+        for label, only in (("whole page", None), ("table only", bs4.SoupStrainer(id="proxy_list"))):
+            start = perf_counter()
+            for _ in range(pages):
+                rows = scrape.make_soup(page, only).find_all("tr")
+            dt = perf_counter() - start
+            assert len(rows) == 500
+            print(f"  {backend:<12} {label}: {pages / dt:7.1f} pages/s")
+    scrape.set_parser(scrape.available_parsers()[0])
+
+
+def bench_extract(n: int = 200_000) -> None:
+    """
+    Throughput of pulling "ip:port" pairs out of a plain dump (one pair per line) and out of an HTML table.
+    """
+    candidates = random_candidates(n)
+    texts = {
+        "dump": "\n".join(candidates).encode(),
+        "html": "".join(f"<tr><td>{c}</td><td>HIA</td><td>Germany</td></tr>\n" for c in candidates).encode(),
+    }
+    extractors = {
+        "find_host_port_pairs": lambda data: [p for p in find_host_port_pairs(data.decode()) if valid_host_port_pair(p)],
+        "records (array)": lambda data: extract_host_port_records(data, as_numpy=False),
+    }
+    if numpy is not None:
+        extractors["records (numpy)"] = extract_host_port_records
+    print(f"extracting {n} pairs:")
+    for label, data in texts.items():
+        for name, extract in extractors.items():
+            start = perf_counter()
+            found = extract(data)
+            dt = perf_counter() - start
+            assert len(found) == n
+            print(f"  {label} ({len(data) / 1e6:.1f} MB), {name:<20}: {len(data) / dt / 1e6:6.1f} MB/s, "
+                  f"{dt / n * 1e6:.2f} us per pair")
+
+
+BENCHMARKS = {
+    "add_many": bench_add_many,
+    "sessions": bench_sessions,
+    "probe": bench_probe,
+    "parsers": bench_parsers,
+    "extract": bench_extract,
+    "metrics": bench_metrics,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,196 @@
+from __future__ import annotations
+from typing import Optional
+from contextlib import contextmanager
+from time import monotonic
+import errno
+import threading
+
+
+# errors, which mean that this machine ran out of something, not that the proxy is dead
+LOCAL_ERRNOS = frozenset(
+    code for code in (
+        getattr(errno, name, None) for name in ("EMFILE", "ENFILE", "ENOBUFS", "ENOMEM", "EADDRNOTAVAIL")
+    ) if code is not None
+)
+
+
+def is_local_error(ex: BaseException) -> bool:
+    """
+    :return: whether the exception has been caused by the exhaustion of local resources (fds, ports, buffers),
+    it's looked for along the chain of the causes, since requests and urllib3 wrap the socket errors
+    """
+    seen = set()
+    while ex is not None and id(ex) not in seen:
+        seen.add(id(ex))
+        if isinstance(ex, OSError) and ex.errno in LOCAL_ERRNOS:
+            return True
+        reason = getattr(ex, "reason", None)  # urllib3 keeps the underlying error there
+        if isinstance(reason, BaseException) and id(reason) not in seen:
+            ex = reason
+        else:
+            ex = ex.__cause__ or ex.__context__
+    return False
+
+
+class AIMDController:
+    """
+    Limit of the checks in flight, which is tuned as they go: additive increase, multiplicative decrease.
+    Every `window` seconds the completion rate is compared with the one of the previous window:
+    while the limit is actually used and the rate keeps improving, the limit grows by `increase`,
+    if the rate drops after a growth, the growth is undone.
+    The limit is multiplied by `decrease` right away on the exhaustion of local resources (see congested),
+    and at the end of a window, in which the share of the test url errors (see error) has risen above error_rate.
+    >>> controller = AIMDController(initial=8, max_limit=256)
+    >>> with ProxyPool(urls, concurrency=controller) as pool:
+    >>>     pool.add_many(random_proxies)
+    >>> print(controller.limit, controller.throughput())  # what it has settled on
+    """
+    limit: int
+    min_limit: int
+    max_limit: int
+    increase: int
+    decrease: float
+    window: float
+    error_rate: float
+    gain: float
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 256, increase: int = 2,
+                 decrease: float = 0.5, window: float = 2.0, error_rate: float = 0.1, gain: float = 0.05):
+        """
+        :param initial: limit to start with
+        :param min_limit: the limit never gets lower
+        :param max_limit: the limit never gets higher (this many threads might be started)
+        :param increase: additive step of the limit
+        :param decrease: multiplicative step of the limit, 0 < decrease < 1
+        :param window: seconds between the adjustments
+        :param error_rate: share of the test url errors among the completions, above which it's a sign of overload
+        :param gain: relative improvement of the completion rate, which is worth growing further for
+        """
+        if not 1 <= min_limit <= initial <= max_limit:
+            raise ValueError(f"Limits must satisfy 1 <= min_limit ({min_limit}) <= initial ({initial}) "
+                             f"<= max_limit ({max_limit}).")
+        if not 0 < decrease < 1:
+            raise ValueError(f"decrease={decrease}: must be in (0, 1).")
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.error_rate = error_rate
+        self.gain = gain
+        self.in_flight = 0
+        self.completed = 0  # over the whole lifetime
+        self._condition = threading.Condition()
+        self._window_start = monotonic()
+        self._completions = 0  # in the current window
+        self._errors = 0  # in the current window
+        self._peak = 0  # max number of checks in flight during the current window
+        self._last_rate = 0.0
+        self._last_error_rate = 0.0
+        self._grew = False  # whether the limit has been increased at the end of the previous window
+        self._last_decrease = 0.0
+
+    def __getstate__(self) -> dict:
+        # a copy sent to another process (see ShardedProxyPool) starts afresh, with the same settings
+        state = self.__dict__.copy()
+        del state["_condition"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self._window_start = monotonic()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for a free slot.
+        :return: False on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < self.limit, timeout):
+                return False
+            self.in_flight += 1
+            self._peak = max(self._peak, self.in_flight)
+            return True
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self.completed += 1
+            self._completions += 1
+            self._adjust(monotonic())
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def congested(self) -> None:
+        """
+        Local resources (file descriptors, ports, buffers) have run out: backs off at once,
+        but not more often than once a window, since a burst of failures is a single event.
+        """
+        with self._condition:
+            now = monotonic()
+            if now - self._last_decrease >= self.window:
+                self._decrease(now)
+
+    def error(self) -> None:
+        """
+        The test url has answered with an error, which means overload (e.g. 429 Too Many Requests).
+        """
+        with self._condition:
+            self._errors += 1
+
+    def _decrease(self, now: float) -> None:
+        self.limit = max(self.min_limit, int(self.limit * self.decrease))
+        self._last_decrease = now
+        self._grew = False
+
+    def _adjust(self, now: float) -> None:
+        # must be called with the lock held
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        rate = self._completions / elapsed
+        error_rate = self._errors / max(self._completions, 1)
+        saturated = self._peak >= self.limit
+        if error_rate > self.error_rate and error_rate > self._last_error_rate:
+            self._decrease(now)
+        elif self._grew and rate < self._last_rate * (1 - self.gain):
+            self.limit = max(self.min_limit, self.limit - self.increase)  # the growth hasn't paid off
+            self._grew = False
+        elif saturated and rate >= self._last_rate * (1 + self.gain) and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + self.increase)
+            self._grew = True
+            self._condition.notify(self.increase)
+        else:
+            self._grew = False
+        self._last_rate = rate
+        self._last_error_rate = error_rate
+        self._window_start = now
+        self._completions = 0
+        self._errors = 0
+        self._peak = self.in_flight
+
+    def throughput(self) -> float:
+        """
+        :return: completions per second over the last full window
+        """
+        return self._last_rate
+
+    def stats(self) -> dict[str, float]:
+        with self._condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "throughput": self._last_rate,
+                "error_rate": self._last_error_rate,
+                "completed": self.completed,
+            }
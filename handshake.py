@@ -0,0 +1,209 @@
+from __future__ import annotations
+from typing import Optional
+from base64 import b64encode
+from urllib.parse import urlsplit
+import ipaddress
+import socket
+
+
+# Byte level codecs of the proxy protocols' handshakes.
+# They don't do any I/O by themselves, so both the blocking and the asyncio code can speak through them.
+
+SOCKS4_VERSION = 0x04
+SOCKS4_GRANTED = 0x5A
+SOCKS5_VERSION = 0x05
+SOCKS5_NO_AUTH = 0x00
+SOCKS5_USER_PASS = 0x02
+SOCKS5_NO_ACCEPTABLE_METHODS = 0xFF
+SOCKS5_SUCCEEDED = 0x00
+
+SOCKS_CONNECT = 0x01
+
+SOCKS5_ATYP_IPV4 = 0x01
+SOCKS5_ATYP_DOMAIN = 0x03
+SOCKS5_ATYP_IPV6 = 0x04
+
+# the size of the SOCKS5 reply header: VER REP RSV ATYP
+SOCKS5_REPLY_HEADER_SIZE = 4
+# the size of the SOCKS4 reply: VN CD DSTPORT DSTIP
+SOCKS4_REPLY_SIZE = 8
+
+
+class HandshakeError(Exception):
+    """
+    Raised when the other side answered something, which doesn't belong to the expected protocol.
+    """
+    pass
+
+
+def is_ipv4(host: str) -> bool:
+    try:
+        socket.inet_aton(host)
+        return host.count(".") == 3
+    except OSError:
+        return False
+
+
+def socks4_request(host: str, port: int, username: Optional[str] = None, remote_dns: bool = False) -> bytes:
+    """
+    :param host: destination host (must be an IPv4 address, unless remote_dns is set)
+    :param port: destination port
+    :param username: SOCKS4 user id
+    :param remote_dns: SOCKS4a extension, lets the proxy server resolve the host name
+    :return: CONNECT request
+    """
+    user = (username or "").encode() + b"\x00"
+    if remote_dns and not is_ipv4(host):
+        # 0.0.0.x is an invalid ip address, which tells the server to read the domain name after the user id
+        return bytes([SOCKS4_VERSION, SOCKS_CONNECT]) + port.to_bytes(2, "big") + b"\x00\x00\x00\x01" + \
+            user + host.encode("idna") + b"\x00"
+    return bytes([SOCKS4_VERSION, SOCKS_CONNECT]) + port.to_bytes(2, "big") + socket.inet_aton(host) + user
+
+
+def parse_socks4_reply(data: bytes) -> bool:
+    """
+    :param data: 8 bytes of the reply
+    :return: whether the request was granted
+    """
+    if len(data) < SOCKS4_REPLY_SIZE or data[0] != 0x00:
+        raise HandshakeError(f"Not a SOCKS4 reply: {data[:SOCKS4_REPLY_SIZE]!r}.")
+    return data[1] == SOCKS4_GRANTED
+
+
+def socks5_greeting(a: Optional[tuple[str, Optional[str]]] = None) -> bytes:
+    if a:
+        return bytes([SOCKS5_VERSION, 2, SOCKS5_NO_AUTH, SOCKS5_USER_PASS])
+    return bytes([SOCKS5_VERSION, 1, SOCKS5_NO_AUTH])
+
+
+def parse_socks5_method(data: bytes) -> int:
+    """
+    :param data: 2 bytes of the method selection message
+    :return: the method the server chose
+    """
+    if len(data) < 2 or data[0] != SOCKS5_VERSION:
+        raise HandshakeError(f"Not a SOCKS5 method selection message: {data[:2]!r}.")
+    return data[1]
+
+
+def socks5_auth_request(a: tuple[str, Optional[str]]) -> bytes:
+    # RFC 1929 username/password sub-negotiation
+    username, password = a
+    username = (username or "").encode()
+    password = (password or "").encode()
+    return bytes([0x01, len(username)]) + username + bytes([len(password)]) + password
+
+
+def parse_socks5_auth_reply(data: bytes) -> bool:
+    if len(data) < 2:
+        raise HandshakeError(f"Not a SOCKS5 authentication reply: {data!r}.")
+    return data[1] == 0x00
+
+
+def socks5_connect_request(host: str, port: int, remote_dns: bool = False) -> bytes:
+    request = bytes([SOCKS5_VERSION, SOCKS_CONNECT, 0x00])
+    try:
+        address = ipaddress.ip_address(host)
+        if address.version == 4:
+            request += bytes([SOCKS5_ATYP_IPV4]) + address.packed
+        else:
+            request += bytes([SOCKS5_ATYP_IPV6]) + address.packed
+    except ValueError:
+        if not remote_dns:
+            raise ValueError(f"'{host}' must be resolved locally before a SOCKS5 CONNECT request.")
+        name = host.encode("idna")
+        request += bytes([SOCKS5_ATYP_DOMAIN, len(name)]) + name
+    return request + port.to_bytes(2, "big")
+
+
+def socks5_reply_address_size(header: bytes, first: int) -> int:
+    """
+    :param header: 4 bytes of the reply header
+    :param first: the byte right after the header (the length of the domain name, if the address is a domain)
+    :return: number of bytes left to read after the header (including the first byte and the port)
+    """
+    atyp = header[3]
+    if atyp == SOCKS5_ATYP_IPV4:
+        return 4 + 2
+    elif atyp == SOCKS5_ATYP_IPV6:
+        return 16 + 2
+    elif atyp == SOCKS5_ATYP_DOMAIN:
+        return 1 + first + 2
+    raise HandshakeError(f"Unknown SOCKS5 address type {atyp}.")
+
+
+def parse_socks5_reply(header: bytes) -> bool:
+    """
+    :param header: first 4 bytes of the reply
+    :return: whether the connection was established
+    """
+    if len(header) < SOCKS5_REPLY_HEADER_SIZE or header[0] != SOCKS5_VERSION:
+        raise HandshakeError(f"Not a SOCKS5 reply: {header!r}.")
+    return header[1] == SOCKS5_SUCCEEDED
+
+
+def basic_auth(a: tuple[str, Optional[str]]) -> str:
+    username, password = a
+    credentials = f"{username or ''}:{password or ''}".encode()
+    return "Basic " + b64encode(credentials).decode()
+
+
+def http_connect_request(host: str, port: int, a: Optional[tuple[str, Optional[str]]] = None) -> bytes:
+    lines = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}"]
+    if a:
+        lines.append(f"Proxy-Authorization: {basic_auth(a)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def http_get_request(url: str, headers: dict[str, str], absolute: bool = False,
+                     a: Optional[tuple[str, Optional[str]]] = None) -> bytes:
+    """
+    :param url: the url to GET
+    :param headers: request headers
+    :param absolute: whether to use the absolute-URI form (when talking to an HTTP proxy directly)
+    :param a: proxy credentials (only make sense with the absolute form)
+    :return: a GET request, which asks the server to close the connection after the response
+    """
+    parts = urlsplit(url)
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    if absolute:
+        target = f"{parts.scheme}://{parts.netloc}{target}"
+    lines = [f"GET {target} HTTP/1.1", f"Host: {parts.netloc}"]
+    for name, value in headers.items():
+        if name.lower() in ("host", "connection", "accept-encoding"):
+            continue
+        lines.append(f"{name}: {value}")
+    # we count bytes on the wire, so there's no need to decompress anything
+    lines.append("Accept-Encoding: identity")
+    lines.append("Connection: close")
+    if absolute and a:
+        lines.append(f"Proxy-Authorization: {basic_auth(a)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def parse_http_status(line: bytes) -> int:
+    """
+    :param line: the status line of an HTTP response
+    :return: the status code
+    """
+    parts = line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+        raise HandshakeError(f"Not an HTTP status line: {line[:32]!r}.")
+    try:
+        return int(parts[1])
+    except ValueError:
+        raise HandshakeError(f"Not an HTTP status line: {line[:32]!r}.")
+
+
+def url_endpoint(url: str) -> tuple[str, str, int]:
+    """
+    :return: scheme, host and port of the url
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    port = parts.port
+    if not port:
+        port = 443 if scheme == "https" else 80
+    return scheme, parts.hostname, port
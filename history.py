@@ -0,0 +1,158 @@
+from __future__ import annotations
+from typing import Optional, Iterator
+from array import array
+from time import monotonic
+
+
+# timestamps are stored as 32-bit floats relative to the import time (~0.06s precision after 10 days of uptime)
+EPOCH = monotonic()
+NO_SPEED = float("nan")  # throughput of a check, which hasn't measured any
+
+
+class Health:
+    """
+    Fixed size ring buffer of the latest checks of a proxy, kept in the slots of the proxy itself
+    (there might be millions of them, so there are no objects of its own per proxy):
+    a float32 monotonic timestamp per check, shared by whether the proxy was online (a bit of an int per check)
+    and the throughput measured by the check (NaN if none). The arrays only grow up to the capacity,
+    and the throughputs aren't kept at all, until one has been measured.
+    """
+    __slots__ = ("_times", "_speeds", "_online", "_start", "_speed")
+
+    _times: array  # "f" timestamps relative to EPOCH
+    _speeds: Optional[array]  # "f" throughputs (bytes per second) of the checks, None if none has been measured
+    _online: int  # bit i is whether the proxy was online at the check in _times[i]
+    _start: int  # index of the oldest check, once the buffer is full
+    _speed: Optional[float]  # best throughput measured by the check in progress
+
+    def __init__(self):
+        self._times = array("f")
+        self._speeds = None
+        self._online = 0
+        self._start = 0
+        self._speed = None
+
+    def add_speed(self, speed: float) -> None:
+        """
+        Records the throughput measured by the check in progress, the best one, if there are several of them
+        (one per protocol). It's kept along with the check, once it's over (see _record).
+        """
+        if self._speed is None or speed > self._speed:
+            self._speed = speed
+
+    def _record(self, online: bool, capacity: int, t: Optional[float] = None) -> None:
+        # the check is over: appends it, overwriting the oldest one, if there are capacity of them already
+        if t is None:
+            t = monotonic()
+        t -= EPOCH
+        speed, self._speed = (NO_SPEED if self._speed is None else self._speed), None
+        if self._speeds is None and speed == speed:  # the first measured one, the rest of them are NaN
+            self._speeds = array("f", [NO_SPEED]) * len(self._times)
+        n = len(self._times)
+        if n < capacity:
+            i = n
+            self._times.append(t)
+            if self._speeds is not None:
+                self._speeds.append(speed)
+        else:
+            i = self._start
+            self._times[i] = t
+            if self._speeds is not None:
+                self._speeds[i] = speed
+            self._start = (i + 1) % n
+        if online:
+            self._online |= 1 << i
+        else:
+            self._online &= ~(1 << i)
+
+    @property
+    def check_count(self) -> int:
+        """
+        :return: number of the checks kept (up to the history size of the pool)
+        """
+        return len(self._times)
+
+    def uptime(self) -> float:
+        """
+        :return: share of the kept checks, which have found the proxy online, 0.0 if there are none
+        """
+        if not self._times:
+            return 0.0
+        return bin(self._online).count("1") / len(self._times)
+
+    def mean_speed(self) -> float:
+        """
+        :return: mean throughput (bytes per second) over the kept checks, which have measured it, 0.0 if none has
+        """
+        if self._speeds is None:
+            return 0.0
+        speeds = [speed for speed in self._speeds if speed == speed]
+        return sum(speeds) / len(speeds) if speeds else 0.0
+
+    def last_online(self) -> bool:
+        """
+        :return: whether the proxy was online at its last check, False if it hasn't been checked
+        """
+        if not self._times:
+            return False
+        return bool(self._online >> (self._start - 1) % len(self._times) & 1)
+
+    def last_check_time(self) -> float:
+        """
+        :return: monotonic time of the last check
+        """
+        return EPOCH + self._times[self._start - 1]
+
+    def _indices(self) -> Iterator[int]:
+        # the oldest first
+        n = len(self._times)
+        for i in range(n):
+            yield (self._start + i) % n
+
+    @property
+    def response_stats(self) -> list[tuple[float, float]]:
+        """
+        :return: (throughput, monotonic timestamp) of the checks, which have measured it, the oldest first
+        """
+        if self._speeds is None:
+            return []
+        speeds = self._speeds
+        return [(speeds[i], EPOCH + self._times[i]) for i in self._indices() if speeds[i] == speeds[i]]
+
+    @property
+    def online_checks(self) -> list[tuple[bool, float]]:
+        """
+        :return: (online, monotonic timestamp) of the checks, the oldest first
+        """
+        return [(bool(self._online >> i & 1), EPOCH + self._times[i]) for i in self._indices()]
+
+    def dump_history(self, clock_offset: float = 0.0) -> tuple[bytes, bytes]:
+        """
+        :param clock_offset: added to every timestamp, e.g. time() - monotonic() to store wall clock time
+        :return: the throughputs and the online flags, each packed as (value, timestamp) pairs of doubles,
+                 the oldest first
+        """
+        speeds, online = array("d"), array("d")
+        for speed, t in self.response_stats:
+            speeds.extend((speed, t + clock_offset))
+        for b, t in self.online_checks:
+            online.extend((b, t + clock_offset))
+        return speeds.tobytes(), online.tobytes()
+
+    def restore_history(self, speeds: bytes, online: bytes, capacity: int, clock_offset: float = 0.0) -> None:
+        """
+        Appends the checks previously packed with dump_history.
+        A throughput is taken for the first check, which isn't older than it
+        (so the ones, which were kept apart from the checks, are restored as well).
+        :param clock_offset: added to every timestamp, e.g. monotonic() - time() to restore wall clock time
+        """
+        speed_records, online_records = array("d"), array("d")
+        speed_records.frombytes(speeds)
+        online_records.frombytes(online)
+        j = 0
+        for i in range(0, len(online_records) - 1, 2):
+            t = online_records[i + 1]
+            while j < len(speed_records) - 1 and speed_records[j + 1] <= t:
+                self.add_speed(speed_records[j])
+                j += 2
+            self._record(bool(online_records[i]), capacity, t + clock_offset)
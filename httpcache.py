@@ -0,0 +1,154 @@
+from __future__ import annotations
+from typing import Optional, NamedTuple
+from urllib.parse import urlsplit
+from time import time
+import json
+import sqlite3
+import threading
+import zlib
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    fetched REAL NOT NULL
+)
+"""
+
+
+class CachedPage(NamedTuple):
+    headers: dict[str, str]
+    body: bytes
+    fetched: float  # wall clock time of the last download or revalidation
+
+
+class HttpCache:
+    """
+    SQLite backed cache of the pages of the proxy lists, bodies are stored compressed.
+    A page younger than the TTL of its host is served without any request,
+    an older one is revalidated with its ETag / Last-Modified, so that an unchanged page isn't downloaded again.
+    >>> cache = HttpCache("pages.sqlite3", ttls={"free-proxy.cz": 600})
+    >>> session.mount("http://", CachingAdapter(cache))
+    """
+    path: str
+    ttl: float
+    ttls: dict[str, float]
+
+    def __init__(self, path: str, ttl: float = 300., ttls: Optional[dict[str, float]] = None):
+        """
+        :param path: database file, ":memory:" for a cache, which lives as long as the process
+        :param ttl: how long a page stays fresh (seconds), unless its host is in ttls
+        :param ttls: TTL by host name
+        """
+        self.path = path
+        self.ttl = ttl
+        self.ttls = dict(ttls) if ttls else dict()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(SCHEMA)
+        self._lock = threading.Lock()
+
+    def ttl_of(self, url: str) -> float:
+        return self.ttls.get(urlsplit(url).hostname, self.ttl)
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT headers, body, fetched FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        headers, body, fetched = row
+        return CachedPage(json.loads(headers), zlib.decompress(body), fetched)
+
+    def put(self, url: str, headers: dict[str, str], body: bytes) -> None:
+        record = (url, json.dumps(headers), zlib.compress(body), time())
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", record)
+
+    def touch(self, url: str) -> None:
+        """
+        Marks the page as fresh again, after the server said it's not modified.
+        """
+        with self._lock:
+            self._connection.execute("UPDATE pages SET fetched = ? WHERE url = ?", (time(), url))
+
+    def delete(self, url: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM pages WHERE url = ?", (url,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, which serves GET requests from an HttpCache.
+    Every response it returns has a from_cache attribute: True when the body hasn't been downloaded this time
+    (the page was fresh, or the server answered 304 Not Modified).
+    """
+    # the headers, which the cached response keeps: the rest describes the transfer, not the page
+    KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Date")
+
+    def __init__(self, cache: HttpCache, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if request.method != "GET":
+            response = super().send(request, **kwargs)
+            response.from_cache = False
+            return response
+        url = request.url
+        page = self.cache.get(url)
+        if page is not None:
+            if time() - page.fetched < self.cache.ttl_of(url):
+                return self._cached_response(request, page)
+            if "ETag" in page.headers:
+                request.headers["If-None-Match"] = page.headers["ETag"]
+            if "Last-Modified" in page.headers:
+                request.headers["If-Modified-Since"] = page.headers["Last-Modified"]
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and page is not None:
+            response.close()
+            self.cache.touch(url)
+            return self._cached_response(request, page)
+        response.from_cache = False
+        if response.status_code == 200 and "no-store" not in response.headers.get("Cache-Control", ""):
+            # reading the body here defeats stream=True, which the scrapers don't use anyway
+            headers = {name: response.headers[name] for name in self.KEPT_HEADERS if name in response.headers}
+            self.cache.put(url, headers, response.content)
+        return response
+
+    @staticmethod
+    def _cached_response(request: requests.PreparedRequest, page: CachedPage) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(page.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = page.body
+        response.url = request.url
+        response.request = request
+        response.from_cache = True
+        return response
@@ -0,0 +1,252 @@
+from __future__ import annotations
+from typing import Optional, NamedTuple
+from time import perf_counter
+import io
+import socket
+import ssl
+import requests
+from netutils import generate_headers
+from probe import PROXY_TLS_CONTEXT, _resolve, _recv_exactly, auth
+from handshake import (
+    HandshakeError, is_ipv4, url_endpoint,
+    socks4_request, parse_socks4_reply, SOCKS4_REPLY_SIZE,
+    socks5_greeting, parse_socks5_method, socks5_auth_request, parse_socks5_auth_reply,
+    socks5_connect_request, parse_socks5_reply, socks5_reply_address_size, SOCKS5_REPLY_HEADER_SIZE,
+    SOCKS5_NO_AUTH, SOCKS5_USER_PASS,
+    http_connect_request, http_get_request, parse_http_status,
+)
+
+
+# the connection to the test server through the proxy is verified
+TLS_CONTEXT = ssl.create_default_context()
+# smaller bodies arrive in a burst of a few segments, the duration of which is the timer and the scheduler,
+# not the link, so their throughput isn't measured
+MIN_THROUGHPUT_BYTES = 65536
+
+
+class TLSTunnel:
+    """
+    TLS connection over a socket, which is a TLS connection itself (to an https proxy):
+    an SSLSocket can't be wrapped again, so the inner TLS runs over memory buffers (like urllib3's SSLTransport).
+    Only what fetch needs of a socket: sendall, recv, makefile("rb") and close.
+    """
+    def __init__(self, sock: ssl.SSLSocket, context: ssl.SSLContext, server_hostname: str):
+        self.sock = sock
+        self._incoming = ssl.MemoryBIO()
+        self._outgoing = ssl.MemoryBIO()
+        self._tls = context.wrap_bio(self._incoming, self._outgoing, server_hostname=server_hostname)
+        self._run(self._tls.do_handshake)
+
+    def _run(self, operation, *args):
+        # runs the TLS operation, passing the records between the memory buffers and the socket
+        while True:
+            try:
+                result = operation(*args)
+            except ssl.SSLWantReadError:
+                self._flush()
+                data = self.sock.recv(65536)
+                if data:
+                    self._incoming.write(data)
+                else:
+                    self._incoming.write_eof()
+                continue
+            self._flush()
+            return result
+
+    def _flush(self) -> None:
+        data = self._outgoing.read()
+        if data:
+            self.sock.sendall(data)
+
+    def send(self, data: bytes) -> int:
+        return self._run(self._tls.write, data)
+
+    def sendall(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[self.send(view):]
+
+    def recv(self, n: int) -> bytes:
+        try:
+            return self._run(self._tls.read, n)
+        except (ssl.SSLZeroReturnError, ssl.SSLEOFError):
+            return b""  # closed, with or without close_notify (ragged EOFs are suppressed, as by SSLSocket)
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        data = self.recv(nbytes or len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def makefile(self, mode: str = "rb") -> io.BufferedReader:
+        return io.BufferedReader(socket.SocketIO(self, mode))
+
+    def _decref_socketios(self) -> None:
+        pass  # socket.SocketIO calls it on close, the socket is closed by close
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class Timings(NamedTuple):
+    """
+    Phases of a single GET through a proxy (seconds), None if they haven't been timed:
+    the connection and the handshakes are only timed over a fresh connection (see fetch),
+    a kept alive one (see fetch_with_session) only times the TTFB and the transfer.
+    """
+    status: int
+    size: int  # bytes of the response body
+    connect: Optional[float]  # TCP connection to the proxy
+    handshake: Optional[float]  # TLS to an https proxy, the proxy protocol negotiation, TLS to an https server
+    ttfb: Optional[float]  # from the request sent to the first byte of the response
+    transfer: float  # from the first byte of the response to the last one
+
+    def throughput(self, min_bytes: int = MIN_THROUGHPUT_BYTES) -> Optional[float]:
+        """
+        :param min_bytes: the throughput of a smaller body isn't measured
+        :return: bytes per second of the transfer, the TTFB excluded, None if it's too short to measure
+        """
+        if self.size < min_bytes or self.transfer <= 0:
+            return None
+        return self.size / self.transfer
+
+
+def _socks4_handshake(s: socket.socket, host: str, port: int, remote_dns: bool, a: auth) -> bool:
+    if not remote_dns and not is_ipv4(host):
+        host = _resolve(host)
+    s.sendall(socks4_request(host, port, a[0] if a else None, remote_dns))
+    return parse_socks4_reply(_recv_exactly(s, SOCKS4_REPLY_SIZE))
+
+
+def _socks5_handshake(s: socket.socket, host: str, port: int, remote_dns: bool, a: auth) -> bool:
+    s.sendall(socks5_greeting(a))
+    method = parse_socks5_method(_recv_exactly(s, 2))
+    if method == SOCKS5_USER_PASS and a:
+        s.sendall(socks5_auth_request(a))
+        if not parse_socks5_auth_reply(_recv_exactly(s, 2)):
+            return False  # bad credentials
+    elif method != SOCKS5_NO_AUTH:
+        return False  # no acceptable methods
+    if not remote_dns and not is_ipv4(host):
+        host = _resolve(host)
+    s.sendall(socks5_connect_request(host, port, remote_dns))
+    header = _recv_exactly(s, SOCKS5_REPLY_HEADER_SIZE)
+    if not parse_socks5_reply(header):
+        return False
+    first = _recv_exactly(s, 1)
+    if not first:
+        raise HandshakeError("Truncated SOCKS5 reply.")
+    _recv_exactly(s, socks5_reply_address_size(header, first[0]) - 1)  # bound address, not needed
+    return True
+
+
+def _http_connect(s: socket.socket, host: str, port: int, a: auth) -> int:
+    s.sendall(http_connect_request(host, port, a))
+    head = b""
+    while b"\r\n\r\n" not in head:  # the reply has no body, but might come in pieces
+        chunk = s.recv(4096)
+        if not chunk:
+            break
+        head += chunk
+    return parse_http_status(head.split(b"\r\n", 1)[0])
+
+
+def fetch(host: str, port: int, protocol: str, url: str, timeout: float,
+          connect_timeout: Optional[float] = None, a: auth = None,
+          max_bytes: Optional[int] = None, max_time: Optional[float] = None) -> Timings:
+    """
+    GETs the url through the proxy over a fresh connection, timing every phase of it.
+    :param host: host of the proxy server
+    :param port: port of the proxy server
+    :param protocol: protocol to speak to the proxy
+    :param url: the url to GET
+    :param timeout: timeout of every exchange after the connection
+    :param connect_timeout: timeout of the connection to the proxy (defaults to timeout)
+    :param a: proxy server authentication credentials
+    :param max_bytes: the body is read up to this many bytes, the whole of it by default
+    :param max_time: the body is read for this many seconds after the first byte at most
+    :return: the timings, status 0 if the proxy refused to connect to the server
+    """
+    scheme, target_host, target_port = url_endpoint(url)
+    start = perf_counter()
+    s = socket.create_connection((host, port), timeout=timeout if connect_timeout is None else connect_timeout)
+    try:
+        connected = perf_counter()
+        s.settimeout(timeout)
+        if protocol == "https":
+            s = PROXY_TLS_CONTEXT.wrap_socket(s)
+        absolute = False
+        if protocol in ("http", "https"):
+            if scheme == "https":
+                status = _http_connect(s, target_host, target_port, a)
+                if status != 200:
+                    return Timings(status, 0, connected - start, perf_counter() - connected, 0.0, 0.0)
+            else:
+                absolute = True  # plain http requests are just forwarded by the proxy
+        elif protocol in ("socks4", "socks4a"):
+            if not _socks4_handshake(s, target_host, target_port, protocol == "socks4a", a):
+                return Timings(0, 0, connected - start, perf_counter() - connected, 0.0, 0.0)
+        elif not _socks5_handshake(s, target_host, target_port, protocol == "socks5h", a):
+            return Timings(0, 0, connected - start, perf_counter() - connected, 0.0, 0.0)
+        if scheme == "https" and protocol == "https":
+            s = TLSTunnel(s, TLS_CONTEXT, target_host)  # TLS to the server inside TLS to the proxy
+        elif scheme == "https":
+            s = TLS_CONTEXT.wrap_socket(s, server_hostname=target_host)
+        handshaken = perf_counter()
+        s.sendall(http_get_request(url, generate_headers(), absolute, a))
+        with s.makefile("rb") as response:
+            status = parse_http_status(response.readline(65537))
+            first_byte = perf_counter()
+            while response.readline(65537) not in (b"\r\n", b"\n", b""):
+                pass  # the headers aren't counted
+            size = 0
+            deadline = None if max_time is None else first_byte + max_time
+            while max_bytes is None or size < max_bytes:
+                chunk = response.read1(65536 if max_bytes is None else min(65536, max_bytes - size))
+                if not chunk:
+                    break
+                size += len(chunk)
+                if deadline is not None and perf_counter() >= deadline:
+                    break  # the rest of the body is dropped along with the connection
+        end = perf_counter()
+        return Timings(status, size, connected - start, handshaken - connected, first_byte - handshaken,
+                       end - first_byte)
+    finally:
+        s.close()
+
+
+def fetch_with_session(session: requests.Session, url: str, proxies: dict[str, str], timeout: float,
+                       connect_timeout: Optional[float] = None,
+                       max_bytes: Optional[int] = None, max_time: Optional[float] = None) -> Timings:
+    """
+    GETs the url through the proxy with a session, which keeps the connections alive (see netutils.pooled_session),
+    so that the repeated checks of a proxy spare the connection and the handshakes.
+    Those aren't timed then, neither is the TTFB, if the session had to open a new connection (it includes them).
+    :param session: session, the adapter of which is a netutils.ProxyAdapter
+    :param url: the url to GET
+    :param proxies: requests proxy routing dict (see Proxy.dict)
+    :param timeout: timeout of every exchange after the connection
+    :param connect_timeout: timeout of the connection to the proxy (defaults to timeout)
+    :param max_bytes: the body is read up to this many bytes, the whole of it by default
+    :param max_time: the body is read for this many seconds after the first byte at most
+    :return: the timings
+    """
+    response = session.get(url, proxies=proxies, stream=True,
+                           timeout=(timeout if connect_timeout is None else connect_timeout, timeout))
+    try:
+        first_byte = perf_counter()
+        # the time from the request sent to the parsed headers
+        ttfb = response.elapsed.total_seconds() if getattr(response, "connection_reused", False) else None
+        size = 0
+        if response.status_code == 200:
+            deadline = None if max_time is None else first_byte + max_time
+            while max_bytes is None or size < max_bytes:
+                chunk = response.raw.read1(65536 if max_bytes is None else min(65536, max_bytes - size),
+                                           decode_content=False)
+                if not chunk:
+                    break  # the connection goes back to the session
+                size += len(chunk)
+                if deadline is not None and perf_counter() >= deadline:
+                    break  # the rest of the body is dropped along with the connection
+        return Timings(response.status_code, size, None, None, ttfb, perf_counter() - first_byte)
+    finally:
+        response.close()
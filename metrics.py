@@ -0,0 +1,299 @@
+"""
+Counters and histograms of a proxy pool, in the Prometheus text format.
+The counters are updated on the hot path, so they're a dict update under a lock of their own
+(see the metrics benchmark for its cost), the gauges (pool size, queue depth, checks in flight, ...) are only computed, when they're asked for.
+"""
+from __future__ import annotations
+from typing import Optional, Callable, Iterable
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import isinf
+import threading
+
+
+# seconds: from the fast local proxies up to the adaptive timeouts of the slow ones
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+labels = tuple[str, ...]
+# (name suffix, label names and values, value) of a single line of the exposition
+sample = tuple[str, dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render(families: Iterable[tuple[str, str, str, list[sample]]]) -> str:
+    """
+    :param families: (name, type, help, samples) of every metric
+    :return: the metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for name, kind, help, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, label_values, value in samples:
+            if label_values:
+                pairs = ",".join(f'{k}="{_escape(str(v))}"' for k, v in label_values.items())
+                lines.append(f"{name}{suffix}{{{pairs}}} {_format(value)}")
+            else:
+                lines.append(f"{name}{suffix} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class Counter:
+    """
+    Monotonic counter, with a value per combination of the label values.
+    """
+    __slots__ = ("name", "help", "label_names", "_values", "_lock")
+
+    def __init__(self, name: str, help: str, label_names: labels = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values: dict[labels, float] = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def values(self) -> dict[labels, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def drain(self) -> dict[labels, float]:
+        # the values counted since the previous drain
+        with self._lock:
+            values, self._values = self._values, dict()
+        return values
+
+    def merge(self, values: dict[labels, float]) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def family(self) -> tuple[str, str, str, list[sample]]:
+        samples = [("_total", dict(zip(self.label_names, key)), value) for key, value in self.values().items()]
+        return self.name, "counter", self.help, samples
+
+
+class Histogram:
+    """
+    Histogram over fixed buckets, with a histogram per combination of the label values.
+    """
+    __slots__ = ("name", "help", "label_names", "buckets", "_values", "_lock")
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS,
+                 label_names: labels = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count of every bucket (not cumulative) and of the values above the last one, sum]
+        self._values: dict[labels, list] = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect_left(self.buckets, value)  # the buckets are "less than or equal"
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def values(self) -> dict[labels, tuple[list[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+    def summary(self, *label_values: str) -> dict[str, float]:
+        """
+        :return: count, sum and the quantiles estimated from the buckets (their upper bounds)
+        """
+        counts, total = self.values().get(label_values, ([0] * (len(self.buckets) + 1), 0.0))
+        observed = sum(counts)
+        result = {"count": observed, "sum": total}
+        for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            seen = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                seen += n
+                if observed and seen >= q * observed:
+                    result[name] = bound
+                    break
+            else:
+                result[name] = 0.0
+        return result
+
+    def drain(self) -> dict[labels, list]:
+        with self._lock:
+            values, self._values = self._values, dict()
+        return values
+
+    def merge(self, values: dict[labels, list]) -> None:
+        with self._lock:
+            for key, (counts, total) in values.items():
+                entry = self._values.get(key)
+                if entry is None:
+                    entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+    def family(self) -> tuple[str, str, str, list[sample]]:
+        samples = []
+        for key, (counts, total) in self.values().items():
+            label_values = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                samples.append(("_bucket", {**label_values, "le": _format(bound)}, cumulative))
+            samples.append(("_sum", label_values, total))
+            samples.append(("_count", label_values, cumulative))
+        return self.name, "histogram", self.help, samples
+
+
+class Metrics:
+    """
+    Counters and histograms of the checks of a pool (see ProxyPool.stats and ProxyPool.prometheus).
+    """
+    candidates: Counter
+    connects: Counter
+    protocol_checks: Counter
+    checks_started: Counter
+    checks: Counter
+    check_seconds: Histogram
+    phase_seconds: Histogram
+
+    def __init__(self, prefix: str = "proxypool"):
+        """
+        :param prefix: prefix of the metric names
+        """
+        self.prefix = prefix
+        self.candidates = Counter(f"{prefix}_candidates", "Candidates passed to the pool, by what became of them: "
+                                  "submitted, duplicate (in the pool or being checked already), "
+                                  "blocked (by the negative cache), "
+                                  "deferred (a limit reached, or out of sockets).", ("outcome",))
+        self.connects = Counter(f"{prefix}_connects", "Connection tests of the candidates.", ("result",))
+        self.protocol_checks = Counter(f"{prefix}_protocol_checks", "Checks of a single protocol of a proxy.",
+                                       ("protocol", "result"))
+        self.checks_started = Counter(f"{prefix}_checks_started", "Checks of the candidates started.")
+        self.checks = Counter(f"{prefix}_checks", "Checks of the candidates finished: online, offline, "
+                              "aborted (the pool has been cancelled), error (the check has raised).",
+                              ("result",))
+        self.check_seconds = Histogram(f"{prefix}_check_duration_seconds", "Duration of the check of a candidate.")
+        self.phase_seconds = Histogram(f"{prefix}_request_phase_seconds", "Phases of the successful test requests "
+                                       "through the proxies: connect, handshake, ttfb.", label_names=("phase",))
+        self._lock = threading.Lock()
+        self._rate_time = 0.0  # monotonic time of the previous rate
+        self._rate_checks = 0.0
+        self._rate = 0.0
+
+    def _all(self) -> tuple[Counter | Histogram, ...]:
+        return (self.candidates, self.connects, self.protocol_checks, self.checks_started, self.checks,
+                self.check_seconds, self.phase_seconds)
+
+    def finished(self) -> float:
+        return sum(self.checks.values().values())
+
+    def in_flight(self) -> float:
+        return max(self.checks_started.value() - self.finished(), 0)
+
+    def rate(self, now: float, min_interval: float = 1.0) -> float:
+        """
+        :param now: monotonic time
+        :param min_interval: the rate is only recalculated, when at least this many seconds have passed
+        :return: checks finished per second since the previous recalculation
+        """
+        with self._lock:
+            elapsed = now - self._rate_time
+            if elapsed >= min_interval:
+                finished = self.finished()
+                if self._rate_time:
+                    self._rate = (finished - self._rate_checks) / elapsed
+                self._rate_time = now
+                self._rate_checks = finished
+            return self._rate
+
+    def drain(self) -> dict[str, dict]:
+        """
+        :return: the values counted since the previous drain (to be merged into another Metrics)
+        """
+        return {metric.name: metric.drain() for metric in self._all()}
+
+    def merge(self, state: dict[str, dict]) -> None:
+        for metric in self._all():
+            values = state.get(metric.name)
+            if values:
+                metric.merge(values)
+
+    def families(self) -> list[tuple[str, str, str, list[sample]]]:
+        return [metric.family() for metric in self._all()]
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.collect().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    HTTP endpoint of the metrics (GET /metrics), which serves from a daemon thread.
+    >>> with ProxyPool(urls) as pool, MetricsServer(pool.prometheus, port=9464):
+    >>>     pool.add_many(random_proxies)
+    """
+    daemon_threads = True
+
+    def __init__(self, collect: Callable[[], str], host: str = "127.0.0.1", port: int = 0):
+        """
+        :param collect: returns the metrics in the Prometheus text format
+        :param host: address to bind to
+        :param port: port to bind to, 0 picks a free one
+        """
+        super().__init__((host, port), MetricsHandler)
+        self.collect = collect
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> MetricsServer:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.serve_forever, name="MetricsServer", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
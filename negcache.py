@@ -0,0 +1,98 @@
+from __future__ import annotations
+from typing import Union, Hashable
+from itertools import islice
+from time import monotonic
+import threading
+from netutils import pack_host_port
+
+
+class NegativeCache:
+    """
+    Remembers the candidates, which failed their checks, so that they aren't checked again for a while:
+    the window starts at base seconds and grows by factor with every failure in a row, up to max_backoff.
+    At most capacity candidates are remembered, the least recently seen ones are forgotten first.
+    IPv4 candidates are keyed on a single int (ip << 16 | port) and the entries are plain ints in a plain dict
+    (which keeps the order of the insertions), so that a million dead candidates take about 110 MB.
+    """
+    capacity: int
+    base: float
+    factor: float
+    max_backoff: float
+    skipped: int  # number of times a candidate has been reported as blocked
+
+    def __init__(self, capacity: int = 1_000_000, base: float = 120., factor: float = 2.,
+                 max_backoff: float = 24 * 3600.):
+        """
+        :param capacity: max number of candidates remembered, 0 turns the cache off
+        :param base: backoff window after the first failure (seconds)
+        :param factor: the window is multiplied by it after every next failure
+        :param max_backoff: max backoff window (seconds)
+        """
+        if capacity < 0:
+            raise ValueError(f"capacity={capacity}: must not be negative.")
+        if base <= 0 or factor < 1:
+            raise ValueError(f"base={base}, factor={factor}: base must be positive, factor must be at least 1.")
+        self.capacity = capacity
+        self.base = base
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.skipped = 0
+        # key -> retry time (ms) << 8 | failures in a row, the least recently seen first
+        self._entries: dict[Union[int, Hashable], int] = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(host: str, port: int) -> Union[int, tuple[str, int]]:
+        try:
+            return pack_host_port(host, port)
+        except OSError:
+            return host, port  # a host name or an IPv6 address
+
+    def blocked(self, host: str, port: int) -> bool:
+        """
+        :return: whether the candidate failed recently and is still within its backoff window
+        """
+        key = self._key(host, port)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self._entries[key] = entry  # the most recently seen now
+            if entry >> 8 <= monotonic() * 1000:
+                return False  # the window is over, but the failures are kept, so the next one backs off longer
+            self.skipped += 1
+            return True
+
+    def fail(self, host: str, port: int) -> None:
+        if not self.capacity:
+            return
+        key = self._key(host, port)
+        with self._lock:
+            failures = min((self._entries.pop(key, 0) & 0xFF) + 1, 0xFF)
+            window = min(self.base * self.factor ** (failures - 1), self.max_backoff)
+            self._entries[key] = int((monotonic() + window) * 1000) << 8 | failures
+            if len(self._entries) > self.capacity:
+                self._evict()
+
+    def _evict(self) -> None:
+        # the oldest eighth is dropped at once, since the dict has to be rebuilt to drop its head cheaply,
+        # which makes it amortized O(1) per insertion
+        n = len(self._entries) - self.capacity + self.capacity // 8
+        self._entries = dict(islice(self._entries.items(), n, None))
+
+    def failures(self, host: str, port: int) -> int:
+        with self._lock:
+            return self._entries.get(self._key(host, port), 0) & 0xFF
+
+    def forget(self, host: str, port: int) -> None:
+        key = self._key(host, port)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,21 +1,154 @@
 import random
 import ipaddress
 import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
 from typing import Optional
+from array import array
+import socket
+import struct
 import re
 
+try:
+    import numpy
+except ImportError:  # optional, extract_host_port_records returns an array.array without it
+    numpy = None
+
 
 IPv4_REGEX = r"\b(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\b"
 IPv4_PORT_REGEX = r"\b(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5]):((6553[0-5])|(655[0-2][0-9])|(65[0-4][0-9][0-9])|(6[0-4][0-9][0-9][0-9])|([1-5][0-9][0-9][0-9][0-9])|([1-9][0-9][0-9][0-9])|([1-9][0-9][0-9])|([0-9])|([1-9][0-9]))\b"
 # taken from https://regexland.com/base64/
 BASE64_WORD_REGEX = r"(?:[A-Za-z\d+/]{4})*(?:[A-Za-z\d+/]{3}=|[A-Za-z\d+/]{2}==)?"
+_IPv4_PORT_PATTERN = re.compile(IPv4_PORT_REGEX)
+# the shape of IPv4_PORT_REGEX only, the ranges are checked on the numbers: much cheaper than the alternations
+_HOST_PORT_BYTES_PATTERN = re.compile(rb"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d{1,5}\b")
+_LEADING_ZERO_PATTERN = re.compile(rb"(?<!\d)0\d")
+_SEPARATORS = bytes.maketrans(b".:", b"  ")
+# the word characters of the \b of the pattern, but the digits (see _scan_host_port_records)
+_LETTERS = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_"
+if numpy is not None:
+    _IS_LETTER = numpy.zeros(256, dtype=bool)
+    _IS_LETTER[list(_LETTERS)] = True
+    # by the number of digits (up to 8): the bytes of a little endian word, which hold them (see _parse_digits),
+    # "0" in those bytes, the smallest number without a leading zero
+    _DIGIT_MASKS = numpy.array([0] + [(1 << 64) - (1 << 8 * (8 - n)) for n in range(1, 9)], dtype=numpy.uint64)
+    _ZEROS = _DIGIT_MASKS & numpy.uint64(0x3030303030303030)
+    _SMALLEST = numpy.array([0, 0] + [10 ** (n - 1) for n in range(2, 9)], dtype=numpy.uint64)
+    _SEPARATORS_WORD = int.from_bytes(b"...:", "little")
+    _MAX_GROUP_LENGTHS = numpy.array([3, 3, 3, 3, 5])
+    _MAX_NUMBERS = numpy.array([255, 255, 255, 255, 65535], dtype=numpy.uint64)
 
 
 def find_host_port_pairs(text: str) -> list[str]:
-    pairs = []
-    for pair in re.finditer(IPv4_PORT_REGEX, text):
-        pairs.append(pair[0])
-    return pairs
+    return [pair[0] for pair in _IPv4_PORT_PATTERN.finditer(text)]
+
+
+def extract_host_port_records(data: bytes, as_numpy: bool = True):
+    """
+    Bulk counterpart of find_host_port_pairs for the raw (not decoded) pages and dumps:
+    finds the same "ip:port" pairs, but returns them packed as ip << 16 | port, where ip is the 32-bit address.
+    With numpy installed, the whole buffer is scanned by numpy, without it by a bytes regex (a few times slower).
+    :param data: the text as bytes
+    :param as_numpy: return a numpy uint64 array, when numpy is installed
+    :return: the records in the order of appearance, duplicates included; array("Q") without numpy
+    """
+    if numpy is not None:
+        records = _scan_host_port_records(data)
+        if as_numpy:
+            return records
+        packed = array("Q")
+        packed.frombytes(records.tobytes())
+        return packed
+    matches = _HOST_PORT_BYTES_PATTERN.findall(data)
+    if not matches:
+        return array("Q")
+    numbers = b" ".join(matches)
+    if _LEADING_ZERO_PATTERN.search(numbers):
+        # rare, so it's fine to go through the matches one by one (IPv4_PORT_REGEX doesn't match those)
+        matches = [match for match in matches if not _LEADING_ZERO_PATTERN.search(match)]
+        numbers = b" ".join(matches)
+    numbers = numbers.translate(_SEPARATORS)
+    records = array("Q")
+    it = iter(map(int, numbers.split()))
+    for a, b, c, d, port in zip(it, it, it, it, it):
+        if a <= 255 and b <= 255 and c <= 255 and d <= 255 and port <= 65535:
+            records.append((((a << 8 | b) << 8 | c) << 8 | d) << 16 | port)
+    return records
+
+
+def _scan_host_port_records(data: bytes):
+    # the matches of _HOST_PORT_BYTES_PATTERN consist of digits and separators only,
+    # so they are found within the runs of those: nearly every run of a page is either a plain "ip:port"
+    # (4 digit groups, 3 dots and a colon between them, no word characters around), which is parsed by numpy,
+    # or has less than 4 separators, so it can't be one. The rest of the runs are left to the regex.
+    a = numpy.frombuffer(data, dtype=numpy.uint8)
+    is_separator = (a == ord(".")) | (a == ord(":"))
+    in_run = numpy.zeros(len(a) + 2, dtype=bool)  # a non-run byte on both sides, so the edges come in pairs
+    numpy.bitwise_or(a - numpy.uint8(ord("0")) < 10, is_separator, out=in_run[1:-1])
+    edges = numpy.flatnonzero(in_run[1:] != in_run[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    separators = numpy.flatnonzero(is_separator)
+    first = numpy.searchsorted(separators, starts)
+    count = numpy.searchsorted(separators, ends) - first
+    candidates = count >= 4
+    starts, ends, first, count = starts[candidates], ends[candidates], first[candidates], count[candidates]
+    if not len(starts):
+        return numpy.zeros(0, dtype=numpy.uint64)
+    # the runs neighbour non-digits only, \b fails next to the rest of the word characters
+    before = (starts > 0) & _IS_LETTER[a[numpy.maximum(starts - 1, 0)]]
+    after = (ends < len(a)) & _IS_LETTER[a[numpy.minimum(ends, len(a) - 1)]]
+    plain = (count == 4) & ~before & ~after
+    s = separators[numpy.minimum(first[:, None] + numpy.arange(4), len(separators) - 1)]  # only meant for plain
+    bounds = numpy.column_stack((starts - 1, s, ends))  # the groups are between the neighbouring bounds
+    lengths = numpy.diff(bounds, axis=1) - 1
+    plain &= a[s].view("<u4")[:, 0] == _SEPARATORS_WORD  # the 4 separators are 3 dots and a colon
+    plain &= ((lengths - 1).view(numpy.uint64) < _MAX_GROUP_LENGTHS).all(axis=1)  # 1 to 3 digits, the port 1 to 5
+    lengths = numpy.clip(lengths, 0, 8)  # of the plain ones, anyway
+    numbers = _parse_digits(a, bounds[:, 1:], lengths)
+    valid = plain & ((numbers >= _SMALLEST[lengths]) & (numbers <= _MAX_NUMBERS)).all(axis=1)  # no leading zeros
+    v = numbers[valid]
+    records = (((v[:, 0] << 8 | v[:, 1]) << 8 | v[:, 2]) << 8 | v[:, 3]) << 16 | v[:, 4]
+    odd = numpy.flatnonzero(~plain)
+    if not len(odd):
+        return records
+    # rare: a run with more separators or word characters around, which the regex finds the pairs in, if any
+    positions, extra = list(starts[valid]), []
+    for start, end in zip(starts[odd].tolist(), ends[odd].tolist()):
+        lo = max(start - 1, 0)  # a neighbour on both sides, since the \b of the pattern looks at them
+        for match in _HOST_PORT_BYTES_PATTERN.finditer(data[lo:end + 1]):
+            if _LEADING_ZERO_PATTERN.search(match[0]):
+                continue
+            b1, b2, b3, b4, port = map(int, match[0].translate(_SEPARATORS).split())
+            if b1 <= 255 and b2 <= 255 and b3 <= 255 and b4 <= 255 and port <= 65535:
+                positions.append(lo + match.start())
+                extra.append((((b1 << 8 | b2) << 8 | b3) << 8 | b4) << 16 | port)
+    if not extra:
+        return records
+    records = numpy.concatenate((records, numpy.array(extra, dtype=numpy.uint64)))
+    return records[numpy.argsort(positions, kind="stable")]
+
+
+def _parse_digits(a, ends, lengths):
+    # the numbers of the digits a[ends - lengths:ends] (up to 8 of them), all at once:
+    # the 8 bytes before every end are loaded as a little endian integer, the ones before the digits are zeroed,
+    # then the digits are combined pairwise by multiplication (the "SWAR" parsing of simdjson and the likes)
+    padded = numpy.zeros(len(a) + 8, dtype=numpy.uint8)
+    padded[8:] = a
+    words = numpy.ndarray((len(a) + 1,), dtype="<u8", buffer=padded, strides=(1,))  # words[i] holds a[i - 8:i]
+    x = (words[ends] & _DIGIT_MASKS[lengths]) - _ZEROS[lengths]  # the digits are 0-9 now, the rest of the bytes 0
+    x = x * numpy.uint64(10) + (x >> numpy.uint64(8))
+    x = ((x & numpy.uint64(0x000000FF000000FF)) * numpy.uint64(100 + (1000000 << 32)) +
+         ((x >> numpy.uint64(16)) & numpy.uint64(0x000000FF000000FF)) * numpy.uint64(1 + (10000 << 32)))
+    return x >> numpy.uint64(32)
+
+
+def pack_host_port(host: str, port: int) -> int:
+    return int.from_bytes(socket.inet_aton(host), "big") << 16 | port
+
+
+def unpack_host_port(record: int) -> tuple[str, int]:
+    record = int(record)  # might be a numpy integer
+    return socket.inet_ntoa(struct.pack(">I", record >> 16)), record & 0xFFFF
 
 
 def valid_ip(ip: str) -> bool:
@@ -98,6 +231,51 @@ def default_session() -> requests.Session:
     return session
 
 
+class ProxyAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, which keeps the connection pools of only the last max_proxies proxies.
+    The stock adapter never forgets a proxy, which means a leak, when thousands of proxies are checked.
+    The streamed responses tell, whether they came over a kept alive connection (response.connection_reused).
+    """
+    def __init__(self, max_proxies: int = 16, **kwargs):
+        self.max_proxies = max_proxies
+        super().__init__(**kwargs)
+        self.proxy_manager = OrderedDict()
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        self.proxy_manager.move_to_end(proxy)
+        while len(self.proxy_manager) > self.max_proxies:
+            _, evicted = self.proxy_manager.popitem(last=False)
+            evicted.clear()  # closes the connections
+        return manager
+
+    def build_response(self, req, resp):
+        response = super().build_response(req, resp)
+        # the connection is only attached to the streamed responses, it has been reused,
+        # if it has carried a response over the same socket before
+        connection = getattr(resp, "connection", None)
+        sock = getattr(connection, "sock", None)
+        response.connection_reused = sock is not None and getattr(connection, "_last_sock", None) is sock
+        if sock is not None:
+            connection._last_sock = sock
+        return response
+
+
+def pooled_session(pool_connections: int = 10, pool_maxsize: int = 1, max_proxies: int = 16) -> requests.Session:
+    """
+    Session, which keeps the connections alive through the last max_proxies proxies.
+    :param pool_connections: number of hosts to keep connections to (per proxy)
+    :param pool_maxsize: number of connections to keep per host (how many threads use the session at once)
+    :param max_proxies: number of proxies to keep connection pools for
+    """
+    session = default_session()
+    adapter = ProxyAdapter(max_proxies, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def download_file_from_url(from_url: str, dest_path: str, session: Optional[requests.Session]) -> None:
     if not session:
         session = default_session()
@@ -0,0 +1,129 @@
+"""
+Local test server of deterministic payloads, which can be used as the test url of a pool:
+GET /bytes/<n> answers with n bytes, byte i of which is i % 256,
+GET /bytes/<n>?rate=<bytes per second> sends them no faster than that (to emulate slow links).
+Run as a script: python payload_server.py [port]
+"""
+from __future__ import annotations
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from time import monotonic, sleep
+import re
+import sys
+import threading
+
+
+MAX_PAYLOAD = 1 << 30  # bytes
+CHUNK = 65536  # bytes written at once, a multiple of 256, so that every chunk starts with byte 0
+PATTERN = bytes(range(256)) * (CHUNK // 256)
+_PATH = re.compile(r"/bytes/(\d+)")
+
+
+class PayloadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    wbufsize = CHUNK  # headers and body in one segment, otherwise delayed ACKs stall the kept-alive connections
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        match = _PATH.fullmatch(parts.path)
+        if match is None or int(match[1]) > MAX_PAYLOAD:
+            self.send_error(404)
+            return
+        size = int(match[1])
+        try:
+            rate = float(parse_qs(parts.query)["rate"][0])
+        except KeyError:
+            rate = None
+        except ValueError:
+            self.send_error(400, "rate must be a number")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        start = monotonic()
+        sent = 0
+        try:
+            while sent < size:
+                n = min(CHUNK, size - sent)
+                self.wfile.write(PATTERN[:n])
+                sent += n
+                if rate:
+                    self.wfile.flush()
+                    delay = start + sent / rate - monotonic()
+                    if delay > 0:
+                        sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # the client has read as much as it wanted
+
+    def log_message(self, *args):
+        pass
+
+
+class PayloadServer(ThreadingHTTPServer):
+    """
+    Payload server, which serves from a daemon thread.
+    The proxies only reach it, if it's bound to an address reachable from them (127.0.0.1 is fine for local ones).
+    >>> with PayloadServer().start() as server:
+    >>>     with ProxyPool([server.url(1 << 20)], throughput_bytes=256 << 10) as pool:
+    >>>         pool.add_many(local_proxies)
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        :param host: address to bind to
+        :param port: port to bind to, 0 picks a free one
+        """
+        super().__init__((host, port), PayloadHandler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def url(self, size: int, rate: Optional[float] = None) -> str:
+        """
+        :param size: bytes of the payload
+        :param rate: bytes per second, the payload is sent at most that fast
+        :return: url of the payload
+        """
+        url = f"http://{self.server_address[0]}:{self.port}/bytes/{size}"
+        if rate is None:
+            return url
+        return f"{url}?rate={f'{rate:f}'.rstrip('0').rstrip('.')}"  # no exponent, since "+" means " " in a query
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):  # clients hang up, once they've read enough
+            super().handle_error(request, client_address)
+
+    def start(self) -> PayloadServer:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.serve_forever, name="PayloadServer", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    server = PayloadServer("0.0.0.0", int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print(f"Serving payloads on port {server.port}: /bytes/<n>[?rate=<bytes per second>]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,15 +1,27 @@
 from __future__ import annotations
-from typing import Optional, Collection, Callable, Union
+from typing import Optional, Collection, Callable, Union, Iterable, Iterator, TYPE_CHECKING
 from sortedcontainers.sortedlist import SortedList
 import requests
 import socket
-import http.client
-from time import time
-from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter
+from concurrent.futures import ThreadPoolExecutor, Future
 import random
-from netutils import generate_headers
-from datetime import datetime
+import threading
+import queue
+from netutils import generate_headers, pooled_session
+from measure import Timings, fetch, fetch_with_session, MIN_THROUGHPUT_BYTES
+from sweep import connect_sweep
+from probe import probe as probe_protocols
+from history import Health
+from sampling import WeightedSampler
+from negcache import NegativeCache
+from timeouts import AdaptiveTimeouts
+from concurrency import AIMDController, is_local_error
+from metrics import Metrics, MetricsServer, render
+from contextlib import contextmanager
 from sys import maxsize
+if TYPE_CHECKING:
+    from store import ProxyStore
 
 
 PROXY_PROTOCOLS = {"http", "https", "socks4", "socks4a", "socks5", "socks5h"}
@@ -34,15 +46,22 @@ def proxy_string(protocol: str, host: str, port: int, a: auth) -> str:
     return s
 
 
-class Proxy:
+class Proxy(Health):
+    # there might be millions of them, the history of the checks is kept in the slots of Health
+    __slots__ = ("protocols", "host", "port", "auth", "_response_speed", "_uptime", "_rank",
+                 "_connect_latency", "_handshake_latency", "_read_latency", "_inconclusive", "pool")
+
     protocols: list[str]
     host: str
     port: int
     auth: Optional[tuple[str, Optional[str]]]  # socks4, socks4a do not have a password by design
-    response_stats: list[tuple[float, datetime]]  # speed of the proxy at given DT
-    online_checks: list[tuple[bool, datetime]]
     _response_speed: float
     _uptime: float
+    _rank: float  # rating, by which the proxy is currently positioned in the pool
+    _connect_latency: float  # average latency of the connections to the proxy (seconds), 0.0 if unknown
+    _handshake_latency: float  # average duration of the TLS and proxy protocol handshakes (seconds)
+    _read_latency: float  # average time to the first byte of the responses through the proxy (seconds)
+    _inconclusive: bool  # the last check has hit local errors or a throttled test url, so it doesn't prove failure
     pool: ProxyPool
 
     def __init__(self, pool: ProxyPool, host: str, port: int, auth: Optional[tuple[str, Optional[str]]] = None):
@@ -56,39 +75,55 @@ class Proxy:
         self.pool = pool
         self.protocols = []
 
-        self.response_stats = []
+        super().__init__()  # throughputs and online flags of the last pool.history_size checks
         self._response_speed = 0.0
-        self.online_checks = []
         self._uptime = 0.0
+        self._rank = 0.0
+        self._connect_latency = 0.0
+        self._handshake_latency = 0.0
+        self._read_latency = 0.0
+        self._inconclusive = False
 
     def supports(self, protocol: str) -> bool:
         return protocol in self.protocols
 
-    def _cache_uptime(self) -> None:
-        if not self.online_checks:
-            self._uptime = 0.0
-            return
-        times_online = 0.
-        for online in self.online_checks:
-            b, dt = online
-            times_online += b
-        self._uptime = times_online / len(self.online_checks)
-
-    def _cache_speed(self) -> None:
-        """
-        :return: mean response speed (kbytes per second)
-        """
-        if not self.response_stats:
-            self._response_speed = 0.0
-            return
-        speed = 0.0
-        for sp in self.response_stats:
-            s, dt = sp
-            speed += s
-        self._response_speed = speed / len(self.response_stats) / 1024.  # there is 1024 bytes per kbyte
+    def _cache_health(self) -> None:
+        # means over the last pool.history_size checks
+        self._uptime = self.uptime()
+        self._response_speed = self.mean_speed() / 1024.  # there is 1024 bytes per kbyte
+        self.pool.rerank(self)  # rating has changed
+
+    @property
+    def connect_latency(self) -> float:
+        """
+        :return: average latency of the connections to the proxy (seconds), 0.0 if unknown
+        """
+        return self._connect_latency
+
+    @property
+    def handshake_latency(self) -> float:
+        """
+        :return: average duration of the handshakes through the proxy (seconds), 0.0 if unknown
+        """
+        return self._handshake_latency
+
+    @property
+    def ttfb(self) -> float:
+        """
+        :return: average time from a request to the first byte of the response (seconds), 0.0 if unknown
+        """
+        return self._read_latency
+
+    @property
+    def throughput(self) -> float:
+        """
+        :return: average sustained throughput (kbytes per second), the latencies excluded,
+                 0.0 if unknown (the test pages are too small to measure it, see measure.MIN_THROUGHPUT_BYTES)
+        """
+        return self._response_speed
 
     def rating(self) -> float:
-        return self._response_speed * self._uptime
+        return self.pool.score(self)
 
     def __eq__(self, other: hostport) -> bool:
         host, port = parse_host_port(other)
@@ -100,10 +135,7 @@ class Proxy:
         return f"{self.__repr__()};{speed};{uptime};"
 
     def add_online(self, b: bool) -> None:
-        self.online_checks.append((b, datetime.now()))
-
-    def add_speed(self, f: float) -> None:
-        self.response_stats.append((f, datetime.now()))
+        self._record(b, self.pool.history_size)
 
     def __repr__(self):
         s = f"[{','.join(self.protocols)}]://"
@@ -126,9 +158,6 @@ class Proxy:
         s += f"{self.host}:{self.port}"
         return s
 
-    def last_online(self) -> bool:
-        return self.online_checks[-1][0]
-
     def dict(self, protocol: Optional[str] = None):
         if not protocol:
             random.choice(self.protocols)
@@ -146,42 +175,48 @@ class Proxy:
         # the only way to check if a proxy follows the protocol is to connect through it to a server.
         # only in case of a successful connection can we speak of the proxy following the protocol.
 
+        # the first check of a proxy and a sample of the later ones go over a fresh connection (see measure.py),
+        # which times the connection and the handshakes separately from the transfer,
+        # the rest reuse the connections kept alive by the sessions of the pool, which spares the handshakes
+        fresh = not self._handshake_latency or random.random() < self.pool.fresh_connection_rate
         # requests proxy routing dict
         proxies = self.dict(protocol)  # this means "route all https and http traffic through this proxy"
         urls = self.pool.urls.copy()
         random.shuffle(urls)
         for url in urls:
+            if self.pool.cancelled():
+                return False
+            connect_timeout, timeout = self.pool.timeouts.request(self)
             try:
                 # check every test url
-                start = time()
-                response = requests.get(url, headers=generate_headers(), proxies=proxies,
-                                        timeout=self.pool.timeout, stream=True)
-                if response.status_code == 200:
-                    # if 200, then most probably this is a working proxy server which speaks this protocol
-                    # (rarely it will be a server, which allows CONNECT requests
-                    #  and answers with 200 to anything you feed it)
-                    end = time()
-                    # calculate speed of the response (bytes per second)
-                    size = len(response.raw.data)
-                    dt = end - start
-                    self.add_speed(size / dt)  # add speed record
-                    self._cache_speed()  # calculate cached value
-                    return True
-                elif response.status_code == 407:
-                    # this means bad authentication
-                    # no use checking further
-                    return False  # no speed
-                # else try another url
-            except requests.exceptions.Timeout as ex:
-                pass
-            except requests.exceptions.ProxyError as ex:
-                pass
-            except requests.exceptions.ConnectionError as ex:
-                pass
-            except http.client.IncompleteRead as ex:
-                pass
-            except Exception as ex:
-                pass
+                if fresh:
+                    timings = fetch(self.host, self.port, protocol, url, timeout, connect_timeout, self.auth,
+                                    self.pool.throughput_bytes, self.pool.throughput_window)
+                else:
+                    with self.pool.session(protocol) as session:
+                        timings = fetch_with_session(session, url, proxies, timeout, connect_timeout,
+                                                     self.pool.throughput_bytes, self.pool.throughput_window)
+            except OSError as ex:  # timeouts, TLS errors and requests exceptions included
+                if self.pool._local_error(ex):
+                    self._inconclusive = True
+                continue
+            except Exception as ex:  # garbage instead of a handshake reply
+                continue
+            if timings.status == 200:
+                # if 200, then most probably this is a working proxy server which speaks this protocol
+                # (rarely it will be a server, which allows CONNECT requests
+                #  and answers with 200 to anything you feed it)
+                self._observe(timings)
+                return True
+            elif timings.status == 407:
+                # this means bad authentication
+                # no use checking further
+                return False  # no speed
+            elif timings.status in (429, 503):
+                self._inconclusive = True  # the test url is throttled, which says nothing about the proxy
+                if self.pool.concurrency is not None:
+                    self.pool.concurrency.error()  # the test url might be overloaded by us
+            # else try another url
         # no server has responded positively
         # 3 main reasons for that:
         # 1. Proxy is bad.
@@ -191,19 +226,66 @@ class Proxy:
         # #3 doesn't really matter, in the end, since we cannot be held responsible for this issue.
         return False  # no speed
 
-    def check(self) -> None:
-        try:
-            # if this sequence goes well,
-            # then the remote server allows connections to the port
-            # and it might be a proxy server
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((self.host, self.port))
-            s.close()
+    def _observe(self, timings: Timings) -> None:
+        timeouts = self.pool.timeouts
+        phases = self.pool.metrics.phase_seconds
+        # the phases, which haven't been timed (over a kept alive connection), are left as they are
+        if timings.connect is not None:
+            timeouts.observe_connect(timings.connect, self)
+            phases.observe(timings.connect, "connect")
+        if timings.handshake is not None:
+            timeouts.observe_handshake(timings.handshake, self)
+            phases.observe(timings.handshake, "handshake")
+        if timings.ttfb is not None:
+            timeouts.observe_read(timings.ttfb, self)
+            phases.observe(timings.ttfb, "ttfb")
+        # the size of the test page doesn't matter to the throughput, since the time to its first byte is excluded,
+        # as long as it's big enough to be measured at all (a byte budget below the minimum is taken as it is)
+        budget = self.pool.throughput_bytes
+        speed = timings.throughput(MIN_THROUGHPUT_BYTES if budget is None else min(budget, MIN_THROUGHPUT_BYTES))
+        if speed is not None:
+            self.add_speed(speed)  # cached along with the uptime, once the check is over
+
+    def check(self, connect: bool = True) -> bool:
+        """
+        :param connect: whether to test if the proxy accepts connections at all
+                        (pass False, if it has already been done, e.g. by the connect sweep)
+        :return: False, if the check was aborted because the pool had been cancelled (nothing is recorded then)
+        """
+        self._inconclusive = False
+        if connect:
+            try:
+                # if this sequence goes well,
+                # then the remote server allows connections to the port
+                # and it might be a proxy server
+                start = monotonic()
+                s = socket.create_connection((self.host, self.port), timeout=self.pool.timeouts.connect(self))
+                self.pool.timeouts.observe_connect(monotonic() - start, self)
+                s.close()
+                was_able_to_connect = True
+            except OSError as ex:
+                if self.pool._local_error(ex):
+                    return False  # this machine is out of sockets, which says nothing about the proxy
+                # connection to the alleged proxy server was refused, timed out or the host couldn't be resolved
+                was_able_to_connect = False
+            self.pool.metrics.connects.inc("ok" if was_able_to_connect else "failed")
+        else:
             was_able_to_connect = True
-        except ConnectionRefusedError or socket.gaierror or Exception:
-            # connection to the alleged proxy server was refused
-            was_able_to_connect = False
-        if was_able_to_connect:
+        if self.pool.cancelled():
+            return False
+        if was_able_to_connect and self.pool.probe:
+            # find out the protocols with handshakes, then only the first of them gets the real request
+            url = random.choice(self.pool.urls)
+            protocols = probe_protocols(self.host, self.port, url, self.pool.timeouts.read(self),
+                                        self.pool.protocols, self.auth)
+            proxy_is_online = bool(protocols) and self.check_protocol(protocols[0])
+            if self.pool.cancelled() and not proxy_is_online:
+                return False
+            if protocols:
+                self.pool.metrics.protocol_checks.inc(protocols[0], "ok" if proxy_is_online else "failed")
+            self.protocols = protocols if proxy_is_online else []
+            self.add_online(proxy_is_online)
+        elif was_able_to_connect:
             # time to check if we can speak to the proxy via any of the protocols
             with ThreadPoolExecutor(max_workers=self.pool.max_protocol_workers) as pool:
                 futures = []
@@ -220,11 +302,45 @@ class Proxy:
                 if result:
                     protocols.append(protocol)
                     proxy_is_online = True
+            if self.pool.cancelled() and not proxy_is_online:
+                return False  # some of the protocols haven't been checked, so we know nothing
+            self.pool._count_protocols(self.pool.protocols, results)
             self.protocols = protocols
             self.add_online(proxy_is_online)
         else:
             self.add_online(False)
-        self._cache_uptime()  # new cached uptime result
+        self._cache_health()  # new cached uptime and speed
+        self.pool._on_check(self)
+        return True
+
+
+def throughput_score(proxy: Proxy) -> float:
+    """
+    Score of the proxies for bulk downloads: sustained throughput (KB/s) times uptime.
+    The proxies, the throughput of which hasn't been measured (the test page is too small), are scored by latency.
+    """
+    if not proxy._response_speed:
+        return latency_score(proxy)
+    return proxy._response_speed * proxy._uptime
+
+
+def latency_score(proxy: Proxy) -> float:
+    """
+    Score of the proxies for many small requests: uptime per second of a request,
+    which is the connection, the handshakes and the time to the first byte.
+    The proxies, the latencies of which are unknown (e.g. loaded from an older store), are taken to be as slow
+    as the timeout of the pool, so that they can still be handed out.
+    """
+    latency = proxy._connect_latency + proxy._handshake_latency + proxy._read_latency
+    return proxy._uptime / (latency or proxy.pool.timeout)
+
+
+def rating_weight(proxy: Proxy) -> float:
+    return proxy.rating()
+
+
+class NoProxyAvailable(LookupError):
+    pass
 
 
 def empty_callback(proxy: Proxy):
@@ -258,10 +374,27 @@ class ProxyPool:
     >>>
     """
     proxies: SortedList[Proxy]
+    index: dict[tuple[str, int], Proxy]  # (host, port) -> proxy, the same proxies as in the sorted list
     cached_proxies: set[tuple[hostport, auth]]
     urls: list[str]
     protocols: Collection[str]
     timeout: float
+    connect_timeout: float
+    timeouts: AdaptiveTimeouts  # deadlines of the checks, see timeouts.py
+    concurrency: Optional[AIMDController]  # tunes the number of proxies checked at once, see concurrency.py
+    max_sweep_sockets: int
+    probe: bool
+    throughput_bytes: Optional[int]  # max bytes of the test url read by a check
+    throughput_window: Optional[float]  # max seconds of the test url transfer
+    fresh_connection_rate: float  # share of the re-checks, which time the connect and the handshakes again
+    history_size: int
+    sampler: WeightedSampler  # (host, port) -> weight of the proxy, see acquire
+    weight: Callable[[Proxy, ], float]
+    score: Callable[[Proxy, ], float]  # rating of a proxy, by which the pool is sorted
+    max_in_flight: int
+    store: Optional[ProxyStore]  # where the checked proxies are saved to
+    negative_cache: NegativeCache  # the candidates, which failed recently, aren't submitted again (opt-in)
+    metrics: Metrics  # counters and histograms of the checks, see stats and prometheus
     callback: Callable[[Proxy, ], None]
 
     max_proxy_workers: int
@@ -277,10 +410,59 @@ class ProxyPool:
                  protocols: Optional[Collection[str]] = None,
                  max_protocol_workers: int = len(PROXY_PROTOCOLS),
                  max_proxy_workers: int = 5,
-                 callback: Callable[[Proxy, ], None] = empty_callback):
+                 callback: Callable[[Proxy, ], None] = empty_callback,
+                 connect_timeout: Optional[float] = None,
+                 max_sweep_sockets: int = 512,
+                 probe: bool = False,
+                 history_size: int = 16,
+                 weight: Callable[[Proxy, ], float] = rating_weight,
+                 max_in_flight: int = 1,
+                 store: Optional[ProxyStore] = None,
+                 negative_cache: Optional[NegativeCache] = None,
+                 adaptive_timeouts: bool = False,
+                 max_timeout: Optional[float] = None,
+                 concurrency: Optional[AIMDController] = None,
+                 score: Callable[[Proxy, ], float] = throughput_score,
+                 throughput_bytes: Optional[int] = None,
+                 throughput_window: Optional[float] = None,
+                 fresh_connection_rate: float = 0.1,
+                 metrics: Optional[Metrics] = None):
         """
         :param urls: urls to test the proxies against
-        :param timeout: request timeout
+        :param timeout: request timeout (only the initial one, if adaptive_timeouts is on)
+        :param connect_timeout: timeout of the connection to the proxy server itself (defaults to timeout)
+        :param adaptive_timeouts: derive the timeouts from the latencies of the successful checks,
+                                  so timeout and connect_timeout are only seeds used, until there are enough of those
+                                  (off by default: a proxy slower than most may then be rejected,
+                                  even though it answers within timeout)
+        :param max_timeout: upper bound of the adaptive request timeout (2 * timeout by default),
+                            so that the slow, but usable proxies aren't rejected, if there are many of them
+        :param max_sweep_sockets: max number of connection attempts in flight during the connect sweep
+        :param probe: detect the protocols with raw handshakes (see probe.py),
+                      so that only one protocol of every proxy is checked with a real request
+        :param throughput_bytes: the response of a test url is read up to this many bytes, the throughput is measured
+                                 over them, so that every check costs the same (see payload_server.py
+                                 for the test urls of any size), the whole response is read by default,
+                                 the throughput of the responses below 64 KB isn't measured, unless this is lower
+        :param throughput_window: the response of a test url is read for this many seconds at most
+        :param fresh_connection_rate: share of the re-checks of a proxy, which go over a fresh connection
+                                      to time the connect and the handshakes again (the first check always does),
+                                      the rest reuse the connections kept alive by the sessions of the pool
+                                      (a response cut short by throughput_bytes or throughput_window
+                                      takes its connection along, though)
+        :param history_size: number of the latest checks, which the speed and uptime of a proxy are averaged over
+        :param weight: function of a proxy, proportionally to which the proxies are handed out by acquire
+        :param max_in_flight: max number of times a proxy can be acquired, but not released yet
+        :param store: store to save every checked proxy to (see store.py)
+        :param negative_cache: backoff of the candidates, which failed their checks (see negcache.py),
+                               e.g. NegativeCache(), off by default: every candidate is checked every time
+        :param concurrency: controller of the number of proxies checked at once,
+                            which replaces the fixed max_proxy_workers (see concurrency.py)
+        :param score: rating of a proxy, by which the pool is sorted (and weighted by default):
+                      throughput_score for bulk downloads, latency_score for many small requests,
+                      or any function of the connect_latency, handshake_latency, ttfb, throughput and uptime
+        :param metrics: counters and histograms of the checks (see metrics.py), a new Metrics by default,
+                        pass the same one to several pools to count their checks together
         :param max_protocol_workers: max number of protocols per proxy checked simultaneously (min 1)
         :param protocols: set of protocols to check proxies for
         :param callback: callback triggered, when a new alive proxy was found
@@ -288,6 +470,28 @@ class ProxyPool:
         self.urls = urls
         self._headers = generate_headers()
         self.timeout = timeout
+        self.connect_timeout = timeout if connect_timeout is None else connect_timeout
+        self.timeouts = AdaptiveTimeouts(self.connect_timeout, timeout,
+                                         max_read_timeout=max_timeout, adaptive=adaptive_timeouts)
+        self.max_sweep_sockets = max_sweep_sockets
+        self.probe = probe
+        if throughput_bytes is not None and throughput_bytes < 1:
+            raise ValueError(f"throughput_bytes={throughput_bytes}: must be a positive number.")
+        self.throughput_bytes = throughput_bytes
+        self.throughput_window = throughput_window
+        if not 0.0 <= fresh_connection_rate <= 1.0:
+            raise ValueError(f"fresh_connection_rate={fresh_connection_rate}: must be between 0 and 1.")
+        self.fresh_connection_rate = fresh_connection_rate
+        self.history_size = history_size
+        self.weight = weight
+        self.score = score
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight={max_in_flight}: must be a positive number.")
+        self.max_in_flight = max_in_flight
+        self.store = store
+        # a cache of capacity 0 remembers nothing, so that the pool doesn't have to tell if there is one
+        self.negative_cache = negative_cache if negative_cache is not None else NegativeCache(capacity=0)
+        self.metrics = metrics if metrics is not None else Metrics()
         if not protocols:
             protocols = PROXY_PROTOCOLS.copy()
         self.protocols = tuple(protocols)
@@ -295,53 +499,499 @@ class ProxyPool:
         self._initialize_sorted_list()
         self.callback = callback
         self.max_proxy_workers = max_proxy_workers
+        self.concurrency = concurrency
         self._initialize_state_variables()
         self.cached_proxies = set()
+        self._pending = set()  # (host, port) pairs submitted, but not checked yet
+        self._futures = dict()  # future -> proxy, of the submitted checks
+        self._streams = []  # queues of the results iterators
+        self._closed = threading.Event()  # the context of the pool has been exited
+        self._cancelled = threading.Event()
+        self._sessions = {protocol: queue.SimpleQueue() for protocol in PROXY_PROTOCOLS}
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)  # notified when a proxy might become acquirable
 
     def _initialize_sorted_list(self):
-        self.proxies = SortedList(key=lambda proxy: -proxy.rating())  # sort via rating DESC (best first)
+        # sort via rating DESC (best first)
+        # the rating of a proxy changes with every check, so the list is sorted by the snapshot of it
+        # taken, when the proxy was (re)positioned, the address makes every key unique
+        self.proxies = SortedList(key=lambda proxy: (-proxy._rank, proxy.host, proxy.port))
+        self.index = dict()
+        self.sampler = WeightedSampler()
+        self._in_flight = dict()  # (host, port) -> number of times the proxy is acquired
 
     def clear(self):
-        self._initialize_sorted_list()
+        with self._lock:
+            self._initialize_sorted_list()
 
-    def _add(self, proxy: Proxy) -> None:
-        proxy.check()  # check working protocols
-        if proxy.last_online():  # proxy is online
-            self.proxies.add(proxy)  # add the proxy to the list
+    def _insert(self, proxy: Proxy) -> None:
+        # must be called with the lock held
+        proxy._rank = proxy.rating()
+        self.proxies.add(proxy)  # add the proxy to the list
+        self.index[(proxy.host, proxy.port)] = proxy
+        self._update_weight(proxy)
+        self._available.notify()
+
+    def _checked(self, proxy: Proxy) -> Optional[list[queue.Queue]]:
+        # called from the worker, when the check of a submitted proxy is over
+        # the proxy stays pending until it's published to the result streams as well
+        # returns the result streams to publish the accepted proxy to, None if it hasn't been accepted:
+        # the streams are taken along with the insertion, since a stream registered later
+        # gets the proxy in its snapshot of the pool (see results)
+        key = (proxy.host, proxy.port)
+        streams = None
+        with self._lock:
+            accepted = proxy.last_online() and key not in self.index  # proxy is online
+            if accepted:
+                self._insert(proxy)
+                streams = list(self._streams)
+            capacity_reached = len(self.proxies) >= self.capacity_limit
+        if proxy.last_online():
+            self.negative_cache.forget(proxy.host, proxy.port)
+        elif not proxy._inconclusive:
+            # a check, which has hit local errors or a throttled test url, doesn't count as a failure
+            self.negative_cache.fail(proxy.host, proxy.port)
+        if accepted:
             self.callback(proxy)  # trigger the callback
+        if capacity_reached and not self.cancelled():
+            self._cancel()  # we've got what we wanted, the rest of the proxies are to be checked later
+        return streams
+
+    def _done(self, proxy: Proxy) -> None:
+        with self._lock:
+            self._pending.discard((proxy.host, proxy.port))
+
+    def _idle(self) -> bool:
+        # nothing is being checked
+        return not self._pending
+
+    def _publish(self, proxy: Proxy, streams: list[queue.Queue]) -> None:
+        # blocks, while any of the result streams is full: the consumer throttles the validation
+        for stream in streams:
+            while True:
+                try:
+                    stream.put(proxy, timeout=0.1)
+                    break
+                except queue.Full:
+                    if stream not in self._streams:
+                        break  # the consumer is gone
+
+    def results(self, maxsize: int = 64, stop_when_idle: bool = True) -> Iterator[Proxy]:
+        """
+        Yields the proxies already in the pool, then every new proxy as soon as it's accepted.
+        At most maxsize accepted proxies wait for the consumer, after that the workers wait for it.
+        >>> with proxy_pool:
+        >>>     proxy_pool.add_many(random_proxies)
+        >>>     for proxy in proxy_pool.results():
+        >>>         ...  # the first proxies are here within seconds
+        :param maxsize: size of the buffer between the workers and the consumer
+        :param stop_when_idle: stop, when no proxy is being checked. Otherwise, stop on the pool's context exit.
+        """
+        stream = queue.Queue(maxsize)
+        with self._lock:
+            self._streams.append(stream)
+            proxies = list(self.proxies)
+        try:
+            yield from proxies
+            while True:
+                try:
+                    yield stream.get(timeout=0.1)
+                except queue.Empty:
+                    if (stop_when_idle and self._idle()) or self._closed.is_set():
+                        if stream.empty():
+                            return
+        finally:
+            with self._lock:
+                self._streams.remove(stream)
 
-    def add_many(self, proxies: Union[Collection[hostport], Collection[tuple[hostport, auth]]], flag=None) -> None:
+    def _on_check(self, proxy: Proxy) -> None:
+        # called by every proxy, whenever its check is over
+        if self.store is not None and (proxy.last_online() or proxy in self):
+            self.store.save(proxy)
+
+    @classmethod
+    def load(cls, store: ProxyStore, urls: list[str], **kwargs) -> ProxyPool:
+        """
+        Creates a pool of the proxies saved in the store, which were online at their last check.
+        The pool keeps saving to the store.
+        :param store: the store
+        :param urls: urls to test the proxies against
+        :param kwargs: the rest of the ProxyPool arguments
+        :return: the pool, ready to hand out proxies
+        """
+        pool = cls(urls, store=store, **kwargs)
+        for proxy in store.load(pool):
+            if proxy.last_online():
+                proxy._cache_health()
+                with pool._lock:
+                    if (proxy.host, proxy.port) not in pool.index:
+                        pool._insert(proxy)
+        return pool
+
+    def rerank(self, proxy: Proxy) -> None:
+        """
+        Repositions the proxy according to its current rating: O(log n).
+        Called by the proxy itself, whenever its rating changes. Does nothing, if the proxy isn't in the pool.
+        """
+        with self._lock:
+            if self.index.get((proxy.host, proxy.port)) is not proxy:
+                return
+            rating = proxy.rating()
+            if rating == proxy._rank:
+                return
+            self.proxies.remove(proxy)
+            proxy._rank = rating
+            self.proxies.add(proxy)
+            self._update_weight(proxy)
+
+    def best(self) -> Optional[Proxy]:
+        """
+        :return: the proxy with the highest rating, None if the pool is empty
+        """
+        with self._lock:
+            return self.proxies[0] if self.proxies else None
+
+    @contextmanager
+    def session(self, protocol: str) -> Iterator[requests.Session]:
+        """
+        Borrows a session of the protocol, so that the requests through the proxies of the pool
+        reuse connections: a session keeps alive the connections through the last few proxies it has been used with.
+        There are never more sessions of a protocol than the threads using them at once.
+        """
+        sessions = self._sessions[protocol]
+        try:
+            session = sessions.get_nowait()
+        except queue.Empty:
+            session = pooled_session(pool_connections=len(self.urls))
+        try:
+            yield session
+        finally:
+            sessions.put(session)
+
+    def _update_weight(self, proxy: Proxy) -> None:
+        # must be called with the lock held
+        key = (proxy.host, proxy.port)
+        if self._in_flight.get(key, 0) >= self.max_in_flight:
+            self.sampler.set(key, 0.0)  # saturated, can't be handed out until released
+        else:
+            self.sampler.set(key, max(0.0, self.weight(proxy)))
+
+    def acquire(self, block: bool = True, timeout: Optional[float] = None) -> Optional[Proxy]:
+        """
+        Hands out a random proxy, the chance of a proxy to be picked is proportional to self.weight(proxy).
+        A proxy can be acquired at most max_in_flight times, until it's released.
+        Sampling is O(log n).
+        :param block: wait until a proxy becomes available
+        :param timeout: max time to wait (seconds), None means forever
+        :return: the proxy, None if there's no proxy available
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._available:
+            while True:
+                key = self.sampler.sample()
+                if key is not None:
+                    proxy = self.index[key]
+                    self._in_flight[key] = self._in_flight.get(key, 0) + 1
+                    self._update_weight(proxy)
+                    return proxy
+                if not block:
+                    return None
+                if deadline is None:
+                    self._available.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._available.wait(remaining)
+
+    def release(self, proxy: Proxy) -> None:
+        """
+        Returns the acquired proxy back to the pool.
+        """
+        key = (proxy.host, proxy.port)
+        with self._available:
+            count = self._in_flight.get(key, 0) - 1
+            if count > 0:
+                self._in_flight[key] = count
+            else:
+                self._in_flight.pop(key, None)
+            if self.index.get(key) is proxy:
+                self._update_weight(proxy)
+                self._available.notify()
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None) -> Iterator[Proxy]:
+        """
+        Acquires a proxy for the duration of the with block.
+        >>> with proxy_pool.lease(timeout=10) as proxy:
+        >>>     requests.get(url, proxies=proxy.dict(proxy.protocols[0]))
+        :raises NoProxyAvailable: if no proxy could be acquired in time
+        """
+        proxy = self.acquire(timeout=timeout)
+        if proxy is None:
+            raise NoProxyAvailable(f"No proxy could be acquired in {timeout} seconds.")
+        try:
+            yield proxy
+        finally:
+            self.release(proxy)
+
+    def _add(self, proxy: Proxy, connect: bool = True) -> None:
+        try:
+            if not self._check(proxy, connect):  # check working protocols
+                self._uncheck(proxy)
+                return
+            streams = self._checked(proxy)
+            if streams is not None:
+                self._publish(proxy, streams)
+        finally:
+            self._done(proxy)
+
+    def _check(self, proxy: Proxy, connect: bool) -> bool:
+        if self.concurrency is None:
+            return self._timed_check(proxy, connect)
+        # the executor has max_limit threads, the controller decides how many of them actually check
+        while not self.concurrency.acquire(timeout=0.1):
+            if self.cancelled():
+                return False
+        try:
+            return self._timed_check(proxy, connect)
+        finally:
+            self.concurrency.release()
+
+    def _timed_check(self, proxy: Proxy, connect: bool) -> bool:
+        self.metrics.checks_started.inc()
+        start = perf_counter()
+        checked = None  # stays None, if the check raises
+        try:
+            checked = proxy.check(connect)
+            return checked
+        finally:
+            self._count_check(proxy, checked, perf_counter() - start)
+
+    def _count_check(self, proxy: Proxy, checked: Optional[bool], seconds: float) -> None:
+        """
+        :param checked: False, if the check has been aborted, None, if it has raised
+        """
+        if checked is None:
+            result = "error"
+        elif checked:
+            result = "online" if proxy.last_online() else "offline"
+        else:
+            result = "aborted"
+        self.metrics.checks.inc(result)
+        self.metrics.check_seconds.observe(seconds)
+
+    def _count_protocols(self, protocols: Iterable[str], results: Iterable[bool]) -> None:
+        for protocol, result in zip(protocols, results):
+            self.metrics.protocol_checks.inc(protocol, "ok" if result else "failed")
+
+    def _local_error(self, ex: BaseException) -> bool:
+        """
+        :return: whether the error has been caused by the exhaustion of local resources,
+        the concurrency controller (if any) backs off then
+        """
+        if not is_local_error(ex):
+            return False
+        if self.concurrency is not None:
+            self.concurrency.congested()
+        return True
+
+    def _uncheck(self, proxy: Proxy) -> None:
+        # the check of the proxy has been cancelled, so it's kept for later
+        key = (proxy.host, proxy.port)
+        with self._lock:
+            self._pending.discard(key)
+            self.cached_proxies.add((key, proxy.auth))
+
+    def _submit(self, proxy: Proxy, connect: bool = True) -> None:
+        future = self.executor.submit(self._add, proxy, connect)
+        with self._lock:
+            self._futures[future] = proxy
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._futures.pop(future, None)
+
+    def cancelled(self) -> bool:
+        """
+        :return: whether the checks are being cancelled, since the capacity limit has been reached
+        """
+        return self._cancelled.is_set()
+
+    def _cancel(self) -> None:
+        """
+        Drops the queued checks, their proxies are put into cached_proxies.
+        The running checks abort at their next I/O boundary.
+        """
+        self._cancelled.set()
+        with self._lock:
+            futures = list(self._futures.items())
+        for future, proxy in futures:
+            if future.cancel():
+                self._uncheck(proxy)
+
+    def _sweep(self, proxies: Iterable[tuple[hostport, auth]]) -> Iterator[tuple[hostport, auth]]:
+        # the candidates, which are already in the pool, aren't even connected to
+        candidates = dict()
+        for p, a in proxies:
+            proxy = parse_host_port(p)
+            if proxy in self.index or proxy in self._pending or proxy in candidates:
+                self.metrics.candidates.inc("duplicate")
+            elif self.negative_cache.blocked(*proxy):
+                self.metrics.candidates.inc("blocked")
+            else:
+                candidates[proxy] = a
+        reached = set()
+        failed = set()
+        for proxy in connect_sweep(candidates, self.timeouts.connect(), self.max_sweep_sockets,
+                                   failed, self._local_error):
+            reached.add(proxy)
+            self.metrics.connects.inc("ok")
+            yield proxy, candidates[proxy]
+        for proxy in failed:
+            self.metrics.connects.inc("failed")
+            self.negative_cache.fail(*proxy)
+        for proxy in candidates.keys() - reached - failed:
+            # this machine has run out of sockets before they could be tried, so they're kept for later
+            self.metrics.candidates.inc("deferred")
+            self.cached_proxies.add((proxy, candidates[proxy]))
+
+    def add_many(self, proxies: Union[Collection[hostport], Collection[tuple[hostport, auth]]], flag=None,
+                 sweep: bool = False) -> None:
+        """
+        :param proxies: proxies to add
+        :param flag: "noauth" if the proxies are passed without authentication data
+        :param sweep: connect to all the proxies at once using non-blocking sockets before checking them,
+                      only the reachable ones are then submitted to the protocol checks.
+                      Blocks until the sweep is over, yet the checks start as soon as the first proxy connects.
+        With a negative_cache, the candidates, which have failed recently, are skipped (see add).
+        """
         if flag == "noauth":
-            for p in proxies:
-                self.add(p, None)
+            proxies = ((p, None) for p in proxies)
+        if sweep:
+            for p, a in self._sweep(proxies):
+                self.add(p, a, reachable=True)
         else:
             for i in proxies:
                 p, a = i
                 self.add(p, a)
 
-    def add(self, p: hostport, a: auth = None) -> bool:
+    def add(self, p: hostport, a: auth = None, reachable: bool = False) -> bool:
         """
         A non-blocking function which adds the specified host, port and authentication data to an execution queue,
         where a function tries to make sense of the data and find out which protocol the proxy server serves.
         In case the proxy server is alive and fulfills its role, the callback function is executed.
         :param p: alleged host of the proxy server
         :param a: alleged proxy server authentication credentials
-        :return: nothing. Calls the self.callback(Proxy) function on success.
+        :param reachable: the proxy is known to accept connections, so don't test it once again
+        :return: whether the proxy has been submitted: False, if it's in the pool or being checked already,
+                 if a limit has been reached (it's kept in cached_proxies then),
+                 or if the pool has a negative_cache, and the proxy has failed within its backoff window
+                 (the checks, which hit local errors or a throttled test url, aren't counted as failures).
+                 Calls the self.callback(Proxy) function on success.
         """
         proxy = parse_host_port(p)
         a = parse_auth(a)
-        if proxy not in self:
-            if not self.any_limit_reached():
-                host, port = proxy
-                proxy = Proxy(self, host, port, a)
-                self.executor.submit(self._add, proxy)  # submit to the executor
-                self.submit_count += 1  # add count
-                return True  # submitted
-            else:
+        with self._lock:
+            if proxy in self.index or proxy in self._pending:
+                self.metrics.candidates.inc("duplicate")
+                return False  # already in the pool or being checked
+            if self.negative_cache.blocked(*proxy):
+                self.metrics.candidates.inc("blocked")
+                return False  # failed recently
+            if self.any_limit_reached():
                 self.cached_proxies.add((proxy, a))
+                self.metrics.candidates.inc("deferred")
                 return False  # not submitted
-        else:
-            return False  # already in the pool
+            self._pending.add(proxy)
+            self.submit_count += 1  # add count
+        self.metrics.candidates.inc("submitted")
+        host, port = proxy
+        self._submit(Proxy(self, host, port, a), not reachable)  # submit to the executor
+        return True  # submitted
+
+    def _gauges(self) -> dict:
+        with self._lock:
+            size = len(self.proxies)
+            by_protocol = {protocol: 0 for protocol in self.protocols}
+            for proxy in self.proxies:
+                for protocol in proxy.protocols:
+                    by_protocol[protocol] = by_protocol.get(protocol, 0) + 1
+            pending = len(self._pending)
+            deferred = len(self.cached_proxies)
+        return {
+            "size": size,
+            "size_by_protocol": by_protocol,
+            "pending": pending,
+            "in_flight": self.metrics.in_flight(),
+            "checks_per_second": self.metrics.rate(monotonic()),
+            "deferred": deferred,
+            "negative_cache": {"entries": len(self.negative_cache), "skipped": self.negative_cache.skipped},
+            "timeouts": {"connect": self.timeouts.connect(), "read": self.timeouts.read()},
+        }
+
+    def stats(self) -> dict:
+        """
+        Snapshot of what the pool is doing: its size, the queue of the checks, the counters and the check latency.
+        The checks per second are recalculated at most once a second.
+        >>> pool.stats()["protocol_checks"]["http"]  # {"ok": 12, "failed": 880}
+        """
+        stats = self._gauges()
+        metrics = self.metrics
+        stats["candidates"] = {outcome: n for (outcome,), n in metrics.candidates.values().items()}
+        stats["connects"] = {result: n for (result,), n in metrics.connects.values().items()}
+        stats["checks"] = {result: n for (result,), n in metrics.checks.values().items()}
+        protocol_checks = dict()
+        for (protocol, result), n in metrics.protocol_checks.values().items():
+            protocol_checks.setdefault(protocol, dict())[result] = n
+        stats["protocol_checks"] = protocol_checks
+        stats["check_seconds"] = metrics.check_seconds.summary()
+        stats["phase_seconds"] = {phase: metrics.phase_seconds.summary(phase) for phase in ("connect", "handshake",
+                                                                                            "ttfb")}
+        if self.concurrency is not None:
+            stats["concurrency"] = self.concurrency.stats()
+        return stats
+
+    def prometheus(self) -> str:
+        """
+        :return: the metrics in the Prometheus text exposition format (see serve_metrics)
+        """
+        gauges = self._gauges()
+        prefix = self.metrics.prefix
+        families = self.metrics.families() + [
+            (f"{prefix}_size", "gauge", "Proxies in the pool.", [("", {}, gauges["size"])]),
+            (f"{prefix}_proxies", "gauge", "Proxies in the pool, which speak the protocol.",
+             [("", {"protocol": protocol}, n) for protocol, n in gauges["size_by_protocol"].items()]),
+            (f"{prefix}_pending", "gauge", "Candidates submitted, but not checked yet.",
+             [("", {}, gauges["pending"])]),
+            (f"{prefix}_checks_in_flight", "gauge", "Checks running right now.", [("", {}, gauges["in_flight"])]),
+            (f"{prefix}_checks_per_second", "gauge", "Checks finished per second.",
+             [("", {}, gauges["checks_per_second"])]),
+            (f"{prefix}_deferred", "gauge", "Candidates kept for later, since a limit has been reached.",
+             [("", {}, gauges["deferred"])]),
+            (f"{prefix}_negative_cache_entries", "gauge", "Candidates remembered by the negative cache.",
+             [("", {}, gauges["negative_cache"]["entries"])]),
+            (f"{prefix}_negative_cache_skipped", "counter", "Candidates skipped by the negative cache.",
+             [("_total", {}, gauges["negative_cache"]["skipped"])]),
+            (f"{prefix}_timeout_seconds", "gauge", "Current deadlines of the checks of the unknown proxies.",
+             [("", {"kind": kind}, seconds) for kind, seconds in gauges["timeouts"].items()]),
+        ]
+        if self.concurrency is not None:
+            families.append((f"{prefix}_concurrency_limit", "gauge", "Limit of the checks in flight.",
+                             [("", {}, self.concurrency.limit)]))
+        return render(families)
+
+    def serve_metrics(self, port: int = 0, host: str = "127.0.0.1") -> MetricsServer:
+        """
+        Starts serving the metrics over HTTP (GET /metrics), until the returned server is closed.
+        >>> server = pool.serve_metrics(9464)
+        >>> ...
+        >>> server.close()
+        :param port: port to bind to, 0 picks a free one (see server.port)
+        :param host: address to bind to
+        """
+        return MetricsServer(self.prometheus, host, port).start()
 
     def is_empty(self) -> bool:
         return len(self.proxies) == 0
@@ -370,19 +1020,20 @@ class ProxyPool:
         return self
 
     def __enter__(self):
-        self.executor = ThreadPoolExecutor(max_workers=self.max_proxy_workers)
+        workers = self.max_proxy_workers if self.concurrency is None else self.concurrency.max_limit
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._closed.clear()
         return self
 
     def __exit__(self, type, value, traceback):
         self.executor.shutdown(wait=True)
         self._initialize_state_variables()
+        self._cancelled.clear()
+        self._closed.set()
         return False
 
     def __contains__(self, item: hostport) -> bool:
-        for proxy in self.proxies:
-            if proxy == item:
-                return True
-        return False
+        return parse_host_port(item) in self.index
 
     def __len__(self):
         return len(self.proxies)
@@ -391,10 +1042,14 @@ class ProxyPool:
         return len(self) < 1
 
     def remove(self, p: hostport) -> bool:
-        proxy = parse_host_port(p)
-        if proxy not in self:
-            return False
-        self.proxies.remove(p)
+        with self._lock:
+            proxy = self.index.pop(parse_host_port(p), None)
+            if proxy is None:
+                return False
+            self.proxies.remove(proxy)
+            self.sampler.remove((proxy.host, proxy.port))
+        if self.store is not None:
+            self.store.delete(proxy.host, proxy.port)
         return True
 
 
@@ -408,7 +1063,7 @@ def parse_host_port(p: hostport) -> tuple[str, int]:
     if type(p) is tuple:
         host, port = p
         port = int(port)
-    elif type(p) is str:
+    elif isinstance(p, str):  # scrape.Candidate is a str as well
         hp = p.rsplit(":", 1)
         if len(hp) == 2:
             host, port = hp
@@ -0,0 +1,147 @@
+from __future__ import annotations
+from typing import Optional, Collection
+from functools import lru_cache
+import socket
+import ssl
+from handshake import (
+    HandshakeError, url_endpoint,
+    socks4_request, parse_socks4_reply, SOCKS4_REPLY_SIZE,
+    socks5_greeting, parse_socks5_method,
+    http_connect_request, http_get_request, parse_http_status,
+)
+
+
+# the order in which the detected protocols are tried by the throughput test
+PROBE_ORDER = ("socks5h", "socks5", "socks4a", "socks4", "http", "https")
+
+# free proxies never have a valid certificate, so the TLS connection to the proxy itself isn't verified
+# (the connection to the test server through the proxy is, though)
+PROXY_TLS_CONTEXT = ssl.create_default_context()
+PROXY_TLS_CONTEXT.check_hostname = False
+PROXY_TLS_CONTEXT.verify_mode = ssl.CERT_NONE
+
+
+# proxy server credentials, see Proxy.auth
+auth = Optional[tuple[str, Optional[str]]]
+
+
+@lru_cache(maxsize=256)
+def _resolve(host: str) -> str:
+    # test urls are few, so they are resolved only once
+    return socket.gethostbyname(host)
+
+
+def _recv_exactly(s: socket.socket, n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = s.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _http_status(s: socket.socket, request: bytes) -> int:
+    s.sendall(request)
+    # the status line fits into the first segment of the response, no need to read any further
+    return parse_http_status(s.recv(256).split(b"\r\n", 1)[0])
+
+
+def probe_socks5(s: socket.socket, a: auth = None) -> Optional[bool]:
+    """
+    Sends the SOCKS5 greeting and reads the method selection.
+    :return: True if the server speaks SOCKS5, False if it speaks HTTP, None if neither
+    """
+    s.sendall(socks5_greeting(a))
+    reply = s.recv(16)
+    if reply.startswith(b"HTTP/"):
+        return False  # an HTTP server answering (most probably with 400) to garbage
+    try:
+        parse_socks5_method(reply)
+        return True  # even 0xFF (no acceptable methods) means that the server speaks SOCKS5
+    except HandshakeError:
+        return None
+
+
+def probe_socks4(s: socket.socket, host: str, port: int, remote_dns: bool, a: auth = None) -> bool:
+    """
+    Sends a SOCKS4(a) CONNECT request to the test server.
+    :return: whether the request was granted
+    """
+    if not remote_dns:
+        host = _resolve(host)
+    s.sendall(socks4_request(host, port, a[0] if a else None, remote_dns))
+    return parse_socks4_reply(_recv_exactly(s, SOCKS4_REPLY_SIZE))
+
+
+def probe_http(s: socket.socket, url: str, a: auth = None) -> bool:
+    """
+    Asks an HTTP proxy to reach the test server: with CONNECT for https urls, with an absolute-URI GET otherwise.
+    :return: whether the proxy agreed to
+    """
+    scheme, host, port = url_endpoint(url)
+    if scheme == "https":
+        return _http_status(s, http_connect_request(host, port, a)) == 200
+    return _http_status(s, http_get_request(url, {}, absolute=True, a=a)) == 200
+
+
+def probe(host: str, port: int, url: str, timeout: float,
+          protocols: Collection[str] = PROBE_ORDER, a: auth = None) -> list[str]:
+    """
+    Finds out which protocols the proxy server speaks with minimal handshakes on raw sockets,
+    instead of fetching a page through the proxy once per protocol.
+    Usually it takes one or two small exchanges: the SOCKS5 greeting tells SOCKS5 servers apart,
+    everything else gets an HTTP request, then a SOCKS4(a) CONNECT request, unless it has answered in HTTP.
+    :param host: host of the proxy server
+    :param port: port of the proxy server
+    :param url: the test url, which the proxy is asked to connect to
+    :param timeout: timeout of every connection and exchange
+    :param protocols: protocols to look for
+    :param a: proxy server authentication credentials
+    :return: detected protocols, in PROBE_ORDER
+    """
+    def connect(tls: bool = False) -> socket.socket:
+        s = socket.create_connection((host, port), timeout=timeout)
+        if tls:
+            s = PROXY_TLS_CONTEXT.wrap_socket(s)
+        return s
+
+    detected = set()
+    speaks_socks5 = None
+    if {"socks5", "socks5h", "http"}.intersection(protocols):
+        try:
+            with connect() as s:
+                speaks_socks5 = probe_socks5(s, a)
+            if speaks_socks5:
+                detected.update({"socks5", "socks5h"}.intersection(protocols))
+        except (OSError, HandshakeError):
+            pass  # HTTP servers, which read the request line by line, never answer the greeting
+    answered_http = speaks_socks5 is False
+    if speaks_socks5 is not True and "http" in protocols:
+        try:
+            with connect() as s:
+                if probe_http(s, url, a):
+                    detected.add("http")
+        except (OSError, HandshakeError):
+            pass
+    if not detected and not answered_http and {"socks4", "socks4a"}.intersection(protocols):
+        _, target_host, target_port = url_endpoint(url)
+        try:
+            with connect() as s:
+                # socks4a servers speak socks4, the opposite isn't always true
+                if probe_socks4(s, target_host, target_port, "socks4a" in protocols, a):
+                    detected.update({"socks4", "socks4a"}.intersection(protocols))
+                elif "socks4a" in protocols and "socks4" in protocols:
+                    with connect() as s4:
+                        if probe_socks4(s4, target_host, target_port, False, a):
+                            detected.add("socks4")
+        except (OSError, HandshakeError):
+            pass
+    if not detected and "https" in protocols:
+        try:
+            with connect(tls=True) as s:
+                if probe_http(s, url, a):
+                    detected.add("https")
+        except (OSError, HandshakeError):
+            pass
+    return [protocol for protocol in PROBE_ORDER if protocol in detected]
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import Optional, Hashable
+from array import array
+import random
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over non-negative weights: point updates, prefix sums
+    and the search by a prefix sum all take O(log n).
+    """
+    __slots__ = ("_tree", "_weights")
+
+    def __init__(self, capacity: int = 16):
+        self._tree = array("d", [0.0]) * (capacity + 1)  # 1-based
+        self._weights = array("d", [0.0]) * capacity
+
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def _grow(self) -> None:
+        weights = self._weights
+        self._weights = weights + array("d", [0.0]) * len(weights)
+        # O(n) rebuild, amortized O(1) per slot, since the capacity doubles
+        n = len(self._weights)
+        tree = array("d", [0.0]) * (n + 1)
+        for i, w in enumerate(self._weights, 1):
+            tree[i] += w
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def set(self, i: int, weight: float) -> None:
+        while i >= len(self._weights):
+            self._grow()
+        delta = weight - self._weights[i]
+        self._weights[i] = weight
+        i += 1
+        n = len(self._weights)
+        while i <= n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def get(self, i: int) -> float:
+        return self._weights[i]
+
+    def total(self) -> float:
+        s = 0.0
+        i = len(self._weights)
+        while i > 0:
+            s += self._tree[i]
+            i -= i & -i
+        return s
+
+    def find(self, value: float) -> int:
+        """
+        :return: the smallest index, at which the prefix sum (inclusive) exceeds the value
+        """
+        n = len(self._weights)
+        position = 0
+        step = 1 << n.bit_length()
+        while step:
+            j = position + step
+            if j <= n and self._tree[j] <= value:
+                position = j
+                value -= self._tree[j]
+            step >>= 1
+        return min(position, n - 1)
+
+
+class WeightedSampler:
+    """
+    Samples keys in proportion to their weights in O(log n), weights can be changed in O(log n) as well.
+    """
+    def __init__(self, rnd: Optional[random.Random] = None):
+        self._tree = FenwickTree()
+        self._slots: dict[Hashable, int] = dict()
+        self._keys: list[Optional[Hashable]] = []
+        self._free: list[int] = []
+        self._random = rnd or random.Random()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slots
+
+    def set(self, key: Hashable, weight: float) -> None:
+        if weight < 0:
+            raise ValueError(f"weight={weight}: must not be negative.")
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self._keys[slot] = key
+            else:
+                slot = len(self._keys)
+                self._keys.append(key)
+            self._slots[key] = slot
+        self._tree.set(slot, weight)
+
+    def remove(self, key: Hashable) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        self._tree.set(slot, 0.0)
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def weight(self, key: Hashable) -> float:
+        return self._tree.get(self._slots[key])
+
+    def total(self) -> float:
+        return self._tree.total()
+
+    def sample(self) -> Optional[Hashable]:
+        """
+        :return: a random key, None if all the weights are zero
+        """
+        total = self._tree.total()
+        if total <= 0:
+            return None
+        # the float error of the tree might point at an empty slot, so retry (practically never happens)
+        for _ in range(3):
+            key = self._keys[self._tree.find(self._random.random() * total)]
+            if key is not None and self._tree.get(self._slots[key]) > 0:
+                return key
+        return None
@@ -0,0 +1,161 @@
+from __future__ import annotations
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+import heapq
+import itertools
+import threading
+from pool import ProxyPool, Proxy
+
+
+class HealthScheduler:
+    """
+    Re-checks the proxies already in the pool in the background, so that their ratings stay fresh.
+    Every proxy is due max_interval seconds after its last check, except for the proxies at the top of the pool
+    (those are actually used) and at the bottom of it (those are about to be evicted):
+    the closer to either end, the closer the interval is to min_interval.
+    Proxies, which fail max_failures re-checks in a row, are removed from the pool.
+    >>> with proxy_pool:
+    >>>     proxy_pool.add_many(random_proxies)
+    >>> with HealthScheduler(proxy_pool, checks_per_second=5):
+    >>>     ...  # the pool is being kept fresh here
+    """
+    pool: ProxyPool
+    min_interval: float
+    max_interval: float
+    checks_per_second: float
+    max_workers: int
+    max_failures: int
+
+    def __init__(self, pool: ProxyPool,
+                 min_interval: float = 30.0, max_interval: float = 300.0,
+                 checks_per_second: float = 10.0, max_workers: int = 5, max_failures: int = 2):
+        """
+        :param pool: pool to keep fresh
+        :param min_interval: re-check interval of the best and the worst proxies (seconds)
+        :param max_interval: re-check interval of the proxies in the middle of the pool (seconds)
+        :param checks_per_second: global budget of re-checks
+        :param max_workers: max number of proxies re-checked simultaneously
+        :param max_failures: number of failed re-checks in a row, after which the proxy is evicted
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError(f"Intervals must satisfy 0 < min_interval ({min_interval}) "
+                             f"<= max_interval ({max_interval}).")
+        if checks_per_second <= 0:
+            raise ValueError(f"checks_per_second={checks_per_second}: must be a positive number.")
+        self.pool = pool
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.checks_per_second = checks_per_second
+        self.max_workers = max_workers
+        self.max_failures = max_failures
+        self._queue: list[tuple[float, int, tuple[str, int]]] = []  # heap of (due, seq, (host, port))
+        self._scheduled: set[tuple[str, int]] = set()
+        self._failures: dict[tuple[str, int], int] = dict()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_sync = 0.0
+
+    def interval(self, proxy: Proxy) -> float:
+        """
+        :return: how long to wait before the next check of the proxy (seconds)
+        """
+        n = len(self.pool)
+        if n < 2:
+            return self.min_interval
+        try:
+            with self.pool._lock:
+                position = self.pool.proxies.index(proxy)
+        except ValueError:
+            return self.min_interval
+        edge = abs(2 * position / (n - 1) - 1)  # 1 at the top and at the bottom, 0 in the middle
+        return self.max_interval - (self.max_interval - self.min_interval) * edge
+
+    def _schedule(self, key: tuple[str, int], due: float) -> None:
+        with self._lock:
+            self._scheduled.add(key)
+            heapq.heappush(self._queue, (due, next(self._seq), key))
+
+    def _sync(self) -> None:
+        # pick up the proxies, which got into the pool since the last sync
+        with self.pool._lock:
+            new = [(key, proxy) for key, proxy in self.pool.index.items() if key not in self._scheduled]
+        for key, proxy in new:
+            last = proxy.last_check_time() if proxy.check_count else monotonic()
+            self._schedule(key, last + self.interval(proxy))
+        self._last_sync = monotonic()
+
+    def _recheck(self, key: tuple[str, int], proxy: Proxy) -> None:
+        try:
+            proxy.check()
+        except Exception as ex:
+            print(f"'{ex}' while re-checking {proxy!r}.")
+        if proxy.last_online():
+            self._failures.pop(key, None)
+        else:
+            failures = self._failures.get(key, 0) + 1
+            if failures >= self.max_failures:
+                self._failures.pop(key, None)
+                self.pool.remove(proxy)
+                with self._lock:
+                    self._scheduled.discard(key)
+                return
+            self._failures[key] = failures
+        self._schedule(key, monotonic() + self.interval(proxy))
+
+    def _run(self) -> None:
+        workers = threading.Semaphore(self.max_workers)
+        budget = 1. / self.checks_per_second
+        next_slot = monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            def done(_):
+                workers.release()
+
+            while not self._stop.is_set():
+                now = monotonic()
+                if now - self._last_sync >= self.min_interval or not self._queue:
+                    self._sync()
+                if not self._queue:
+                    self._stop.wait(self.min_interval)
+                    continue
+                due = self._queue[0][0]
+                wait = max(due, next_slot) - now
+                if wait > 0:
+                    # the sync must not be postponed for longer than min_interval
+                    self._stop.wait(min(wait, self.min_interval))
+                    continue
+                with self._lock:
+                    _, _, key = heapq.heappop(self._queue)
+                proxy = self.pool.index.get(key)
+                if proxy is None:
+                    self._scheduled.discard(key)
+                    continue  # removed from the pool in the meantime
+                while not workers.acquire(timeout=self.min_interval):
+                    if self._stop.is_set():
+                        return
+                # the key stays in self._scheduled while it's being checked, so that the sync doesn't pick it up
+                executor.submit(self._recheck, key, proxy).add_done_callback(done)
+                # after some idle time, allow a burst of at most a second worth of the budget
+                next_slot = max(next_slot + budget, monotonic() - 1.)
+
+    def start(self) -> HealthScheduler:
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="HealthScheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, wait: bool = True) -> None:
+        self._stop.set()
+        if wait and self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+        return False
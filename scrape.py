@@ -1,18 +1,193 @@
 import requests
 from netutils import (
-    generate_headers, IPv4_REGEX, find_host_port_pairs,
-    BASE64_WORD_REGEX, valid_ip, valid_host_port_pair, valid_port
+    generate_headers, IPv4_REGEX, extract_host_port_records, unpack_host_port,
+    BASE64_WORD_REGEX, valid_ip, valid_host_port_pair, valid_port, pooled_session
 )
 from base64 import b64decode
-from typing import Optional, Collection
+from typing import Optional, Union, Collection, Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from pool import ProxyPool
+from httpcache import HttpCache, CachingAdapter
+import threading
+import queue
 import json
 import bs4
 import re
 
 
+class Candidate(str):
+    """
+    "host:port" string, which might know the protocol of the proxy (when the source tells it).
+    """
+    protocol: Optional[str]
+
+    def __new__(cls, value: str, protocol: Optional[str] = None):
+        candidate = super().__new__(cls, value)
+        candidate.protocol = protocol
+        return candidate
+
+
+# bs4 tree builders, the fastest first: the scrapers walk the tree with the bs4 api, whichever builder makes it
+PARSERS = ("lxml", "html.parser")
+
+
+def available_parsers() -> list[str]:
+    return [name for name in PARSERS if bs4.builder.builder_registry.lookup(name) is not None]
+
+
+_parser = available_parsers()[0]
+
+
+def set_parser(name: str) -> None:
+    """
+    :param name: one of available_parsers(), lxml (when installed) is used by default
+    """
+    global _parser
+    if name not in available_parsers():
+        raise ValueError(f"Parser '{name}' is not available, use one of {available_parsers()}.")
+    _parser = name
+
+
+def make_soup(markup: Union[str, bytes], only: Optional[bs4.SoupStrainer] = None) -> bs4.BeautifulSoup:
+    """
+    :param markup: the page
+    :param only: when given, only the matching tags (along with everything inside them) are built into the tree,
+    which is much cheaper than the tree of the whole page
+    """
+    return bs4.BeautifulSoup(markup, features=_parser, parse_only=only)
+
+
+# pages of a single source are fetched at most this many at once, so that the site isn't hammered
+MAX_PAGES_IN_FLIGHT = 4
+PAGE_TIMEOUT = 20.
+
+# how long the pages of a source stay fresh in the cache (seconds), roughly how often the list changes
+CACHE_TTLS = {
+    "www.ip3366.net": 900.,
+    "www.89ip.cn": 600.,
+    "www.proxynova.com": 300.,
+    "www.my-proxy.com": 600.,
+    "free-proxy.cz": 600.,
+    "www.ipaddress.com": 300.,
+    "list.proxylistplus.com": 300.,
+    "www.proxyrack.com": 120.,
+    "www.proxy-list.download": 300.,
+}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_cache: Optional[HttpCache] = None
+_parsed: dict[str, tuple[int, Collection[str]]] = dict()  # url -> (hash of the page, proxies parsed from it)
+
+
+def scrape_session() -> requests.Session:
+    """
+    Session shared by the scrapers, so that the connection to a source is reused from page to page.
+    It's safe to use from several threads, as long as every request passes its own headers.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = pooled_session(pool_connections=16, pool_maxsize=MAX_PAGES_IN_FLIGHT)
+            if _cache is not None:
+                adapter = CachingAdapter(_cache, pool_connections=16, pool_maxsize=MAX_PAGES_IN_FLIGHT)
+                _session.mount("http://", adapter)
+                _session.mount("https://", adapter)
+        return _session
+
+
+def use_cache(cache: Union[HttpCache, str, None]) -> Optional[HttpCache]:
+    """
+    Puts an HttpCache under the scrape session, so that the next scrape cycles don't download the pages,
+    which haven't changed, and don't parse them again either.
+    >>> use_cache("pages.sqlite3")
+    :param cache: the cache or the path of its database (with CACHE_TTLS), None turns the cache off
+    :return: the cache in use
+    """
+    global _cache, _session
+    if isinstance(cache, str):
+        cache = HttpCache(cache, ttls=CACHE_TTLS)
+    with _session_lock:
+        _cache = cache
+        _session = None  # the next request makes a new one
+        _parsed.clear()
+    return cache
+
+
+def parse_page(res: requests.Response, parse: Callable[[requests.Response], Collection]) -> Collection:
+    """
+    :return: parse(res), or what it returned the last time, if the page is the same as then (only with the cache on)
+    """
+    if getattr(res, "from_cache", None) is None:
+        return parse(res)
+    key = hash(res.content)
+    parsed = _parsed.get(res.url)
+    if parsed is None or parsed[0] != key:
+        parsed = _parsed[res.url] = (key, parse(res))
+    return parsed[1]
+
+
+def fetch_pages(urls: Iterable[str], parse: Callable[[requests.Response], Collection[str]],
+                headers: Optional[Callable[[], dict[str, str]]] = None,
+                max_in_flight: int = MAX_PAGES_IN_FLIGHT) -> Iterator[str]:
+    """
+    Fetches the pages of a paginated source concurrently and yields the proxies page by page, in the page order.
+    No more pages are requested after a page without proxies, or without any proxies, which weren't on the pages before:
+    either the list has ended, or the site keeps serving its last page.
+    A page, which couldn't be fetched at all or has come with an error status (e.g. 429 when throttled),
+    is skipped, but doesn't stop the pagination: only a 200 page, which adds nothing, does.
+    :param urls: urls of the pages, in order (might be infinite)
+    :param parse: extracts the proxies from a page
+    :param headers: request headers factory, generate_headers by default
+    :param max_in_flight: max number of pages requested at once
+    """
+    session = scrape_session()
+    headers = headers or generate_headers
+    urls = iter(urls)
+
+    def fetch(url: str) -> Optional[Collection[str]]:
+        try:
+            res = session.get(url, headers=headers(), timeout=PAGE_TIMEOUT)
+            if res.status_code != 200:
+                print(f"{res.status_code} while handling {url}.")
+                return None  # the parsers make an empty page of it, which would end the pagination
+            return parse_page(res, parse)
+        except Exception as ex:
+            print(f"'{ex}' while handling {url}.")
+            return None
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                url = next(urls, None)
+                if url is None:
+                    exhausted = True
+                else:
+                    in_flight.append(executor.submit(fetch, url))
+            if not in_flight:
+                return
+            proxies = in_flight.popleft().result()
+            if proxies is None:
+                continue
+            new = [proxy for proxy in proxies if proxy not in seen]
+            if not new:
+                # the pages already requested are still yielded from, since they're fetched anyway
+                exhausted = True
+            seen.update(new)
+            yield from new
+
+
 # -1
 def scrape_ip3366() -> Collection[str]:  # shitty chinese proxies (only <<1% works)
-    def get_proxies(s) -> Collection[str]:
+    return list(iter_ip3366())
+
+
+def iter_ip3366() -> Iterator[str]:
+    def get_proxies(s) -> set[str]:
         proxy_table = s.find(id="list").find("table").find("tbody")
         proxy_records = proxy_table.find_all("tr")
         proxies = set()
@@ -33,30 +208,54 @@ def scrape_ip3366() -> Collection[str]:  # shitty chinese proxies (only <<1% wor
         h = set(str(a["href"]) for a in a_tags)
         return h
 
-    proxy_list = []
-    base_url = "http://www.ip3366.net/free/"
-    hrefs = {"?stype=1&page=1", "?stype=2&page=1"}
-    visited_hrefs = set()
-    while hrefs:
-        href = hrefs.pop()
+    def parse(res: requests.Response) -> tuple[set[str], set[str]]:
+        soup = make_soup(res.content, bs4.SoupStrainer(id=["list", "listnav"]))
+        return get_proxies(soup), get_hrefs(soup)
+
+    def fetch(href: str) -> tuple[str, Optional[tuple[set[str], set[str]]]]:
         url = base_url + href
-        # this opens the first page
         try:
-            html = requests.get(url, headers=generate_headers()).content
-            soup = bs4.BeautifulSoup(html, features="html.parser")
-            hrefs = hrefs.union(get_hrefs(soup)).difference(visited_hrefs)
-            proxy_list += get_proxies(soup)
-        except:
-            pass
-        visited_hrefs.add(href)
-    return proxy_list
+            res = session.get(url, headers=generate_headers(), timeout=PAGE_TIMEOUT)
+            if res.status_code != 200:
+                return href, None  # throttled or down
+            return href, parse_page(res, parse)
+        except Exception:
+            return href, None
+
+    session = scrape_session()
+    base_url = "http://www.ip3366.net/free/"
+    hrefs = deque(["?stype=1&page=1", "?stype=2&page=1"])
+    visited_hrefs = set(hrefs)
+    seen = set()
+    # the pagination is crawled, max MAX_PAGES_IN_FLIGHT pages at once
+    with ThreadPoolExecutor(max_workers=MAX_PAGES_IN_FLIGHT) as executor:
+        in_flight = set()
+        while hrefs or in_flight:
+            while hrefs and len(in_flight) < MAX_PAGES_IN_FLIGHT:
+                in_flight.add(executor.submit(fetch, hrefs.popleft()))
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                href, page = future.result()
+                if page is None:
+                    # skipped, but not given up on: it's requested again, if another page links to it
+                    visited_hrefs.discard(href)
+                    continue
+                proxies, links = page
+                new = proxies - seen
+                if not new:
+                    continue  # the links of a page, which has nothing new, aren't followed
+                seen |= new
+                yield from new
+                for href in links - visited_hrefs:
+                    visited_hrefs.add(href)
+                    hrefs.append(href)
 
 
 # 0
 def scrape_89ip() -> Collection[str]:  # chinese proxies
     url = "https://www.89ip.cn/tqdl.html?num=9999&address=&kill_address=&port=&kill_port=&isp="
-    res = requests.get(url, headers=generate_headers())
-    soup = bs4.BeautifulSoup(res.text, features='html.parser')
+    res = scrape_session().get(url, headers=generate_headers(), timeout=PAGE_TIMEOUT)
+    soup = make_soup(res.text, bs4.SoupStrainer('div', attrs={'class': 'fly-panel'}))
     elems = soup.find('div', attrs={'class': 'fly-panel'}).find('div').find_all(text=True)
     proxies = set()
     for e in elems:
@@ -72,8 +271,8 @@ def scrape_proxynova() -> Collection[str]:
     proxies = set()
     url = "https://www.proxynova.com/proxy-server-list/"
     try:
-        res = requests.get(url, headers=generate_headers())
-        soup = bs4.BeautifulSoup(res.text, features='html.parser')
+        res = scrape_session().get(url, headers=generate_headers(), timeout=PAGE_TIMEOUT)
+        soup = make_soup(res.text, bs4.SoupStrainer(id="tbl_proxy_list"))
         table = soup.find(id="tbl_proxy_list")
         if not table:
             return []
@@ -112,9 +311,15 @@ def scrape_proxynova() -> Collection[str]:
 
 # 2
 def scrape_myproxy():
-    urls = [
-        "https://www.my-proxy.com/free-socks-4-proxy.html",
-        "https://www.my-proxy.com/free-socks-5-proxy.html",
+    return set(iter_myproxy())
+
+
+def iter_myproxy() -> Iterator[Candidate]:
+    urls = {
+        "https://www.my-proxy.com/free-socks-4-proxy.html": "socks4",
+        "https://www.my-proxy.com/free-socks-5-proxy.html": "socks5",
+    }
+    urls.update((url, None) for url in [
         "https://www.my-proxy.com/free-proxy-list.html",
         "https://www.my-proxy.com/free-proxy-list-2.html",
         "https://www.my-proxy.com/free-proxy-list-3.html",
@@ -125,70 +330,72 @@ def scrape_myproxy():
         "https://www.my-proxy.com/free-proxy-list-8.html",
         "https://www.my-proxy.com/free-proxy-list-9.html",
         "https://www.my-proxy.com/free-proxy-list-10.html",
-    ]
-    proxies = set()
-    for url in urls:
+    ])
+    for url, protocol in urls.items():
         try:
-            res = requests.get(url, headers=generate_headers())
+            res = scrape_session().get(url, headers=generate_headers(), timeout=PAGE_TIMEOUT)
             if res.status_code == 200:
-                text = res.content.decode("utf-8")
-                proxies = proxies.union(find_host_port_pairs(text))
+                records = extract_host_port_records(res.content, as_numpy=False)
+            else:
+                records = []
         except Exception as ex:
             print(f"'{ex}' while handling '{url}'.")
-    return proxies
+            records = []
+        for record in records:
+            host, port = unpack_host_port(record)
+            yield Candidate(f"{host}:{port}", protocol)
 
 
 # 3
 def scrape_freeproxy_cz(pages=20) -> Collection[str]:
+    return set(iter_freeproxy_cz(pages))
+
+
+def iter_freeproxy_cz(pages=20) -> Iterator[str]:
     regex = fr'(?<=Base64.decode\("){BASE64_WORD_REGEX}(?="\))'
     base_url = "http://free-proxy.cz/en/proxylist/main/uptime/"
-    proxies = set()
-    for page in range(1, pages+1):
-        url = base_url + str(page)
-        try:
-            res = requests.get(url, headers=generate_headers())
-            soup = bs4.BeautifulSoup(res.text, features='html.parser')
-            proxy_list = soup.find(id="proxy_list")
-            if not proxy_list:
+
+    def parse(res: requests.Response) -> Collection[str]:
+        proxies = set()
+        soup = make_soup(res.text, bs4.SoupStrainer(id="proxy_list"))
+        proxy_list = soup.find(id="proxy_list")
+        if not proxy_list:
+            return proxies
+        tbody = proxy_list.find('tbody')
+        if not tbody:
+            return proxies
+        rows = tbody.find_all("tr")
+        for row in rows:
+            columns = row.find_all("td")
+            if not columns or len(columns) < 2:
                 continue
-            tbody = proxy_list.find('tbody')
-            if not tbody:
+            host_column = columns[0]
+            script = host_column.find("script")
+            if not script or not script.string:
                 continue
-            rows = tbody.find_all("tr")
-            if not rows:
+            encoded_host = re.search(regex, script.string)
+            if not encoded_host:
                 continue
-            for row in rows:
-                columns = row.find_all("td")
-                if not columns or len(columns) < 2:
-                    continue
-                host_column = columns[0]
-                script = host_column.find("script")
-                if not script or not script.string:
-                    continue
-                encoded_host = re.search(regex, script.string)
-                if not encoded_host:
-                    continue
-                encoded_host = encoded_host[0]
-                try:
-                    host = b64decode(encoded_host).decode()
-                    if not valid_ip(host):
-                        continue
-                except Exception as ex:
-                    print(f"'{ex}' while decoding '{encoded_host}'.")
-                    continue
-                port_column = columns[1]
-                if not port_column:
-                    continue
-                port_span = port_column.find("span")
-                if not port_span or not port_span.text:
+            encoded_host = encoded_host[0]
+            try:
+                host = b64decode(encoded_host).decode()
+                if not valid_ip(host):
                     continue
-                port = port_span.text
-                proxy = f"{host}:{port}"
-                proxies.add(proxy)
-        except Exception as ex:
-            print(f"'{ex}' while handling {url}.")
-            pass
-    return proxies
+            except Exception as ex:
+                print(f"'{ex}' while decoding '{encoded_host}'.")
+                continue
+            port_column = columns[1]
+            if not port_column:
+                continue
+            port_span = port_column.find("span")
+            if not port_span or not port_span.text:
+                continue
+            port = port_span.text
+            proxy = f"{host}:{port}"
+            proxies.add(proxy)
+        return proxies
+
+    return fetch_pages((base_url + str(page) for page in range(1, pages+1)), parse)
 
 
 # 4
@@ -196,8 +403,8 @@ def scrape_ipaddress() -> Collection[str]:
     proxies = set()
     url = "https://www.ipaddress.com/proxy-list/"
     try:
-        res = requests.get(url, headers=generate_headers())
-        soup = bs4.BeautifulSoup(res.text, features='html.parser')
+        res = scrape_session().get(url, headers=generate_headers(), timeout=PAGE_TIMEOUT)
+        soup = make_soup(res.text, bs4.SoupStrainer("tbody"))
         table_body = soup.find("tbody")
         if not table_body:
             return []
@@ -221,79 +428,88 @@ def scrape_ipaddress() -> Collection[str]:
 
 # 5
 def scrape_proxylistplus(pages=6) -> Collection[str]:
-    proxies = set()
+    return set(iter_proxylistplus(pages))
+
+
+def iter_proxylistplus(pages=6) -> Iterator[Candidate]:
     base_url = "https://list.proxylistplus.com/Fresh-HTTP-Proxy-List-"
-    for page in range(1, pages+1):
-        url = base_url + str(page)
-        try:
-            res = requests.get(url, headers=generate_headers())
-            if res.status_code != 200:
+
+    def parse(res: requests.Response) -> Collection[Candidate]:
+        proxies = set()
+        if res.status_code != 200:
+            return proxies
+        soup = make_soup(res.text, bs4.SoupStrainer("tr"))
+        rows = soup.find_all("tr")  # find all rows in the document
+        for row in rows:
+            columns = row.find_all("td")
+            if not columns or len(columns) < 3:
                 continue
-            soup = bs4.BeautifulSoup(res.text, features='html.parser')
-            rows = soup.find_all("tr")  # find all rows in the document
-            if not rows:
+            host = columns[1].text
+            if not valid_ip(host):
                 continue
-            for row in rows:
-                columns = row.find_all("td")
-                if not columns or len(columns) < 3:
-                    continue
-                host = columns[1].text
-                if not valid_ip(host):
-                    continue
-                port = columns[2].text
-                proxy = f"{host}:{port}"
-                proxies.add(proxy)
-        except Exception as ex:
-            print(f"'{ex}' while handling {url}.")
-    return proxies
+            port = columns[2].text
+            proxy = Candidate(f"{host}:{port}", "http")
+            proxies.add(proxy)
+        return proxies
+
+    return fetch_pages((base_url + str(page) for page in range(1, pages+1)), parse)
 
 
 # 6
 def scrape_proxyrack(pages=5):
-    proxies = set()
+    return set(iter_proxyrack(pages))
+
+
+def iter_proxyrack(pages=5) -> Iterator[str]:
     base_url = "https://www.proxyrack.com/proxyfinder/proxies.json"
     step = 50
-    for page in range(1, pages+1):
-        offset = (page - 1) * step
-        url = base_url + f"?page={page}&perPage={step}&offset={offset}"
+
+    def headers() -> dict[str, str]:
+        h = generate_headers()
+        h['Accept'] = "application/json, text/javascript, */*"
+        return h
+
+    def parse(res: requests.Response) -> Collection[str]:
+        proxies = set()
+        if res.status_code != 200:
+            return proxies
         try:
-            headers = generate_headers()
-            headers['Accept'] = "application/json, text/javascript, */*"
-            res = requests.get(url, headers=headers)
-            if res.status_code != 200:
-                continue
-            try:
-                data = res.json()["records"]
-                for proxy_json in data:
-                    host = proxy_json['ip']
-                    if not valid_ip(host):
-                        continue
-                    port = proxy_json['port']
-                    proxy_str = f"{host}:{port}"
-                    proxies.add(proxy_str)
-            except json.JSONDecodeError:
-                continue
-            except KeyError:
-                continue
-        except Exception as ex:
-            print(f"'{ex}' while handling url {url}.")
-    return proxies
+            data = res.json()["records"]
+            for proxy_json in data:
+                host = proxy_json['ip']
+                if not valid_ip(host):
+                    continue
+                port = proxy_json['port']
+                proxy_str = f"{host}:{port}"
+                proxies.add(proxy_str)
+        except json.JSONDecodeError:
+            pass
+        except KeyError:
+            pass  # whatever has been parsed is still good
+        return proxies
+
+    urls = (base_url + f"?page={page}&perPage={step}&offset={(page - 1) * step}" for page in range(1, pages+1))
+    return fetch_pages(urls, parse, headers)
 
 
 # 7
 def scrape_proxy_list_download() -> Collection[str]:
-    proxies = set()
-    urls = [
-        "https://www.proxy-list.download/api/v0/get?l=en&t=socks4",
-        "https://www.proxy-list.download/api/v0/get?l=en&t=http",
-        "https://www.proxy-list.download/api/v0/get?l=en&t=socks5",
-        "https://www.proxy-list.download/api/v0/get?l=en&t=https",
-    ]
-    for url in urls:
+    return set(iter_proxy_list_download())
+
+
+def iter_proxy_list_download() -> Iterator[Candidate]:
+    urls = {
+        "https://www.proxy-list.download/api/v0/get?l=en&t=socks4": "socks4",
+        "https://www.proxy-list.download/api/v0/get?l=en&t=http": "http",
+        "https://www.proxy-list.download/api/v0/get?l=en&t=socks5": "socks5",
+        "https://www.proxy-list.download/api/v0/get?l=en&t=https": "https",
+    }
+    for url, protocol in urls.items():
+        proxies = set()
         try:
             headers = generate_headers()
             headers["Accept"] = "*/*"
-            res = requests.get(url, headers=headers)
+            res = scrape_session().get(url, headers=headers, timeout=PAGE_TIMEOUT)
             if res.status_code == 200:
                 try:
                     data = res.json()[0]["LISTA"]
@@ -303,7 +519,7 @@ def scrape_proxy_list_download() -> Collection[str]:
                             if not valid_ip(host):
                                 continue
                             port = record["PORT"]
-                            proxy = f"{host}:{port}"
+                            proxy = Candidate(f"{host}:{port}", protocol)
                             proxies.add(proxy)
                         except KeyError:
                             continue
@@ -315,7 +531,7 @@ def scrape_proxy_list_download() -> Collection[str]:
                     pass
         except:
             pass
-    return proxies
+        yield from proxies
 
 
 # 8
@@ -404,10 +620,11 @@ def scrape_spysone() -> Collection[str]:
         data = {"xpp": "5", "xf1": "0", "xf2": "0", "xf3": "0", "xf4": "0", "xf5": "0"}
         proxies = set()
 
+        # not through the scrape session: the page carries a one time token, so it mustn't come from the cache
         response = requests.get(url, headers=generate_headers())
         if response.status_code != 200:
             return proxies
-        soup = bs4.BeautifulSoup(response.text, features='html.parser')
+        soup = make_soup(response.text)
         rows1 = soup.find_all(attrs={"class": "spy1xx"})
         rows2 = soup.find_all(attrs={"class": "spy1x"})
         encoding = get_port_encoding(soup)
@@ -434,7 +651,7 @@ def scrape_spysone() -> Collection[str]:
         response = requests.post(url, headers=generate_headers(), data=data)
         if response.status_code != 200:
             return proxies
-        soup = bs4.BeautifulSoup(response.text, features='html.parser')
+        soup = make_soup(response.text)
         encoding = get_port_encoding(soup)
         if not encoding:
             return proxies
@@ -537,7 +754,7 @@ def scrape_xseo_in() -> Collection[str]:
         if response.status_code != 200:
             return proxies
 
-        soup = bs4.BeautifulSoup(response.text, features='html.parser')
+        soup = make_soup(response.text)
         if not free:
             encoding = get_port_encoding(soup)
             if not encoding:
@@ -571,3 +788,63 @@ def scrape_xseo_in() -> Collection[str]:
     except Exception as ex:
         print(f"'{ex}' while scraping {url}.")
     return r
+
+
+# the streaming variants are used where there are any
+SCRAPERS = (
+    iter_ip3366, scrape_89ip, scrape_proxynova, iter_myproxy, iter_freeproxy_cz, scrape_ipaddress,
+    iter_proxylistplus, iter_proxyrack, iter_proxy_list_download, scrape_spysone, scrape_xseo_in,
+)
+
+
+def scrape_all(scrapers: Collection[Callable[[], Iterable[str]]] = SCRAPERS,
+               max_workers: Optional[int] = None) -> Iterator[str]:
+    """
+    Runs all the scrapers concurrently and yields every "host:port" candidate once, as soon as it's scraped.
+    Scrapers which yield page by page are streamed from, the rest are yielded from when they return.
+    Wall-clock time is about the time of the slowest scraper.
+    :param scrapers: scraper functions
+    :param max_workers: max number of scrapers running at once (all of them by default)
+    """
+    candidates = queue.Queue()
+    done = object()  # every scraper puts it in the end
+
+    def run(scraper: Callable[[], Iterable[str]]) -> None:
+        try:
+            for candidate in scraper():
+                candidates.put(candidate)
+        except Exception as ex:
+            print(f"'{ex}' while running {scraper.__name__}.")
+        finally:
+            candidates.put(done)
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max_workers or len(scrapers)) as executor:
+        for scraper in scrapers:
+            executor.submit(run, scraper)
+        running = len(scrapers)
+        while running:
+            candidate = candidates.get()
+            if candidate is done:
+                running -= 1
+            elif candidate not in seen:
+                seen.add(candidate)
+                yield candidate
+
+
+def scrape_into(pool: ProxyPool, scrapers: Collection[Callable[[], Iterable[str]]] = SCRAPERS,
+                max_workers: Optional[int] = None) -> int:
+    """
+    Scrapes all the sources concurrently, straight into the pool's validation queue,
+    so that scraping and validation overlap.
+    >>> with ProxyPool(urls) as proxy_pool:
+    >>>     scrape_into(proxy_pool)
+    :return: number of candidates submitted
+    """
+    submitted = 0
+    for candidate in scrape_all(scrapers, max_workers):
+        try:
+            submitted += pool.add(candidate)
+        except (ValueError, TypeError):
+            pass  # not a "host:port" string
+    return submitted
@@ -0,0 +1,195 @@
+from __future__ import annotations
+from typing import Optional, Collection
+from concurrent.futures import ThreadPoolExecutor
+from time import time, monotonic, sleep
+import multiprocessing
+import threading
+import queue
+import os
+from pool import ProxyPool, Proxy
+
+
+METRICS_INTERVAL = 1.0  # seconds between the metrics sent by a worker
+
+
+def _shard_worker(config: dict, inbox, outbox, cancelled) -> None:
+    # runs in a worker process: checks the candidates of its shard with a pool of its own,
+    # which never keeps any proxy, the results are sent back to the parent
+    pool = ProxyPool(**config)
+    pool._cancelled = cancelled  # the checks of all the shards are cancelled at once
+    offset = time() - monotonic()  # the histories are sent with wall clock timestamps
+    sent = [monotonic()]  # when the metrics were last sent
+
+    def send_metrics(interval: float) -> None:
+        # the counters are sent as the increments since the previous send, which the parent adds up
+        if monotonic() - sent[0] >= interval:
+            sent[0] = monotonic()
+            outbox.put(("metrics", pool.metrics.drain()))
+
+    def check(host: str, port: int, a, connect: bool) -> None:
+        try:
+            checked(host, port, a, connect)
+        finally:
+            send_metrics(METRICS_INTERVAL)
+
+    def checked(host: str, port: int, a, connect: bool) -> None:
+        proxy = Proxy(pool, host, port, a)
+        try:
+            if cancelled.is_set() or not pool._check(proxy, connect):
+                outbox.put(("unchecked", host, port, a, None, None, None, None, None))
+                return
+        except Exception as ex:
+            print(f"'{ex}' while checking {proxy!r}.")
+            outbox.put(("failed", host, port, a, None, None, None, None, None))
+            return
+        outbox.put(("checked", host, port, a, proxy.protocols, *proxy.dump_history(offset),
+                    (proxy._connect_latency, proxy._handshake_latency, proxy._read_latency),
+                    proxy._inconclusive))
+
+    workers = pool.max_proxy_workers if pool.concurrency is None else pool.concurrency.max_limit
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            try:
+                candidate = inbox.get(timeout=METRICS_INTERVAL)
+            except queue.Empty:
+                send_metrics(METRICS_INTERVAL)  # an idle or slowly checking shard still reports
+                continue
+            if candidate is None:
+                break
+            executor.submit(check, *candidate)
+    send_metrics(0.0)
+
+
+class ShardedProxyPool(ProxyPool):
+    """
+    Proxy pool, which checks the candidates in worker processes, so that the checks aren't bound by a single GIL.
+    Every candidate goes to the worker of its shard (by the hash of its host and port),
+    every worker checks max_proxy_workers candidates at once.
+    The results are streamed back to this pool, which ranks them, calls the callback,
+    enforces the limits and feeds the results streams just like ProxyPool does.
+    The workers are started, when the context is entered for the first time, and are kept until close.
+    The metrics of the checks are counted by the workers and added to the ones of this pool every second.
+    The negative cache is kept by this pool, which submits the candidates and receives the results,
+    a concurrency controller is copied to every worker, which tunes its copy on its own
+    (the file descriptors and ports run out per process), the one passed in isn't updated then.
+    >>> with ShardedProxyPool(urls, processes=8, max_proxy_workers=50).limit_capacity(100) as proxy_pool:
+    >>>     proxy_pool.add_many(random_proxies)
+    >>> proxy_pool.close()  # stops the worker processes
+    """
+    processes: int
+
+    def __init__(self,
+                 urls: list[str], timeout: float = 2.0,
+                 protocols: Optional[Collection[str]] = None,
+                 processes: Optional[int] = None,
+                 start_method: Optional[str] = None,
+                 **kwargs):
+        """
+        :param urls: urls to test the proxies against
+        :param timeout: request timeout
+        :param protocols: set of protocols to check proxies for
+        :param processes: number of worker processes, the number of CPUs by default
+        :param start_method: multiprocessing start method of the workers ("spawn", "fork", "forkserver")
+        :param kwargs: the rest of the ProxyPool arguments
+        """
+        super().__init__(urls, timeout, protocols, **kwargs)
+        # the checks are run by the workers, so are the copies of the controller, this pool has none of its own
+        self._worker_concurrency, self.concurrency = self.concurrency, None
+        self.processes = processes or os.cpu_count() or 1
+        if self.processes < 1:
+            raise ValueError(f"processes={self.processes}: must be a positive number.")
+        self._context = multiprocessing.get_context(start_method)
+        self._cancelled = self._context.Event()  # shared with the workers
+        self._workers = []
+        self._inboxes = []
+        self._outbox = None
+        self._receiver: Optional[threading.Thread] = None
+
+    def start(self) -> ShardedProxyPool:
+        if self._workers:
+            return self
+        config = dict(
+            urls=self.urls, timeout=self.timeout, protocols=self.protocols,
+            max_protocol_workers=self.max_protocol_workers, max_proxy_workers=self.max_proxy_workers,
+            connect_timeout=self.connect_timeout, probe=self.probe, history_size=self.history_size,
+            adaptive_timeouts=self.timeouts.adaptive, max_timeout=self.timeouts.max_read_timeout,
+            score=self.score, throughput_bytes=self.throughput_bytes, throughput_window=self.throughput_window,
+            fresh_connection_rate=self.fresh_connection_rate, concurrency=self._worker_concurrency,
+        )
+        self._outbox = self._context.Queue()
+        for i in range(self.processes):
+            inbox = self._context.Queue()
+            worker = self._context.Process(target=_shard_worker, args=(config, inbox, self._outbox, self._cancelled),
+                                           name=f"ProxyPoolShard-{i}", daemon=True)
+            worker.start()
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+        self._receiver = threading.Thread(target=self._receive, name="ShardedProxyPool", daemon=True)
+        self._receiver.start()
+        return self
+
+    def close(self) -> None:
+        """
+        Stops the worker processes, once they're done with the candidates submitted to them.
+        """
+        if not self._workers:
+            return
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._outbox.put(None)
+        self._receiver.join()
+        self._workers.clear()
+        self._inboxes.clear()
+        self._outbox = None
+        self._receiver = None
+
+    def _submit(self, proxy: Proxy, connect: bool = True) -> None:
+        shard = hash((proxy.host, proxy.port)) % self.processes
+        self._inboxes[shard].put((proxy.host, proxy.port, proxy.auth, connect))
+
+    def _receive(self) -> None:
+        offset = monotonic() - time()
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                break
+            if message[0] == "metrics":
+                self.metrics.merge(message[1])
+                continue
+            kind, host, port, a, protocols, speed, online, latencies, inconclusive = message
+            proxy = Proxy(self, host, port, a)
+            try:
+                if kind == "unchecked":
+                    self._uncheck(proxy)
+                elif kind == "checked":
+                    proxy.protocols = protocols
+                    proxy.restore_history(speed, online, self.history_size, offset)
+                    proxy._connect_latency, proxy._handshake_latency, proxy._read_latency = latencies
+                    proxy._inconclusive = inconclusive
+                    proxy._cache_health()
+                    self._on_check(proxy)
+                    streams = self._checked(proxy)
+                    if streams is not None:
+                        self._publish(proxy, streams)
+            except Exception as ex:
+                print(f"'{ex}' while receiving {proxy!r}.")
+            finally:
+                self._done(proxy)
+
+    def _gauges(self) -> dict:
+        gauges = super()._gauges()
+        # the counters of the workers arrive up to METRICS_INTERVAL late, so the checks in flight are the pending ones
+        gauges["in_flight"] = gauges["pending"]
+        return gauges
+
+    def __enter__(self):
+        super().__enter__()
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        # every submitted candidate is waited for, just like the executor of ProxyPool is
+        while not self._idle() and any(worker.is_alive() for worker in self._workers):
+            sleep(0.01)
+        return super().__exit__(type, value, traceback)
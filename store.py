@@ -0,0 +1,105 @@
+from __future__ import annotations
+from typing import Iterator
+from time import time, monotonic
+import sqlite3
+import threading
+from pool import Proxy
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS proxies (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    username TEXT,
+    password TEXT,
+    protocols TEXT NOT NULL,
+    speed BLOB NOT NULL,
+    online BLOB NOT NULL,
+    updated REAL NOT NULL,
+    connect_latency REAL NOT NULL DEFAULT 0,
+    handshake_latency REAL NOT NULL DEFAULT 0,
+    ttfb REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (host, port)
+)
+"""
+# columns added since the first version of the schema, the stores created before lack them
+LATENCY_COLUMNS = ("connect_latency", "handshake_latency", "ttfb")
+COLUMNS = ("host", "port", "username", "password", "protocols", "speed", "online", "updated") + LATENCY_COLUMNS
+
+
+class ProxyStore:
+    """
+    SQLite backed store of the checked proxies: their protocols, credentials, health history and latencies.
+    Attach it to a pool to save every proxy as soon as its check completes,
+    then warm start the next process with ProxyPool.load.
+    >>> store = ProxyStore("proxies.sqlite3")
+    >>> proxy_pool = ProxyPool.load(store, urls)  # known good proxies are available right away
+    >>> with HealthScheduler(proxy_pool):  # while they're being re-checked in the background
+    >>>     ...
+    """
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(SCHEMA)
+        existing = {row[1] for row in self._connection.execute("PRAGMA table_info(proxies)")}
+        for column in LATENCY_COLUMNS:
+            if column not in existing:
+                self._connection.execute(f"ALTER TABLE proxies ADD COLUMN {column} REAL NOT NULL DEFAULT 0")
+        self._lock = threading.Lock()
+
+    def save(self, proxy: Proxy) -> None:
+        # histories keep monotonic timestamps, which mean nothing after a restart, so wall clock time is stored
+        offset = time() - monotonic()
+        username, password = proxy.auth if proxy.auth else (None, None)
+        record = (
+            proxy.host, proxy.port, username, password, ",".join(proxy.protocols),
+            *proxy.dump_history(offset), time(),
+            proxy.connect_latency, proxy.handshake_latency, proxy.ttfb
+        )
+        with self._lock:
+            self._connection.execute(f"INSERT OR REPLACE INTO proxies ({', '.join(COLUMNS)}) "
+                                     f"VALUES ({', '.join('?' * len(COLUMNS))})", record)
+
+    def delete(self, host: str, port: int) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM proxies WHERE host = ? AND port = ?", (host, port))
+
+    def load(self, pool) -> Iterator[Proxy]:
+        """
+        :param pool: the pool, which the proxies are created for
+        :return: the stored proxies, with their histories and latencies restored
+        """
+        offset = monotonic() - time()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT host, port, username, password, protocols, speed, online, "
+                "connect_latency, handshake_latency, ttfb FROM proxies"
+            ).fetchall()
+        for host, port, username, password, protocols, speed, online, connect, handshake, ttfb in rows:
+            a = (username, password) if username is not None or password is not None else None
+            proxy = Proxy(pool, host, port, a)
+            proxy.protocols = protocols.split(",") if protocols else []
+            proxy.restore_history(speed, online, pool.history_size, offset)
+            proxy._connect_latency = connect
+            proxy._handshake_latency = handshake
+            proxy._read_latency = ttfb
+            yield proxy
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM proxies").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,116 @@
+from __future__ import annotations
+from typing import Iterable, Iterator, Optional, Callable
+from collections import deque
+from time import monotonic
+import selectors
+import socket
+import errno
+from concurrency import is_local_error, LOCAL_ERRNOS
+
+
+def _open(host: str, port: int) -> socket.socket:
+    """
+    Starts a non-blocking connection.
+    :raises OSError: if the connection failed right away
+    """
+    family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    s = socket.socket(family, socket.SOCK_STREAM)
+    s.setblocking(False)
+    code = s.connect_ex(address)
+    if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+        s.close()
+        raise OSError(code, errno.errorcode.get(code, "connect failed"))
+    return s
+
+
+def connect_sweep(candidates: Iterable[tuple[str, int]],
+                  timeout: float = 2.0, max_sockets: int = 512,
+                  failed: Optional[set[tuple[str, int]]] = None,
+                  local_error: Optional[Callable[[OSError], object]] = None) -> Iterator[tuple[str, int]]:
+    """
+    Tries to connect to every candidate (host, port) pair using non-blocking sockets,
+    with at most max_sockets connection attempts in flight.
+    Candidates are consumed lazily and reachable endpoints are yielded as soon as they accept the connection,
+    so the protocol checks of the first reachable proxies can start while the sweep goes on.
+    Running out of local resources (file descriptors, ports) says nothing about a candidate: it's retried
+    with fewer attempts in flight, or, if there are none to wait for, the sweep stops
+    (the candidates, which haven't been tried, are neither yielded nor failed then).
+    >>> for host, port in connect_sweep([("127.0.0.1", 9050), ("10.0.0.1", 8080)], timeout=1.0):
+    >>>     print(host, port)
+    :param candidates: (host, port) pairs to connect to
+    :param timeout: deadline of every connection attempt (seconds)
+    :param max_sockets: max number of connection attempts in flight
+    :param failed: the candidates, which have refused the connection, timed out or couldn't be resolved, are added
+    :param local_error: called with every error caused by the exhaustion of local resources
+    :return: iterator of reachable (host, port) pairs
+    """
+    if max_sockets < 1:
+        raise ValueError(f"max_sockets={max_sockets}: must be a positive number.")
+    candidates = iter(candidates)
+    selector = selectors.DefaultSelector()
+    # every attempt has the same timeout, so the deadlines are ordered the same way the attempts were started
+    deadlines: deque[tuple[float, socket.socket]] = deque()
+    retries: deque[tuple[str, int]] = deque()  # the candidates, which have hit local errors
+    limit = max_sockets  # shrinks to what this machine can hold, then grows back by one per completed attempt
+    exhausted = False
+    stopped = False
+    try:
+        while True:
+            # keep the funnel full
+            while not stopped and len(selector.get_map()) < limit:
+                if retries:
+                    host, port = retries.popleft()
+                elif exhausted:
+                    break
+                else:
+                    try:
+                        host, port = next(candidates)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                try:
+                    s = _open(host, port)
+                except OSError as ex:
+                    if is_local_error(ex):
+                        if local_error is not None:
+                            local_error(ex)
+                        retries.appendleft((host, port))
+                        in_flight = len(selector.get_map())
+                        stopped = in_flight == 0  # nothing will free the resources up
+                        limit = max(in_flight, 1)
+                        break
+                    if failed is not None:
+                        failed.add((host, port))  # refused right away, or the host couldn't be resolved
+                    continue
+                selector.register(s, selectors.EVENT_WRITE, (host, port))
+                deadlines.append((monotonic() + timeout, s))
+            if not selector.get_map():
+                break
+            # wait until either a connection completes or the oldest attempt expires
+            wait = max(0.0, deadlines[0][0] - monotonic()) if deadlines else timeout
+            for key, _ in selector.select(wait):
+                s = key.fileobj
+                selector.unregister(s)
+                error = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                s.close()
+                limit = min(limit + 1, max_sockets)
+                if error == 0:
+                    yield key.data
+                elif error in LOCAL_ERRNOS:
+                    if local_error is not None:
+                        local_error(OSError(error, errno.errorcode.get(error, "connect failed")))
+                    retries.append(key.data)
+                elif failed is not None:
+                    failed.add(key.data)
+            now = monotonic()
+            while deadlines and (deadlines[0][0] <= now or deadlines[0][1].fileno() == -1):
+                _, s = deadlines.popleft()
+                if s.fileno() != -1:  # still connecting, give up on it
+                    if failed is not None:
+                        failed.add(selector.get_key(s).data)
+                    selector.unregister(s)
+                    s.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
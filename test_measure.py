@@ -0,0 +1,150 @@
+"""
+Fetches of measure.py through local proxies to a local https server, TLS to an https proxy included.
+Run: python -m pytest -q test_measure.py (or python -m unittest test_measure)
+"""
+from __future__ import annotations
+import os
+import select
+import shutil
+import socket
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import measure
+from measure import fetch
+
+
+BODY = bytes(range(256)) * 64
+TIMEOUT = 2.0
+
+
+def _make_certificate(directory: str) -> tuple[str, str]:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                    "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def _relay(a: socket.socket, b: socket.socket) -> None:
+    # a single thread, since an SSLSocket mustn't be read and written from two at once
+    while True:
+        readable = [s for s in (a, b) if isinstance(s, ssl.SSLSocket) and s.pending()]
+        if not readable:
+            readable, _, _ = select.select([a, b], [], [], TIMEOUT)
+            if not readable:
+                return
+        for s in readable:
+            data = s.recv(65536)
+            if not data:
+                return
+            (b if s is a else a).sendall(data)
+
+
+class ConnectProxy(socketserver.StreamRequestHandler):
+    # the connections are TLS, if the server has a context (an https proxy)
+    def setup(self):
+        if self.server.context is not None:
+            self.request = self.server.context.wrap_socket(self.request, server_side=True)
+        super().setup()
+
+    def handle(self):
+        line = self.rfile.readline(65537)
+        while self.rfile.readline(65537) not in (b"\r\n", b"\n", b""):
+            pass
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        if method != "CONNECT":
+            self.wfile.write(b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n")
+            return
+        host, port = target.rsplit(":", 1)
+        with socket.create_connection(("127.0.0.1" if host == "localhost" else host, int(port))) as upstream:
+            self.wfile.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+            self.wfile.flush()
+            _relay(self.request, upstream)
+
+
+class ProxyServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, context: ssl.SSLContext | None):
+        self.context = context
+        super().__init__(("127.0.0.1", 0), ConnectProxy)
+
+    def handle_error(self, request, client_address):
+        pass  # the clients hang up, once they've read the body
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(shutil.which("openssl"), "openssl is needed to make a certificate")
+class FetchTest(unittest.TestCase):
+    servers: list = []
+
+    @classmethod
+    def serve(cls, server) -> int:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.servers.append(server)
+        return server.server_address[1]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cert, key = _make_certificate(cls.directory.name)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+        cls.client_context = ssl.create_default_context(cafile=cert)
+        origin = ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler)
+        origin.daemon_threads = True
+        origin.socket = server_context.wrap_socket(origin.socket, server_side=True)
+        cls.url = f"https://localhost:{cls.serve(origin)}/"
+        cls.http_port = cls.serve(ProxyServer(None))
+        cls.https_port = cls.serve(ProxyServer(server_context))
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+        cls.servers.clear()
+        cls.directory.cleanup()
+
+    def fetch(self, port: int, protocol: str, **kwargs) -> measure.Timings:
+        with mock.patch.object(measure, "TLS_CONTEXT", self.client_context):  # trusts the test certificate
+            return fetch("127.0.0.1", port, protocol, self.url, TIMEOUT, **kwargs)
+
+    def test_https_through_http_proxy(self):
+        timings = self.fetch(self.http_port, "http")
+        self.assertEqual((timings.status, timings.size), (200, len(BODY)))
+
+    def test_https_through_https_proxy(self):
+        # TLS to the server inside TLS to the proxy
+        timings = self.fetch(self.https_port, "https")
+        self.assertEqual((timings.status, timings.size), (200, len(BODY)))
+        self.assertGreater(timings.handshake, 0)
+
+    def test_https_through_https_proxy_with_budget(self):
+        timings = self.fetch(self.https_port, "https", max_bytes=1000)
+        self.assertEqual((timings.status, timings.size), (200, 1000))
+
+    def test_server_certificate_is_verified(self):
+        with self.assertRaises(ssl.SSLCertVerificationError):
+            fetch("127.0.0.1", self.https_port, "https", self.url, TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+The numpy scan of netutils.extract_host_port_records against its regex: the same records from the same bytes.
+Run: python -m pytest -q test_netutils.py (or python -m unittest test_netutils)
+"""
+from __future__ import annotations
+import random
+import unittest
+from unittest import mock
+import netutils
+from netutils import extract_host_port_records, unpack_host_port
+
+
+CASES = [
+    b"",
+    b"1.2.3.4:80",
+    b"<td>10.0.0.1:8080</td><td>192.168.1.254:3128</td>",
+    b"a1.2.3.4:80 1.2.3.4:80b _1.2.3.4:80",  # no \b next to a word character
+    b"1.2.3.4.5:80 1.2.3.4:80:90 1.2.3.4:80.5",  # a pair within a longer run
+    b"01.2.3.4:80 1.2.3.4:080 1.2.3.0:0 0.0.0.0:00",  # leading zeros
+    b"256.1.1.1:80 1.1.1.1:65536 1.1.1.1:123456 1234.1.1.1:80",  # out of the ranges
+    b"1.2.3:80 1..2.3.4:80 1.2.3.4: :80 12:30:45.5.6",
+    b"255.255.255.255:65535\n",
+]
+
+
+def _with_regex(data: bytes) -> list[int]:
+    with mock.patch.object(netutils, "numpy", None):
+        return list(extract_host_port_records(data))
+
+
+@unittest.skipIf(netutils.numpy is None, "numpy isn't installed")
+class ExtractTest(unittest.TestCase):
+    def assertSameRecords(self, data: bytes):
+        expected = _with_regex(data)
+        self.assertEqual(list(extract_host_port_records(data, as_numpy=False)), expected)
+        self.assertEqual(extract_host_port_records(data).tolist(), expected)
+
+    def test_cases(self):
+        for data in CASES:
+            with self.subTest(data=data):
+                self.assertSameRecords(data)
+
+    def test_found(self):
+        records = extract_host_port_records(b"<td>10.0.0.1:8080</td> 1.2.3.4.5:80 a1.1.1.1:1 1.1.1.1:1b")
+        self.assertEqual([unpack_host_port(record) for record in records], [("10.0.0.1", 8080), ("2.3.4.5", 80)])
+
+    def test_random(self):
+        rnd = random.Random(0)
+        pieces = [b"0", b"1", b"25", b"255", b"256", b"007", b"65535", b"99999", b".", b":", b" ", b"a", b"\n"]
+        for _ in range(500):
+            data = b"".join(rnd.choice(pieces) for _ in range(rnd.randrange(40)))
+            with self.subTest(data=data):
+                self.assertSameRecords(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+Protocol detection of probe.py against local servers, which speak a single protocol each.
+Run: python -m pytest -q test_probe.py (or python -m unittest test_probe)
+"""
+from __future__ import annotations
+import asyncio
+import socket
+import socketserver
+import threading
+import unittest
+from probe import probe, probe_http, probe_socks5
+import aiopool
+
+
+URL = "http://127.0.0.1:9/"  # the servers below never connect anywhere, they just agree to
+TIMEOUT = 0.3
+
+
+def _recv_exactly(s: socket.socket, n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = s.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _recv_until_nul(s: socket.socket) -> bytes:
+    data = b""
+    while not data.endswith(b"\x00"):
+        chunk = s.recv(1)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class LineHTTPProxy(socketserver.StreamRequestHandler):
+    # reads the request line by line (like tinyproxy or squid), so the SOCKS5 greeting is never answered
+    def handle(self):
+        line = self.rfile.readline(65537)
+        while self.rfile.readline(65537) not in (b"\r\n", b"\n", b""):
+            pass
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        if method == "CONNECT" or target.startswith("http://"):
+            self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+        else:
+            self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+
+
+class Socks4Proxy(socketserver.BaseRequestHandler):
+    def handle(self):
+        s = self.request
+        header = _recv_exactly(s, 8)
+        if len(header) < 8 or header[0] != 4:
+            return
+        _recv_until_nul(s)  # user id
+        if header[4:7] == b"\x00\x00\x00" and header[7]:
+            _recv_until_nul(s)  # socks4a host name
+        s.sendall(b"\x00\x5a" + b"\x00" * 6)
+
+
+class Socks5Proxy(socketserver.BaseRequestHandler):
+    def handle(self):
+        s = self.request
+        greeting = _recv_exactly(s, 2)
+        if len(greeting) < 2 or greeting[0] != 5:
+            return
+        _recv_exactly(s, greeting[1])  # methods
+        s.sendall(b"\x05\x00")
+        header = _recv_exactly(s, 4)
+        if len(header) < 4:
+            return
+        if header[3] == 1:
+            _recv_exactly(s, 4)
+        elif header[3] == 3:
+            _recv_exactly(s, _recv_exactly(s, 1)[0])
+        else:
+            _recv_exactly(s, 16)
+        _recv_exactly(s, 2)  # port
+        s.sendall(b"\x05\x00\x00\x01" + b"\x00" * 6)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        pass  # the probes hang up, once they've found out what they wanted
+
+
+class ProbeTest(unittest.TestCase):
+    servers: list[Server] = []
+
+    @classmethod
+    def serve(cls, handler) -> int:
+        server = Server(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.servers.append(server)
+        return server.server_address[1]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.http_port = cls.serve(LineHTTPProxy)
+        cls.socks4_port = cls.serve(Socks4Proxy)
+        cls.socks5_port = cls.serve(Socks5Proxy)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+        cls.servers.clear()
+
+    def test_line_reading_http_proxy_never_answers_socks5_greeting(self):
+        with socket.create_connection(("127.0.0.1", self.http_port), timeout=TIMEOUT) as s:
+            with self.assertRaises(OSError):  # a timeout
+                probe_socks5(s)
+
+    def test_probe_http_codec(self):
+        with socket.create_connection(("127.0.0.1", self.http_port), timeout=TIMEOUT) as s:
+            self.assertTrue(probe_http(s, URL))
+        with socket.create_connection(("127.0.0.1", self.http_port), timeout=TIMEOUT) as s:
+            self.assertTrue(probe_http(s, "https://127.0.0.1:9/"))  # CONNECT
+
+    def test_http(self):
+        self.assertEqual(probe("127.0.0.1", self.http_port, URL, TIMEOUT), ["http"])
+
+    def test_socks4(self):
+        self.assertEqual(probe("127.0.0.1", self.socks4_port, URL, TIMEOUT), ["socks4a", "socks4"])
+        self.assertEqual(probe("127.0.0.1", self.socks4_port, URL, TIMEOUT, protocols=("socks4",)), ["socks4"])
+
+    def test_socks5(self):
+        self.assertEqual(probe("127.0.0.1", self.socks5_port, URL, TIMEOUT), ["socks5h", "socks5"])
+
+    def test_nothing_listening(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]  # closed right away, so nothing listens there
+        self.assertEqual(probe("127.0.0.1", port, URL, TIMEOUT), [])
+
+    def test_async_probe(self):
+        # the same detection on the event loop (AsyncProxyPool with probe=True)
+        for port, protocols in ((self.http_port, ["http"]), (self.socks4_port, ["socks4a", "socks4"]),
+                                (self.socks5_port, ["socks5h", "socks5"])):
+            with self.subTest(protocols=protocols):
+                self.assertEqual(asyncio.run(aiopool.probe("127.0.0.1", port, URL, TIMEOUT)), protocols)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Warm start of a pool from store.py: the saved proxies are handed out right away.
+Run: python -m pytest -q test_store.py (or python -m unittest test_store)
+"""
+from __future__ import annotations
+import os
+import sqlite3
+import tempfile
+import unittest
+from array import array
+from pool import ProxyPool, Proxy
+from store import ProxyStore
+
+
+URLS = ["http://127.0.0.1:9/"]  # nothing is checked, the proxies come from the store
+
+
+def _checked_proxy(pool: ProxyPool, port: int) -> Proxy:
+    proxy = Proxy(pool, "127.0.0.1", port)
+    proxy.protocols = ["http"]
+    proxy.add_online(True)
+    proxy._connect_latency, proxy._handshake_latency, proxy._read_latency = 0.01, 0.02, 0.03
+    return proxy
+
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "proxies.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_load_acquire(self):
+        with ProxyStore(self.path) as store:
+            store.save(_checked_proxy(ProxyPool(URLS), 8080))
+        with ProxyStore(self.path) as store:
+            pool = ProxyPool.load(store, URLS)
+            proxy = pool.acquire(block=False)
+        self.assertIsNotNone(proxy)
+        self.assertEqual((proxy.host, proxy.port, proxy.protocols), ("127.0.0.1", 8080, ["http"]))
+        self.assertEqual((proxy.connect_latency, proxy.handshake_latency, proxy.ttfb), (0.01, 0.02, 0.03))
+        self.assertGreater(proxy.rating(), 0)
+
+    def test_store_without_latencies(self):
+        # a store of the first schema version gets the latency columns, its proxies can still be handed out
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE proxies (host TEXT NOT NULL, port INTEGER NOT NULL, username TEXT, "
+                           "password TEXT, protocols TEXT NOT NULL, speed BLOB NOT NULL, online BLOB NOT NULL, "
+                           "updated REAL NOT NULL, PRIMARY KEY (host, port))")
+        proxy = _checked_proxy(ProxyPool(URLS), 8080)
+        connection.execute("INSERT INTO proxies VALUES ('127.0.0.1', 8080, NULL, NULL, 'http', ?, ?, 0)",
+                           proxy.dump_history())
+        connection.commit()
+        connection.close()
+        with ProxyStore(self.path) as store:
+            pool = ProxyPool.load(store, URLS)
+            self.assertEqual(pool.acquire(block=False), "127.0.0.1:8080")
+            store.save(_checked_proxy(pool, 8081))
+            self.assertEqual(len(store), 2)
+
+    def test_history_of_separate_records(self):
+        # the throughputs used to be kept apart from the checks, a moment before them: they belong to the next check
+        pool = ProxyPool(URLS, history_size=2)
+        proxy = Proxy(pool, "127.0.0.1", 8080)
+        speeds = array("d", [1000.0, 9.5, 3000.0, 29.5, 5000.0, 29.6]).tobytes()
+        online = array("d", [1.0, 10.0, 0.0, 20.0, 1.0, 30.0]).tobytes()
+        proxy.restore_history(speeds, online, pool.history_size)
+        self.assertEqual([b for b, _ in proxy.online_checks], [False, True])
+        self.assertEqual([speed for speed, _ in proxy.response_stats], [5000.0])
+        self.assertEqual((proxy.uptime(), proxy.mean_speed(), proxy.last_online()), (0.5, 5000.0, True))
+        restored = Proxy(pool, "127.0.0.1", 8080)
+        restored.restore_history(*proxy.dump_history(), pool.history_size)
+        self.assertEqual((restored.online_checks, restored.response_stats), (proxy.online_checks, proxy.response_stats))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Connect sweep of sweep.py against local ports, with the local resources running out.
+Run: python -m pytest -q test_sweep.py (or python -m unittest test_sweep)
+"""
+from __future__ import annotations
+import errno
+import socket
+import unittest
+from unittest import mock
+import sweep
+from sweep import connect_sweep
+from pool import ProxyPool
+from negcache import NegativeCache
+
+
+def _closed_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]  # closed right away, so nothing listens there
+
+
+class LimitedOpen:
+    # the real _open, which fails with EMFILE, while max_open of its sockets are open
+    def __init__(self, max_open: int):
+        self.max_open = max_open
+        self.open = sweep._open
+        self.sockets = []
+
+    def __call__(self, host: str, port: int) -> socket.socket:
+        self.sockets = [s for s in self.sockets if s.fileno() != -1]
+        if len(self.sockets) >= self.max_open:
+            raise OSError(errno.EMFILE, "Too many open files")
+        s = self.open(host, port)
+        self.sockets.append(s)
+        return s
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.listeners = []
+        for _ in range(10):
+            s = socket.socket()
+            s.bind(("127.0.0.1", 0))
+            s.listen(16)
+            self.listeners.append(s)
+        self.live = {("127.0.0.1", s.getsockname()[1]) for s in self.listeners}
+        self.dead = {("127.0.0.1", _closed_port()) for _ in range(5)}
+
+    def tearDown(self):
+        for s in self.listeners:
+            s.close()
+
+    def sweep_limited(self, max_open: int) -> tuple[set, set, list]:
+        failed, errors = set(), []
+        with mock.patch.object(sweep, "_open", LimitedOpen(max_open)):
+            reached = set(connect_sweep(sorted(self.live | self.dead), 1.0, 64, failed, errors.append))
+        return reached, failed, errors
+
+    def test_all_candidates(self):
+        failed = set()
+        self.assertEqual(set(connect_sweep(self.live | self.dead, 1.0, 64, failed)), self.live)
+        self.assertEqual(failed, self.dead)
+
+    def test_local_errors_are_retried(self):
+        reached, failed, errors = self.sweep_limited(3)
+        self.assertEqual(reached, self.live)
+        self.assertEqual(failed, self.dead)
+        self.assertTrue(errors)
+        self.assertTrue(all(ex.errno == errno.EMFILE for ex in errors))
+
+    def test_stops_without_sockets(self):
+        reached, failed, errors = self.sweep_limited(0)
+        self.assertEqual((reached, failed, len(errors)), (set(), set(), 1))
+
+    def test_pool_keeps_untried_candidates(self):
+        pool = ProxyPool(["http://127.0.0.1:9/"], negative_cache=NegativeCache())
+        candidates = [(f"{host}:{port}", None) for host, port in sorted(self.live | self.dead)]
+        with mock.patch.object(sweep, "_open", LimitedOpen(0)):
+            self.assertEqual(list(pool._sweep(candidates)), [])
+        self.assertEqual(len(pool.negative_cache), 0)
+        self.assertEqual(len(pool.cached_proxies), len(candidates))
+        self.assertEqual(pool.metrics.connects.values(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+from array import array
+import threading
+if TYPE_CHECKING:
+    from pool import Proxy
+
+
+class LatencyWindow:
+    """
+    The last `size` latency samples, with percentiles over them.
+    The sorted copy is only rebuilt every `size // 32` samples, so a percentile is O(1) amortized.
+    """
+    __slots__ = ("size", "_samples", "_next", "_sorted", "_stale")
+
+    def __init__(self, size: int = 512):
+        if size < 1:
+            raise ValueError(f"size={size}: must be a positive number.")
+        self.size = size
+        self._samples = array("f")
+        self._next = 0  # where the next sample goes, once the window is full
+        self._sorted: list[float] = []
+        self._stale = 0  # samples added since the sorted copy was made
+
+    def add(self, seconds: float) -> None:
+        if len(self._samples) < self.size:
+            self._samples.append(seconds)
+        else:
+            self._samples[self._next] = seconds
+            self._next = (self._next + 1) % self.size
+        self._stale += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: 0 <= q <= 1
+        :return: the sample below which q of the samples are, 0.0 if there are none
+        """
+        if self._stale > max(1, self.size // 32) or len(self._sorted) < min(len(self._samples), 32):
+            self._sorted = sorted(self._samples)
+            self._stale = 0
+        if not self._sorted:
+            return 0.0
+        return self._sorted[min(int(q * len(self._sorted)), len(self._sorted) - 1)]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class AdaptiveTimeouts:
+    """
+    Connect and read deadlines of the checks, derived from the latencies of the successful ones:
+    a high percentile of the recent latencies over the whole pool, times a margin.
+    Until min_samples latencies are known, the configured timeouts are used.
+    A proxy, which has already been checked successfully, gets deadlines of its own instead,
+    a few times its own average latency, which is much tighter for the fast proxies
+    and still lets the known slow ones through.
+    All the deadlines are kept within [min_timeout, max_*_timeout].
+    """
+    connect_timeout: float
+    read_timeout: float
+    max_connect_timeout: float
+    max_read_timeout: float
+    adaptive: bool
+
+    def __init__(self, connect_timeout: float, read_timeout: float,
+                 max_connect_timeout: Optional[float] = None, max_read_timeout: Optional[float] = None,
+                 adaptive: bool = True, percentile: float = 0.95, margin: float = 1.5, slack: float = 0.1,
+                 known_factor: float = 3.0, alpha: float = 0.3, min_timeout: float = 0.1,
+                 min_samples: int = 20, window: int = 512):
+        """
+        :param connect_timeout: connect deadline, while the latencies are unknown
+        :param read_timeout: read deadline, while the latencies are unknown
+        :param max_connect_timeout: upper bound of the adaptive connect deadline (2 * connect_timeout by default)
+        :param max_read_timeout: upper bound of the adaptive read deadline (2 * read_timeout by default)
+        :param adaptive: False keeps the configured timeouts
+        :param percentile: percentile of the pool-wide latencies, which the deadlines are based on
+        :param margin: the percentile is multiplied by it
+        :param slack: seconds added to every adaptive deadline (the latencies of the fast proxies are jittery)
+        :param known_factor: the deadline of a known proxy is its average latency multiplied by it
+        :param alpha: EWMA smoothing factor of the latencies of a proxy
+        :param min_timeout: lower bound of every deadline
+        :param min_samples: number of pool-wide samples needed to adapt
+        :param window: number of the latest pool-wide samples kept
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connect_timeout = 2 * connect_timeout if max_connect_timeout is None else max_connect_timeout
+        self.max_read_timeout = 2 * read_timeout if max_read_timeout is None else max_read_timeout
+        self.adaptive = adaptive
+        self.percentile = percentile
+        self.margin = margin
+        self.slack = slack
+        self.known_factor = known_factor
+        self.alpha = alpha
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self._connects = LatencyWindow(window)
+        self._reads = LatencyWindow(window)
+        self._lock = threading.Lock()
+
+    def observe_connect(self, seconds: float, proxy: Optional[Proxy] = None) -> None:
+        with self._lock:
+            self._connects.add(seconds)
+        if proxy is not None:
+            proxy._connect_latency = self._smooth(proxy._connect_latency, seconds)
+
+    def observe_read(self, seconds: float, proxy: Optional[Proxy] = None) -> None:
+        with self._lock:
+            self._reads.add(seconds)
+        if proxy is not None:
+            proxy._read_latency = self._smooth(proxy._read_latency, seconds)
+
+    def observe_handshake(self, seconds: float, proxy: Proxy) -> None:
+        # no deadline is derived from these, the handshake exchanges are bounded by the read deadline
+        proxy._handshake_latency = self._smooth(proxy._handshake_latency, seconds)
+
+    def _smooth(self, average: float, seconds: float) -> float:
+        return seconds if not average else average + self.alpha * (seconds - average)
+
+    def _deadline(self, samples: LatencyWindow, own: float, default: float, upper: float) -> float:
+        if not self.adaptive:
+            return default
+        if own:
+            deadline = self.known_factor * own + self.slack
+        else:
+            with self._lock:
+                if len(samples) < self.min_samples:
+                    return default
+                deadline = self.margin * samples.percentile(self.percentile) + self.slack
+        return min(max(deadline, self.min_timeout), upper)
+
+    def connect(self, proxy: Optional[Proxy] = None) -> float:
+        """
+        :return: deadline of the connection to the proxy (seconds)
+        """
+        own = proxy._connect_latency if proxy is not None else 0.0
+        return self._deadline(self._connects, own, self.connect_timeout, self.max_connect_timeout)
+
+    def read(self, proxy: Optional[Proxy] = None) -> float:
+        """
+        :return: deadline of the response through the proxy (seconds)
+        """
+        own = proxy._read_latency if proxy is not None else 0.0
+        return self._deadline(self._reads, own, self.read_timeout, self.max_read_timeout)
+
+    def request(self, proxy: Optional[Proxy] = None) -> tuple[float, float]:
+        """
+        :return: (connect, read) timeout pair, as requests takes it
+        """
+        return self.connect(proxy), self.read(proxy)